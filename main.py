@@ -1,11 +1,22 @@
+import sys
 import functools
-from typing import Callable
+from typing import Callable, List, Tuple
 
 import click
 
 from src.benchmark import benchmark_runner
+from src.soak import soak_runner
+from src.calibrate import calibrate_runner
 from src.visualize import make_visualization
-from src.constants import STEPS, N_STEPS_DEFAULT, THREADS_DEFAULT
+from src.compare import compare_reports
+from src.metrics import resolve_request_log, aggregate_request_log, print_aggregates
+from src.constants import (
+    STEPS, N_STEPS_DEFAULT, THREADS_DEFAULT, N_TRIALS_DEFAULT, COMPARE_THRESHOLD_DEFAULT, COMPARE_ALPHA_DEFAULT,
+    TIMEOUT_CONNECT_DEFAULT, TIMEOUT_READ_DEFAULT, RETRIES_DEFAULT, BACKOFF_DEFAULT, SWEEP_LIST_SIZES_DEFAULT,
+    MANIFEST_SERVER_LATENCY_DEFAULT, MANIFEST_SERVER_SEED_DEFAULT, DISTRIBUTION_DEFAULT, COLD_CACHE_COMMAND_DEFAULT,
+    SOAK_DURATION_DEFAULT, SOAK_WINDOW_DEFAULT, SOAK_CONCURRENCY_DEFAULT, SAS_FANOUT_DEFAULT,
+    CALIBRATE_N_CALL, CALIBRATE_N_CANVAS, N_ANNOTATIONS_PER_CANVAS
+)
 
 def common_options(func: Callable) -> Callable:
     """
@@ -23,6 +34,18 @@ def common_options(func: Callable) -> Callable:
         return func(*args, **kwargs)
     return wrapper
 
+def parse_int_list(value: str) -> List[int]:
+    """parse a comma-separated list of integers, i.e. `10,100,1000`"""
+    return [ int(v.strip()) for v in value.split(",") if v.strip() ]
+
+def parse_pipeline(value: str) -> Tuple[int, int]:
+    """parse the sizes of the stages of a pipeline, i.e. `4:16` (4 producers, 16 senders)"""
+    try:
+        producers, senders = [ int(v.strip()) for v in value.split(":") ]
+    except ValueError:
+        raise click.BadParameter(f"expected '<producers>:<senders>', got '{value}'")
+    return producers, senders
+
 @click.group()
 def cli():
     """
@@ -44,22 +67,196 @@ def cli():
     "-s", "--steps",
     type=int,
     required=False,
-    default=N_STEPS_DEFAULT,
-    help=f"number of step groups to run (in range (1..{len(STEPS)+1}))"
+    default=None,
+    help=f"number of step groups to run (in range (1..{len(STEPS)}), default={N_STEPS_DEFAULT}). with --scenario, default to all steps of the scenario"
 )
 @click.option(
     "-t", "--threads",
     type=int,
     required=False,
-    default=THREADS_DEFAULT,
-    help=f"number of threads to use when populating database (default={THREADS_DEFAULT})"
+    default=None,
+    help=f"number of threads to use when populating database (default: the scenario's value, or {THREADS_DEFAULT})"
+)
+@click.option(
+    "-k", "--trials",
+    type=int,
+    required=False,
+    default=None,
+    help=f"number of times the benchmark phase is repeated on the same populated database, to measure variance (default: the scenario's value, or {N_TRIALS_DEFAULT})"
+)
+@click.option(
+    "-p", "--profile-client",
+    type=click.BOOL,
+    is_flag=True,
+    default=False,
+    help="profile the benchmark client (not the annotation server) and print a per-phase breakdown of its CPU time. profiles are saved next to the report"
+)
+@click.option(
+    "-m", "--metrics-port",
+    type=int,
+    required=False,
+    default=None,
+    help="if set, serve live metrics (ops/sec, latency percentiles, error rates, current step and phase) in Prometheus text format on http://127.0.0.1:<metrics-port>/metrics"
+)
+@click.option(
+    "--connect-timeout",
+    type=float,
+    required=False,
+    default=TIMEOUT_CONNECT_DEFAULT,
+    help=f"max time (in seconds) to connect to the annotation server (default={TIMEOUT_CONNECT_DEFAULT})"
+)
+@click.option(
+    "--read-timeout",
+    type=float,
+    required=False,
+    default=TIMEOUT_READ_DEFAULT,
+    help=f"max time (in seconds) to wait for a response from the annotation server (default={TIMEOUT_READ_DEFAULT})"
+)
+@click.option(
+    "--retries",
+    type=int,
+    required=False,
+    default=RETRIES_DEFAULT,
+    help=f"max number of times a failed request is retried. POST requests are only retried if they could not be sent (default={RETRIES_DEFAULT})"
+)
+@click.option(
+    "--backoff",
+    type=float,
+    required=False,
+    default=BACKOFF_DEFAULT,
+    help=f"time (in seconds) to wait before retrying a failed request, doubled at each retry (default={BACKOFF_DEFAULT})"
+)
+@click.option(
+    "-w", "--sweep",
+    type=click.STRING,
+    required=False,
+    default=None,
+    is_flag=False,
+    flag_value=",".join(str(n) for n in SWEEP_LIST_SIZES_DEFAULT),
+    help=f"run an annotation list size sweep at the last step, instead of the benchmark phase. optionally, comma-separated list sizes (default: the scenario's sweep sizes, or {','.join(str(n) for n in SWEEP_LIST_SIZES_DEFAULT)})"
+)
+@click.option(
+    "--manifest-server",
+    type=int,
+    required=False,
+    default=None,
+    help="if set, serve the generated manifests on http://127.0.0.1:<manifest-server>, so that the annotation server fetches real manifests when inserting annotations"
+)
+@click.option(
+    "--manifest-latency",
+    type=float,
+    required=False,
+    default=MANIFEST_SERVER_LATENCY_DEFAULT,
+    help=f"with --manifest-server, artificial latency (in seconds) added to each manifest response (default={MANIFEST_SERVER_LATENCY_DEFAULT})"
+)
+@click.option(
+    "--manifest-seed",
+    type=int,
+    required=False,
+    default=MANIFEST_SERVER_SEED_DEFAULT,
+    help=f"with --manifest-server, seed of the generated canvases (default={MANIFEST_SERVER_SEED_DEFAULT})"
+)
+@click.option(
+    "-d", "--distribution",
+    type=click.STRING,
+    required=False,
+    default=None,
+    help=f"how canvases, annotations and manifests are picked in the benchmark phase: 'uniform', 'zipf:<s>' (i.e., zipf:1.1) or 'hotspot:<x>:<y>' (a share x of requests on a share y of keys, i.e. hotspot:0.9:0.1) (default: the scenario's value, or {DISTRIBUTION_DEFAULT})"
+)
+@click.option(
+    "-c", "--scenario",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False,
+    default=None,
+    help="path to a scenario file (.toml or .json) defining steps, ratio, iterations, threads, trials, phases, key distribution and sweep sizes. options given on the command line override the matching values of the scenario"
+)
+@click.option(
+    "--cold-cache",
+    type=int,
+    required=False,
+    default=None,
+    help="if set, restart the database and drop the OS page cache before each read phase, and time the first <cold-cache> reads apart from the others. the database must run locally"
+)
+@click.option(
+    "--cold-cache-command",
+    type=click.STRING,
+    required=False,
+    default=COLD_CACHE_COMMAND_DEFAULT,
+    help=f"with --cold-cache, shell command that restarts the database (and optionally the annotation server) (default='{COLD_CACHE_COMMAND_DEFAULT}')"
+)
+@click.option(
+    "--autotune",
+    is_flag=True,
+    default=False,
+    help="at each populate, probe the insert throughput with an increasing number of threads on the first inserts, and insert the rest with the best number of threads. --threads is still used to purge the database"
+)
+@click.option(
+    "--adaptive",
+    is_flag=True,
+    default=False,
+    help="when populating and purging, adapt the number of requests in flight to the latency and errors of the server (AIMD), up to --threads. the trajectory of the limit is saved in the report. can't be used with --autotune"
+)
+@click.option(
+    "--pipeline",
+    type=click.STRING,
+    required=False,
+    default=None,
+    help="insert annotations with a pipeline of '<producers>:<senders>' threads (i.e., 4:16): producers generate and serialize annotation lists, senders only send them. the utilization of each stage is saved in the report. aiiinotate only. can't be used with --autotune"
+)
+@click.option(
+    "--sas-fanout",
+    type=int,
+    required=False,
+    default=SAS_FANOUT_DEFAULT,
+    help=f"with SAS, which has no bulk routes, number of threads that insert and delete the annotations of lists concurrently. 1 to insert and delete annotations one by one (default={SAS_FANOUT_DEFAULT})"
+)
+@click.option(
+    "--db-latency",
+    is_flag=True,
+    default=False,
+    help="aiiinotate only: after each call of the benchmark phase, run the equivalent MongoDB query on the same key, to compare the HTTP latency, the database latency and aiiinotate's overhead. requires pymongo (`uv sync --extra db`)"
+)
+@click.option(
+    "--compression",
+    type=click.Choice(["none", "gzip", "deflate"]),
+    required=False,
+    default="none",
+    help="compress request bodies with gzip or deflate, and accept compressed responses. with 'none', uncompressed responses are requested. bytes on the wire and client CPU time per operation are saved in the report (default=none)"
+)
+@click.option(
+    "--no-decode",
+    is_flag=True,
+    default=False,
+    help="don't decode the responses of the benchmark phase that aren't inspected (searches on manifests), to measure the latency without the client's JSON decoding"
 )
 @common_options
 def benchmark(
     server: str,
     endpoint: str,
-    steps: int,
-    threads: int,
+    steps: int|None,
+    threads: int|None,
+    trials: int|None,
+    profile_client: bool,
+    metrics_port: int|None,
+    connect_timeout: float,
+    read_timeout: float,
+    retries: int,
+    backoff: float,
+    sweep: str|None,
+    manifest_server: int|None,
+    manifest_latency: float,
+    manifest_seed: int,
+    distribution: str|None,
+    scenario: str|None,
+    cold_cache: int|None,
+    cold_cache_command: str,
+    autotune: bool,
+    adaptive: bool,
+    pipeline: str|None,
+    sas_fanout: int,
+    db_latency: bool,
+    compression: str,
+    no_decode: bool,
     nowrite: bool,
 ):
     """
@@ -70,6 +267,167 @@ def benchmark(
         endpoint=endpoint,
         n_steps=steps,
         threads=threads,
+        trials=trials,
+        profile_client=profile_client,
+        metrics_port=metrics_port,
+        timeout_connect=connect_timeout,
+        timeout_read=read_timeout,
+        retries=retries,
+        backoff=backoff,
+        sweep=parse_int_list(sweep) if sweep is not None else None,
+        manifest_server_port=manifest_server,
+        manifest_server_latency=manifest_latency,
+        manifest_server_seed=manifest_seed,
+        distribution=distribution,
+        scenario=scenario,
+        cold_cache=cold_cache,
+        cold_cache_command=cold_cache_command,
+        autotune=autotune,
+        adaptive=adaptive,
+        pipeline=parse_pipeline(pipeline) if pipeline is not None else None,
+        sas_fanout=sas_fanout,
+        db_latency=db_latency,
+        compression=compression if compression != "none" else None,
+        decode=not no_decode,
+        nowrite=nowrite
+    )
+
+@cli.command()
+@click.argument(
+    "server",
+    type=click.STRING,
+    required=True,
+)
+@click.option(
+    "-e", "--endpoint",
+    type=click.STRING,
+    help="the endpoint on which the annotation server is listening (including http(s) scheme and port, if needed)"
+)
+@click.option(
+    "-s", "--step",
+    type=int,
+    required=False,
+    default=N_STEPS_DEFAULT,
+    help=f"the step whose database is populated before the soak test (in range (1..{len(STEPS)}), default={N_STEPS_DEFAULT})"
+)
+@click.option(
+    "-t", "--threads",
+    type=int,
+    required=False,
+    default=THREADS_DEFAULT,
+    help=f"number of threads to use when populating database (default={THREADS_DEFAULT})"
+)
+@click.option(
+    "-D", "--duration",
+    type=float,
+    required=False,
+    default=SOAK_DURATION_DEFAULT,
+    help=f"duration of the soak test, in seconds, excluding the populate phase (default={SOAK_DURATION_DEFAULT})"
+)
+@click.option(
+    "-W", "--window",
+    type=float,
+    required=False,
+    default=SOAK_WINDOW_DEFAULT,
+    help=f"duration of the windows over which latency, throughput and memory are measured, in seconds (default={SOAK_WINDOW_DEFAULT})"
+)
+@click.option(
+    "-C", "--concurrency",
+    type=int,
+    required=False,
+    default=SOAK_CONCURRENCY_DEFAULT,
+    help=f"number of threads sending requests during the soak test (default={SOAK_CONCURRENCY_DEFAULT})"
+)
+@click.option(
+    "-d", "--distribution",
+    type=click.STRING,
+    required=False,
+    default=DISTRIBUTION_DEFAULT,
+    help=f"how canvases and manifests are picked: 'uniform', 'zipf:<s>' or 'hotspot:<x>:<y>' (default={DISTRIBUTION_DEFAULT})"
+)
+@click.option(
+    "-a", "--alpha",
+    type=float,
+    default=COMPARE_ALPHA_DEFAULT,
+    help=f"significance level of the trend tests (default={COMPARE_ALPHA_DEFAULT})"
+)
+@click.option(
+    "-m", "--metrics-port",
+    type=int,
+    required=False,
+    default=None,
+    help="if set, serve live metrics in Prometheus text format on http://127.0.0.1:<metrics-port>/metrics"
+)
+@common_options
+def soak(
+    server: str,
+    endpoint: str,
+    step: int,
+    threads: int,
+    duration: float,
+    window: float,
+    concurrency: int,
+    distribution: str,
+    alpha: float,
+    metrics_port: int|None,
+    nowrite: bool,
+):
+    """
+    run a steady mixed workload on a populated database for a long time, and detect degradations of latency, throughput and memory
+    """
+    soak_runner(
+        server=server,
+        endpoint=endpoint,
+        n_steps=step,
+        threads=threads,
+        duration=duration,
+        window=window,
+        concurrency=concurrency,
+        distribution=distribution,
+        alpha=alpha,
+        metrics_port=metrics_port,
+        nowrite=nowrite
+    )
+
+@cli.command()
+@click.option(
+    "-t", "--threads",
+    type=int,
+    required=False,
+    default=THREADS_DEFAULT,
+    help=f"number of threads used to measure the max throughput (default={THREADS_DEFAULT})"
+)
+@click.option(
+    "-N", "--n-call",
+    type=int,
+    required=False,
+    default=CALIBRATE_N_CALL,
+    help=f"number of calls of each operation, with 1 thread and with --threads threads (default={CALIBRATE_N_CALL})"
+)
+@click.option(
+    "--n-canvas",
+    type=int,
+    required=False,
+    default=CALIBRATE_N_CANVAS,
+    help=f"number of canvases per inserted manifest (default={CALIBRATE_N_CANVAS})"
+)
+@click.option(
+    "--n-annotation",
+    type=int,
+    required=False,
+    default=N_ANNOTATIONS_PER_CANVAS,
+    help=f"number of annotations per inserted annotation list (default={N_ANNOTATIONS_PER_CANVAS})"
+)
+@common_options
+def calibrate(threads: int, n_call: int, n_canvas: int, n_annotation: int, nowrite: bool):
+    """
+    measure the max throughput and baseline latency of the benchmark client, against an in-process null annotation server
+    """
+    calibrate_runner(
+        threads=threads,
+        n_call=n_call,
+        n_canvas=n_canvas,
+        n_annotation=n_annotation,
         nowrite=nowrite
     )
 
@@ -96,6 +454,61 @@ def visualize(report_file: str, annotations_only, nowrite: bool):
     """
     make_visualization(report_file, annotations_only, nowrite)
 
+@cli.command()
+@click.argument(
+    "report_files",
+    type=click.STRING,
+    nargs=-1,
+    required=True
+)
+@click.option(
+    "-r", "--threshold",
+    type=float,
+    default=COMPARE_THRESHOLD_DEFAULT,
+    help=f"relative slowdown above which a metric is a regression (default={COMPARE_THRESHOLD_DEFAULT}, i.e. {COMPARE_THRESHOLD_DEFAULT:.0%})"
+)
+@click.option(
+    "-a", "--alpha",
+    type=float,
+    default=COMPARE_ALPHA_DEFAULT,
+    help=f"significance level of statistical tests, used when reports contain several trials (default={COMPARE_ALPHA_DEFAULT})"
+)
+def compare(report_files: tuple[str], threshold: float, alpha: float):
+    """
+    compare 2 or more benchmark reports and exit with a non-zero status if a regression is found.
+    the 1st report is the baseline, and all other reports are compared to it.
+    each argument in report_files can be either:
+    - "latest": the latest report generated
+    - the path to a report file
+    """
+    n_regression = compare_reports(list(report_files), threshold, alpha)
+    if n_regression > 0:
+        sys.exit(1)
+
+@cli.command()
+@click.argument(
+    "request_log",
+    type=click.STRING,
+    required=True
+)
+@click.option(
+    "-g", "--group-by",
+    type=click.STRING,
+    default="step,phase,op",
+    help="comma-separated record keys to group requests by (default=step,phase,op). available keys: op, step, phase, trial, status, ok, outcome, key_class, worker"
+)
+def aggregate(request_log: str, group_by: str):
+    """
+    rebuild aggregates (count, errors, latency percentiles, bytes) from the request log of a benchmark.
+    argument request_log can be either:
+    - "latest": the request log of the latest report generated
+    - the path to a report file
+    - the path to a request log
+    """
+    group_by_keys = tuple(k.strip() for k in group_by.split(","))
+    aggregates = aggregate_request_log(resolve_request_log(request_log), group_by_keys)
+    print_aggregates(aggregates, group_by_keys)
+
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
@@ -35,5 +35,13 @@ sudo systemctl start mongod;
 cd "$AIIINOTATE_DIR";
 # apply migrations and indexes, v. important to have realistic performance.
 npm run aiiinotate -- migrate apply;
+# when profiling, record when the server starts, so that client profiles
+# (`main.py benchmark --profile-client`) can be located in the server's profile.
+if [ "$PROFILING" != "" ];
+then
+    mkdir -p "$SCRIPT_DIR/out";
+    echo "{\"mode\": \"$PROFILING\", \"started_at\": $(date +%s.%N), \"profile_dir\": \"$AIIINOTATE_DIR\"}" > "$SCRIPT_DIR/out/server_profile.json";
+else rm -f "$SCRIPT_DIR/out/server_profile.json";
+fi;
 # run the app (with clinic profiling)
 npm run $aiiinotate_cmd -- serve prod;
@@ -5,10 +5,11 @@ from pathlib import Path
 import subprocess
 import os
 
+import orjson
 import requests
 from dotenv import load_dotenv
 
-from src.adapter_core import AdapterCore
+from src.adapter_core import AdapterCore, check_status
 from src.utils import pprint, get_manifest_short_id, get_canvas_ids, json_dumps, run_bash
 from src.mongosh import run_mongosh_command
 
@@ -16,8 +17,8 @@ from src.mongosh import run_mongosh_command
 
 
 class AdapterAiiinotate(AdapterCore):
-    def __init__(self, endpoint):
-        super().__init__(endpoint)
+    def __init__(self, endpoint, **kwargs):
+        super().__init__(endpoint, **kwargs)
         return
 
     @property
@@ -26,11 +27,12 @@ class AdapterAiiinotate(AdapterCore):
 
     def insert_manifest(self, manifest: Dict) -> List[Optional[str]]:
         """insert a single manifest"""
-        r = requests.post(
+        r = self.request(
+            "post",
             f"{self.endpoint}/manifests/2/create",
             json=manifest
         )
-        r_data = r.json()
+        r_data = self.decode(r)
         # returns list of canvas ids if the manifest has been inserted, `[]` otherwise.
         return (
             get_canvas_ids(manifest)
@@ -41,11 +43,12 @@ class AdapterAiiinotate(AdapterCore):
 
     def insert_annotation(self, annotation:Dict):
         """insert a single annotation"""
-        r = requests.post(
-            f"{self.endpoint}/annotations/2/create",
-            json=annotation
-        )
-        r_json = r.json()
+        return self.insert_annotation_bytes(orjson.dumps(annotation))
+
+    def insert_annotation_bytes(self, body: bytes):
+        """insert a single annotation that is already serialized to JSON"""
+        r = self.post_json(f"{self.endpoint}/annotations/2/create", body)
+        r_json = self.decode(r)
         if "insertedIds" in r_json and len(r_json["insertedIds"]):
             return 1
         else:
@@ -53,61 +56,95 @@ class AdapterAiiinotate(AdapterCore):
 
     def insert_annotation_list(self, annotation_list: Dict):
         """insert an AnnotationList"""
-        r = requests.post(
-            f"{self.endpoint}/annotations/2/createMany",
-            json=annotation_list
-        )
-        r_json = r.json()
+        return self.insert_annotation_list_bytes(orjson.dumps(annotation_list))
+
+    def insert_annotation_list_bytes(self, body: bytes):
+        """insert an AnnotationList that is already serialized to JSON"""
+        r = self.post_json(f"{self.endpoint}/annotations/2/createMany", body)
+        r_json = self.decode(r)
         if "insertedIds" in r_json and len(r_json["insertedIds"]):
             return 1
         else:
             return 0
 
-    # TODO delete ?
-    def get_manifest(self):
-        """read a single manifest"""
-        raise NotImplementedError("AdapterCore.get_manifest")
+    def get_manifest(self, id_manifest: str) -> Dict:
+        """
+        read a single manifest, as it is served by aiiinotate
+
+        :param id_manifest: the manifest's "@id"
+        """
+        id_manifest = get_manifest_short_id(id_manifest)
+        r = self.request("get", f"{self.endpoint}/data/2/{quote_plus(id_manifest)}/manifest.json")
+        check_status(r)
+        return self.decode(r)
 
     def get_annotation(self, id_annotation:str):
-        r = requests.get(id_annotation)
-        assert r.status_code == 200
-        return r.json()
+        r = self.request("get", id_annotation)
+        check_status(r)
+        return self.decode(r)
 
     def get_manifest_collection(self) -> Dict:
         """return the collection of manifests"""
-        r = requests.get(f"{self.endpoint}/manifests/2")
-        return r.json()
+        r = self.request("get", f"{self.endpoint}/manifests/2")
+        return self.decode(r)
+
+    def list_manifest_collection(self) -> Dict:
+        """list the whole collection of manifests, without holding it in memory"""
+        return self.scan_collection(f"{self.endpoint}/manifests/2")
+
+    def get_annotation_list(self, id_canvas:str, decode: bool = True):
+        """
+        read annotations into an annotationList ('search' route ?)
 
-    def get_annotation_list(self, id_canvas:str):
-        """read annotations into an annotationList ('search' route ?)"""
-        r = requests.get(f"{self.endpoint}/annotations/2/search?canvasUri={quote_plus(id_canvas)}")
-        assert r.status_code == 200
-        return r.json()
+        :param decode: if False, return the raw response body
+        """
+        r = self.request("get", f"{self.endpoint}/annotations/2/search?canvasUri={quote_plus(id_canvas)}")
+        check_status(r)
+        return self.decode(r) if decode else r.content
+
+    def search(self, id_manifest: str, decode: bool = True) -> Dict|bytes:
+        """
+        search all annotations on a manifest, using the IIIF Search API (v1, for IIIF presentation 2.x)
+
+        :param id_manifest: the manifest's "@id"
+        :param decode: if False, return the raw response body
+        :returns: an AnnotationList
+        """
+        id_manifest = get_manifest_short_id(id_manifest)
+        r = self.request("get", f"{self.endpoint}/search-api/1/manifests/{quote_plus(id_manifest)}/search")
+        check_status(r)
+        return self.decode(r) if decode else r.content
+
+    def delete_manifest(self, id_manifest: str) -> int:
+        """
+        delete a manifest
 
-    def delete_manifest(self, id_manifest: str):
-        """delete a manifest"""
-        r = requests.delete(f"{self.endpoint}/manifests/2/delete?uri={quote_plus(id_manifest)}")
-        return 1 if r.json()["deletedCount"] > 0 else 0
+        :returns: the number of deleted manifests
+        """
+        r = self.request("delete", f"{self.endpoint}/manifests/2/delete?uri={quote_plus(id_manifest)}")
+        return self.decode(r)["deletedCount"]
 
     def delete_annotation(self, id_annotation: str):
         """delete an annotation"""
-        r = requests.delete(f"{self.endpoint}/annotations/2/delete?uri={id_annotation}")
-        return 1 if r.json()["deletedCount"] > 0 else 0
+        r = self.request("delete", f"{self.endpoint}/annotations/2/delete?uri={id_annotation}")
+        return 1 if self.decode(r)["deletedCount"] > 0 else 0
 
-    def delete_annotations_for_manifest(self, id_manifest: str):
+    def delete_annotations_for_manifest(self, id_manifest: str) -> int:
         """
         :param id_manifest: the manifest's "@id"
+        :returns: the number of deleted annotations
         """
         id_manifest = get_manifest_short_id(id_manifest)
-        r = requests.delete(f"{self.endpoint}/annotations/2/delete?manifestShortId={quote_plus(id_manifest)}")
-        return 1 if r.json()["deletedCount"] > 0 else 0
+        r = self.request("delete", f"{self.endpoint}/annotations/2/delete?manifestShortId={quote_plus(id_manifest)}")
+        return self.decode(r)["deletedCount"]
 
     def update_annotation(self, annotation: Dict):
-        r = requests.post(
-            f"{self.endpoint}/annotations/2/update",
-            json=annotation
-        )
-        return 1 if r.json()["modifiedCount"] > 1 else 0
+        return self.update_annotation_bytes(orjson.dumps(annotation))
+
+    def update_annotation_bytes(self, body: bytes):
+        """update an annotation that is already serialized to JSON"""
+        r = self.post_json(f"{self.endpoint}/annotations/2/update", body)
+        return 1 if self.decode(r)["modifiedCount"] > 0 else 0
 
     def update_manifest(self, id_manifest):
         """update an annotation"""
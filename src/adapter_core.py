@@ -1,40 +1,244 @@
 import re
-from typing import Dict, List, Tuple
+import gzip
+import zlib
+import time
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+import orjson
 import requests
 
+from src.constants import TIMEOUT_CONNECT_DEFAULT, TIMEOUT_READ_DEFAULT, RETRIES_DEFAULT, BACKOFF_DEFAULT, STREAM_CHUNK_SIZE, COMPRESSION_LEVEL
 
-def validate_endpoint(endpoint: str) -> str:
+
+class UnexpectedStatus(requests.exceptions.HTTPError):
+    """raised by adapter methods when the annotation server answers with an unexpected status code"""
+
+
+# exceptions raised by adapter methods when a request fails or when the annotation
+# server sends an unexpected response (an unexpected status, or an error page instead
+# of JSON). other exceptions are bugs of the client, and are not caught.
+ADAPTER_ERRORS = (requests.exceptions.RequestException, orjson.JSONDecodeError)
+
+# methods that can safely be sent again if a request fails after being sent.
+IDEMPOTENT_METHODS = ["get", "delete", "head", "options"]
+
+# content codings that can be used to compress request bodies (see `AdapterCore.request`).
+# "deflate" is zlib-wrapped deflate, as defined by HTTP.
+COMPRESSIONS = {
+    "gzip": lambda body: gzip.compress(body, compresslevel=COMPRESSION_LEVEL, mtime=0),
+    "deflate": lambda body: zlib.compress(body, COMPRESSION_LEVEL),
+}
+
+# in a streamed manifest collection, a member is counted each time its type appears,
+# and the URLs of the first and next pages (for paged collections) are found with regexes.
+MANIFEST_TYPE = b'"sc:Manifest"'
+PAGE_REGEX = {
+    key: re.compile(rb'"' + key.encode() + rb'"\s*:\s*(?:\{\s*"@id"\s*:\s*)?"([^"]+)"')
+    for key in ["first", "next"]
+}
+
+# statistics on the HTTP responses received by the current thread since the
+# last call to `reset_response_stats`. read by `src.metrics.Recorder` to
+# log the status and size of the response(s) of each adapter call.
+_response_stats = threading.local()
+
+def reset_response_stats() -> None:
+    _response_stats.status = None
+    _response_stats.size = 0
+    _response_stats.wire_size = 0
+    _response_stats.request_size = 0
+    _response_stats.n_retry = 0
+
+def merge_response_stats(stats: Dict) -> None:
+    """
+    add the response stats of requests sent by another thread (see `get_response_stats`)
+    to the current thread's, so that they are recorded with the adapter call that sent them.
+    """
+    if stats["status"] is not None:
+        _response_stats.status = stats["status"]
+    _response_stats.size = getattr(_response_stats, "size", 0) + stats["size"]
+    _response_stats.wire_size = getattr(_response_stats, "wire_size", 0) + stats["wire_size"]
+    _response_stats.request_size = getattr(_response_stats, "request_size", 0) + stats["request_size"]
+    _response_stats.n_retry = getattr(_response_stats, "n_retry", 0) + stats["n_retry"]
+
+def get_response_stats() -> Dict:
+    """
+    :returns: {
+        "status": status code of the last response, or None if no response was received
+        "size": total size of the response bodies, in bytes
+        "wire_size": total size of the response bodies as received, before decompression, in bytes
+        "request_size": total size of the request bodies as sent (after compression), in bytes
+        "n_retry": number of requests that were retried
+    }
+    """
+    return {
+        "status": getattr(_response_stats, "status", None),
+        "size": getattr(_response_stats, "size", 0),
+        "wire_size": getattr(_response_stats, "wire_size", 0),
+        "request_size": getattr(_response_stats, "request_size", 0),
+        "n_retry": getattr(_response_stats, "n_retry", 0),
+    }
+
+
+def check_status(r: requests.Response, expected: int = 200) -> None:
+    """raise `UnexpectedStatus` if the status of `r` isn't `expected`"""
+    if r.status_code != expected:
+        raise UnexpectedStatus(f"check_status: expected status {expected}, got {r.status_code} for {r.request.method} {r.url}", response=r)
+
+
+def validate_endpoint(endpoint: str, timeout: Tuple[float, float] = (TIMEOUT_CONNECT_DEFAULT, TIMEOUT_READ_DEFAULT)) -> str:
     endpoint = re.sub("/$", "", endpoint)  # delete trailing "/"
     try:
-        requests.get(endpoint)
-    except requests.exceptions.ConnectionError:
+        requests.get(endpoint, timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         raise ValueError(f"validate_endpoint: failed to connect to endpoint: '{endpoint}'")
     return endpoint
 
 
+def validate_retry_policy(timeout_connect: float, timeout_read: float, retries: int, backoff: float) -> None:
+    for name, value in [("timeout_connect", timeout_connect), ("timeout_read", timeout_read)]:
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"validate_retry_policy: '{name}' must be a number > 0, got {value} (type {type(value)})")
+    if not isinstance(retries, int) or retries < 0:
+        raise ValueError(f"validate_retry_policy: 'retries' must be an integer >= 0, got {retries} (type {type(retries)})")
+    if not isinstance(backoff, (int, float)) or backoff < 0:
+        raise ValueError(f"validate_retry_policy: 'backoff' must be a number >= 0, got {backoff} (type {type(backoff)})")
+
+
+def validate_compression(compression) -> None:
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"validate_compression: 'compression' must be None or one of {list(COMPRESSIONS.keys())}, got {compression}")
+
+
 class AdapterCore:
 
-    def __init__(self, endpoint):
+    def __init__(
+        self,
+        endpoint: str,
+        timeout_connect: float = TIMEOUT_CONNECT_DEFAULT,
+        timeout_read: float = TIMEOUT_READ_DEFAULT,
+        retries: int = RETRIES_DEFAULT,
+        backoff: float = BACKOFF_DEFAULT,
+        compression: str|None = None,
+    ):
         """
         :param endpoint: full endpoint (including the service: 'http://' and port, if on localhost)
+        :param timeout_connect: max time (in seconds) to connect to the server
+        :param timeout_read: max time (in seconds) to wait for the server between 2 bytes of the response
+        :param retries: max number of times a failed request is retried
+        :param backoff: time (in seconds) to wait before the 1st retry. it doubles at each retry.
+        :param compression: if not None, "gzip" or "deflate": request bodies are compressed, and compressed
+            responses are accepted. if None, bodies are sent as is and uncompressed responses are requested.
         """
-        self.endpoint = validate_endpoint(endpoint)
+        validate_retry_policy(timeout_connect, timeout_read, retries, backoff)
+        validate_compression(compression)
+        self.timeout = (timeout_connect, timeout_read)
+        self.retries = retries
+        self.backoff = backoff
+        self.compression = compression
+        self.endpoint = validate_endpoint(endpoint, self.timeout)
         return
 
     @property
     def server_name(self):
         raise NotImplementedError("AdapterCore.server_name")
 
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        send an HTTP request to the annotation server. all adapters must use
+        this method instead of `requests`, so that responses can be measured
+        and so that all requests have the same timeouts and retry policy.
+
+        a request is retried at most `self.retries` times, waiting
+        `self.backoff * 2**attempt` seconds before each retry:
+        - on connection timeouts, for all methods (the request was not sent).
+        - on other connection errors, timeouts and 5xx responses, for idempotent methods only:
+          sending a POST again after it reached the server could insert data twice.
+        when the retries are exhausted, the last exception is raised or the last response is returned.
+
+        with `stream=True`, the body isn't read: the caller must count its size (see `self.scan_collection`).
+
+        `json` bodies are serialized with orjson, which is much faster than the `json` module used by `requests`.
+        with `self.compression`, `json` and `data` bodies are compressed once, before the 1st attempt,
+        and all requests accept compressed responses. otherwise, only uncompressed responses are
+        accepted, so that compression on the server doesn't bias the results.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        headers = { "Accept-Encoding": "identity", **kwargs.pop("headers", {}) }
+        if "json" in kwargs:
+            kwargs["data"] = orjson.dumps(kwargs.pop("json"))
+            headers.setdefault("Content-Type", "application/json")
+        if self.compression is not None:
+            headers["Accept-Encoding"] = ", ".join(COMPRESSIONS.keys())
+            if kwargs.get("data") is not None:
+                headers.setdefault("Content-Type", "application/json")
+                headers["Content-Encoding"] = self.compression
+                kwargs["data"] = COMPRESSIONS[self.compression](kwargs["data"])
+        kwargs["headers"] = headers
+        idempotent = method.lower() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                r = requests.request(method, url, **kwargs)
+                _response_stats.status = r.status_code
+                _response_stats.request_size = getattr(_response_stats, "request_size", 0) + len(r.request.body or b"")
+                if not kwargs.get("stream", False):
+                    _response_stats.size = getattr(_response_stats, "size", 0) + len(r.content)
+                    _response_stats.wire_size = getattr(_response_stats, "wire_size", 0) + r.raw.tell()
+                if r.status_code < 500 or not idempotent or attempt >= self.retries:
+                    return r
+                r.close()
+            except requests.exceptions.ConnectTimeout:
+                if attempt >= self.retries:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or attempt >= self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+            _response_stats.n_retry = getattr(_response_stats, "n_retry", 0) + 1
+
+    def post_json(self, url: str, body: bytes) -> requests.Response:
+        """POST a body that is already serialized to JSON"""
+        return self.request("post", url, data=body, headers={ "Content-Type": "application/json" })
+
+    def decode(self, r: requests.Response) -> Any:
+        """
+        decode a JSON response with orjson, instead of the `json` module used by `r.json()`.
+        error responses (status >= 400) raise `UnexpectedStatus`, instead of being decoded.
+        """
+        if r.status_code >= 400:
+            raise UnexpectedStatus(f"decode: got status {r.status_code} for {r.request.method} {r.url}", response=r)
+        return orjson.loads(r.content)
+
     def insert_manifest(self, manifest: Dict):
         """insert a single manifest"""
         raise NotImplementedError("AdapterCore.insert_manifest")
 
+    def insert_annotation(self, annotation: Dict):
+        """insert a single annotation"""
+        raise NotImplementedError("AdapterCore.insert_annotation")
+
+    def insert_annotation_bytes(self, body: bytes):
+        """
+        insert an annotation that is already serialized to JSON.
+        by default, it is decoded and inserted with `self.insert_annotation`.
+        """
+        return self.insert_annotation(orjson.loads(body))
+
     def insert_annotation_list(self, annotation_list: Dict):
         """insert an AnnotationList"""
         raise NotImplementedError("AdapterCore.insert_annotation_list")
 
-    def get_manifest(self):
+    def insert_annotation_list_bytes(self, body: bytes):
+        """
+        insert an AnnotationList that is already serialized to JSON (see `src.pipeline`).
+        by default, it is decoded and inserted with `self.insert_annotation_list`.
+        """
+        return self.insert_annotation_list(orjson.loads(body))
+
+    def get_manifest(self, id_manifest: str) -> Dict:
         """read a single manifest"""
         raise NotImplementedError("AdapterCore.get_manifest")
 
@@ -42,6 +246,51 @@ class AdapterCore:
         """return the collection of manifests"""
         raise NotImplementedError("AdapterCore.get_manifest_collection")
 
+    def list_manifest_collection(self) -> Dict:
+        """
+        list the whole collection of manifests, without holding it in memory (see `self.scan_collection`)
+        """
+        raise NotImplementedError("AdapterCore.list_manifest_collection")
+
+    def scan_collection(self, url: str) -> Dict:
+        """
+        read a collection of manifests by streaming it: the response is read in
+        chunks of `STREAM_CHUNK_SIZE` bytes, and members are counted without
+        parsing the response, so that memory stays constant even if the
+        collection has millions of members. if the collection is paged,
+        all pages are read, following its `first` link and then the `next` link of each page.
+
+        :param url: URL of the collection (or of its 1st page)
+        :returns: { "n_member", "n_page", "size": total size of the response(s), in bytes }
+        """
+        n_member = 0
+        n_page = 0
+        size = 0
+        next_url: Optional[str] = url
+        seen = set()
+        while next_url is not None and next_url not in seen:
+            seen.add(next_url)
+            r = self.request("get", next_url, stream=True)
+            check_status(r)
+            n_page += 1
+            links: Dict[str, Optional[str]] = { "first": None, "next": None }
+            # keep the end of the previous chunk, so that matches split across 2 chunks
+            # are found. matches entirely within `tail` were already counted.
+            tail = b""
+            with r:
+                for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    _response_stats.size = getattr(_response_stats, "size", 0) + len(chunk)
+                    buffer = tail + chunk
+                    n_member += buffer.count(MANIFEST_TYPE) - tail.count(MANIFEST_TYPE)
+                    for key, regex in PAGE_REGEX.items():
+                        match = regex.search(buffer) if links[key] is None else None
+                        links[key] = match[1].decode("utf-8") if match else links[key]
+                    tail = buffer[-1024:]
+                _response_stats.wire_size = getattr(_response_stats, "wire_size", 0) + r.raw.tell()
+            next_url = links["next"] or links["first"]
+        return { "n_member": n_member, "n_page": n_page, "size": size }
+
     def get_id_manifest_list(self) -> List[str]:
         coll = self.get_manifest_collection()
         return [
@@ -49,25 +298,55 @@ class AdapterCore:
             if m["@type"] == "sc:Manifest"
         ]
 
-    def get_annotation_list(self, id_canvas: str):
-        """read annotations into an annotationList ('search' route ?)"""
+    def get_annotation_list(self, id_canvas: str, decode: bool = True):
+        """
+        read annotations into an annotationList ('search' route ?)
+
+        :param decode: if False, return the raw response body, for callers that don't inspect it
+        """
         raise NotImplementedError("AdapterCore.get_annotation_list")
 
-    def delete_manifest(self, id_manifest: str):
-        """delete an annotation"""
+    def search(self, id_manifest: str, decode: bool = True) -> Dict|bytes:
+        """
+        search all annotations on a manifest, using the IIIF Search API
+
+        :param id_manifest: the manifest's "@id"
+        :param decode: if False, return the raw response body, for callers that don't inspect it
+        :returns: an AnnotationList
+        """
+        raise NotImplementedError("AdapterCore.search")
+
+    def delete_manifest(self, id_manifest: str) -> int:
+        """
+        delete a manifest
+
+        :returns: the number of deleted manifests
+        """
         raise NotImplementedError("AdapterCore.delete_manifest")
 
     def delete_annotation(self, id_annotation: str):
         """delete an annotation"""
         raise NotImplementedError("AdapterCore.delete_annotation")
 
-    def delete_annotations_for_manifest(self, id_manifest: str):
+    def delete_annotations_for_manifest(self, id_manifest: str) -> int|None:
+        """
+        delete all annotations on a manifest
+
+        :returns: the number of deleted annotations (0 for a manifest without annotations), or None if the delete failed
+        """
         raise NotImplementedError("AdapterCore.delete_annotations_for_manifest")
 
     def update_annotation(self, annotation: Dict):
         """update an annotation"""
         raise NotImplementedError("AdapterCore.update_annotation")
 
+    def update_annotation_bytes(self, body: bytes):
+        """
+        update an annotation that is already serialized to JSON.
+        by default, it is decoded and updated with `self.update_annotation`.
+        """
+        return self.update_annotation(orjson.loads(body))
+
     def update_manifest(self, id_manifest):
         """update an annotation"""
         raise NotImplementedError("AdapterCore.update_manifest")
@@ -76,5 +355,9 @@ class AdapterCore:
         """delete all contents from database"""
         raise NotImplementedError("AdapterCore.purge")
 
+    def close(self) -> None:
+        """release the resources held by the adapter"""
+        return
+
 
 
@@ -1,19 +1,72 @@
 from json import JSONDecodeError
-from typing import Dict, List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Optional
 from urllib.parse import quote_plus
 import subprocess
 
+import orjson
 import requests
 
-from src.constants import PATH_ROOT
-from src.adapter_core import AdapterCore
+from src.constants import PATH_ROOT, SAS_FANOUT_DEFAULT
+from src.adapter_core import AdapterCore, ADAPTER_ERRORS, check_status, reset_response_stats, get_response_stats, merge_response_stats
 from src.utils import get_canvas_ids, get_manifest_short_id, pprint
 from src.multithread import mt_delete
+from src.limiter import AimdLimiter
+
+
+def validate_fanout(fanout) -> None:
+    if not isinstance(fanout, int) or fanout < 1:
+        raise ValueError(f"validate_fanout: 'fanout' must be an integer >= 1, got {fanout} (type {type(fanout)})")
 
 
 class AdapterSas(AdapterCore):
-    def __init__(self, endpoint):
-        super().__init__(endpoint)
+    def __init__(self, endpoint, fanout: int = SAS_FANOUT_DEFAULT, **kwargs):
+        """
+        :param fanout: SAS has no bulk routes, so annotations of a list are inserted and deleted one by one.
+            they are sent by a pool of `fanout` threads, shared by all the adapter's callers. 1 = sequentially.
+        """
+        validate_fanout(fanout)
+        super().__init__(endpoint, **kwargs)
+        self.fanout = fanout
+        self.pool = ThreadPoolExecutor(max_workers=fanout, thread_name_prefix="sas_fanout") if fanout > 1 else None
+        return
+
+    def fan_out(self, func: Callable[[Any], Any], items: Iterable) -> List:
+        """
+        call `func` on each of `items` with the adapter's pool, and return the results in order.
+        the response stats of the requests sent by the pool are added to the calling thread's,
+        so that `src.metrics.Recorder` records them with the call that fanned out.
+        if a call fails, its error is raised once all calls are done.
+        """
+        if self.pool is None:
+            return [ func(item) for item in items ]
+
+        def task(item):
+            reset_response_stats()
+            try:
+                return func(item)
+            finally:
+                # the stats are sent back with the result or the error
+                task_stats.append(get_response_stats())
+
+        task_stats: List[Dict] = []
+        futures = [ self.pool.submit(task, item) for item in items ]
+        results = []
+        error = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = error or e
+        for stats in task_stats:
+            merge_response_stats(stats)
+        if error is not None:
+            raise error
+        return results
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
         return
 
     @property
@@ -22,11 +75,12 @@ class AdapterSas(AdapterCore):
 
     def insert_manifest(self, manifest: Dict) -> List[Optional[str]]:
         """insert a single manifest"""
-        r = requests.post(
+        r = self.request(
+            "post",
             f"{self.endpoint}/manifests",
             json=manifest
         )
-        r_json = r.json()  # { loaded: <manifestId> }
+        r_json = self.decode(r)  # { loaded: <manifestId> }
         return (
             get_canvas_ids(manifest)
             if "loaded" in r_json.keys()
@@ -35,12 +89,13 @@ class AdapterSas(AdapterCore):
         )
 
     def insert_annotation(self, annotation:Dict):
-        r = requests.post(
-            f"{self.endpoint}/annotation/create",
-            json=annotation
-        )
+        return self.insert_annotation_bytes(orjson.dumps(annotation))
+
+    def insert_annotation_bytes(self, body: bytes):
+        """insert a single annotation that is already serialized to JSON"""
+        r = self.post_json(f"{self.endpoint}/annotation/create", body)
         try:
-            r_json = r.json()
+            r_json = self.decode(r)
             return 1 if "@id" in r_json.keys() else 0
         except JSONDecodeError:
             return 0
@@ -50,26 +105,48 @@ class AdapterSas(AdapterCore):
         """
         insert an AnnotationList
         in SAS, you can only create annotations from an annotation list through an HTML page... annotations must be inserted manually
-        => we use self.insert_annotations to insert annotations one by one.
+        => we use self.insert_annotations to insert annotations one by one, concurrently (see `self.fan_out`).
+        the list is inserted only if all its annotations are inserted.
         """
-        r_all = []
-        for annotation in annotation_list["resources"]:
-            r_all.append(self.insert_annotation(annotation))
-        return 1 if len(set(r_all)) == 1 and r_all[0] == 1 else 0
+        r_all = self.fan_out(self.insert_annotation, annotation_list["resources"])
+        return 1 if len(r_all) and all(r == 1 for r in r_all) else 0
 
-    def get_manifest(self):
+    # NOTE: this functionnality is not implemented by SAS: manifests are only indexed, not served.
+    def get_manifest(self, id_manifest: str) -> Dict:
         """read a single manifest"""
+        raise NotImplementedError("AdapterSas.get_manifest")
+
+    def list_manifest_collection(self) -> Dict:
+        """list the whole collection of manifests, without holding it in memory"""
+        return self.scan_collection(f"{self.endpoint}/manifests")
 
     def get_manifest_collection(self) -> Dict:
         """return the collection of manifests"""
-        r = requests.get(f"{self.endpoint}/manifests")
-        return r.json()
+        r = self.request("get", f"{self.endpoint}/manifests")
+        return self.decode(r)
 
-    def get_annotation_list(self, id_canvas: str):
-        """read anno  tations into an annotationList ('search' route ?)"""
-        r = requests.get(f"{self.endpoint}/annotation/search?uri={quote_plus(id_canvas)}")
-        assert r.status_code == 200
-        return r.json()
+    def get_annotation_list(self, id_canvas: str, decode: bool = True):
+        """
+        read anno  tations into an annotationList ('search' route ?)
+
+        :param decode: if False, return the raw response body
+        """
+        r = self.request("get", f"{self.endpoint}/annotation/search?uri={quote_plus(id_canvas)}")
+        check_status(r)
+        return self.decode(r) if decode else r.content
+
+    def search(self, id_manifest: str, decode: bool = True) -> Dict|bytes:
+        """
+        search all annotations on a manifest, using the IIIF Search API
+
+        :param id_manifest: the manifest's "@id"
+        :param decode: if False, return the raw response body
+        :returns: an AnnotationList
+        """
+        id_manifest = get_manifest_short_id(id_manifest)
+        r = self.request("get", f"{self.endpoint}/search-api/{quote_plus(id_manifest)}/search")
+        check_status(r)
+        return self.decode(r) if decode else r.content
 
     # NOTE: this functionnality is not implemented by SAS
     def delete_manifest(self, id_manifest: str):
@@ -78,7 +155,7 @@ class AdapterSas(AdapterCore):
 
     def delete_annotation(self, id_annotation: str):
         """delete an annotation"""
-        r = requests.delete(f"{self.endpoint}/annotation/destroy?uri={quote_plus(id_annotation)}")
+        r = self.request("delete", f"{self.endpoint}/annotation/destroy?uri={quote_plus(id_annotation)}")
         if r.status_code == 204:
             return 1
         else:
@@ -89,27 +166,27 @@ class AdapterSas(AdapterCore):
         list_id_annotation = [
             a["@id"] for a in annotation_list["resources"]
         ]
-        r_all = []
-        for id_annotation in list_id_annotation:
-            r_all.append(self.delete_annotation(id_annotation))
-        return 1 if len(set(r_all)) == 1 and r_all[0] == 1 else 0
+        r_all = self.fan_out(self.delete_annotation, list_id_annotation)
+        return 1 if len(r_all) and all(r == 1 for r in r_all) else 0
 
-    def delete_annotations_for_manifest(self, id_manifest:str):
-        id_manifest = get_manifest_short_id(id_manifest)
-        r = requests.get(f"{self.endpoint}/search-api/{quote_plus(id_manifest)}/search")
-        annotation_list = r.json()
-        r_all = []
-        for annotation in annotation_list["resources"]:
-            r_all.append(self.delete_annotation(annotation["@id"]))
-        return 1 if len(set(r_all)) == 1 and r_all[0] == 1 else 0
+    def delete_annotations_for_manifest(self, id_manifest:str) -> int:
+        """
+        SAS can't delete annotations in bulk: search all annotations on the manifest and delete them one by one, concurrently.
+
+        :returns: the number of deleted annotations, or None if an annotation could not be deleted
+        """
+        annotation_list = self.search(id_manifest)
+        r_all = self.fan_out(self.delete_annotation, [ annotation["@id"] for annotation in annotation_list["resources"] ])
+        return sum(r_all) if all(r == 1 for r in r_all) else None
 
     def update_annotation(self, annotation: Dict):
         """update an annotation"""
-        r = requests.post(
-            f"{self.endpoint}/annotation/update",
-            json=annotation
-        )
-        if "@id" in r.json().keys():
+        return self.update_annotation_bytes(orjson.dumps(annotation))
+
+    def update_annotation_bytes(self, body: bytes):
+        """update an annotation that is already serialized to JSON"""
+        r = self.post_json(f"{self.endpoint}/annotation/update", body)
+        if "@id" in self.decode(r).keys():
             return 1
         else:
             return 0
@@ -133,16 +210,27 @@ class AdapterSas(AdapterCore):
         subprocess.run(f"rm -r \"{path_sas_data}\"", shell=True)
         return
 
-    def purge(self, threads:int):  #pyright: ignore
+    def purge(self, threads:int, limiter: Optional[AimdLimiter] = None):  #pyright: ignore
         """
-        delete all contents from the database using
+        delete all contents from the database using `mt_delete`, that deletes the annotations of
+        several manifests at once. the annotations of each manifest are deleted concurrently (see `self.fan_out`).
+
+        :param limiter: optional, adaptive concurrency limiter (see `src.limiter`)
         """
         #NOTE: with SAS, we can't delete manifests, so we just delete annotations.
+        def delete_annotations_for_manifest(id_manifest: str) -> int|None:
+            # a failed request is counted as an error by `mt_delete`, instead of stopping all threads
+            try:
+                return self.delete_annotations_for_manifest(id_manifest)
+            except ADAPTER_ERRORS:
+                return None
+
         list_id_manifest = self.get_id_manifest_list()
         mt_delete(
             data=list_id_manifest,
-            func=self.delete_annotations_for_manifest,
+            func=delete_annotations_for_manifest,
             threads=threads,
+            limiter=limiter,
             pbar_desc=f"deleting all annotations from {len(list_id_manifest)} manifests (threads={threads})"
         )
         return
@@ -0,0 +1,76 @@
+"""
+automatic tuning of the number of threads used to populate the database (`--autotune`).
+
+the best number of threads depends on the server and on the size of the database
+(insert throughput drops as collections grow), so it is tuned at each populate:
+1. the first items are inserted in probes with an increasing number of threads
+   (`AUTOTUNE_CANDIDATES`), and the throughput of each probe is measured.
+2. probing stops when adding threads doesn't increase the throughput anymore,
+   or when the probes have used their share of the items (`AUTOTUNE_BUDGET`).
+3. the knee of the curve is chosen: the smallest number of threads whose throughput
+   is within `AUTOTUNE_TOLERANCE` of the best throughput. the remaining items are
+   inserted with this number of threads.
+"""
+
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Tuple
+
+from src.constants import (
+    AUTOTUNE_CANDIDATES, AUTOTUNE_ITEMS_PER_THREAD, AUTOTUNE_BUDGET,
+    AUTOTUNE_MIN_GAIN, AUTOTUNE_PATIENCE, AUTOTUNE_TOLERANCE
+)
+
+
+def find_knee(curve: List[Dict], tolerance: float = AUTOTUNE_TOLERANCE) -> int|None:
+    """
+    :param curve: the probes, as returned by `autotune`
+    :returns: the smallest number of threads whose throughput is at least `(1-tolerance) * max throughput`
+    """
+    curve = [ probe for probe in curve if probe["throughput"] > 0 ]
+    if not len(curve):
+        return None
+    best = max(probe["throughput"] for probe in curve)
+    return min(probe["threads"] for probe in curve if probe["throughput"] >= (1 - tolerance) * best)
+
+
+def autotune(
+    probe: Callable[[int, int], int],
+    n: int,
+    candidates: List[int] = AUTOTUNE_CANDIDATES,
+) -> Tuple[int|None, List[Dict], int]:
+    """
+    run probes with an increasing number of threads.
+
+    :param probe: function that inserts `n_probe` items with `threads` threads and
+        returns the number of successful inserts: `probe(threads, n_probe)`
+    :param n: total number of items to insert. probes use at most `n * AUTOTUNE_BUDGET` items.
+    :returns:
+        - the chosen number of threads, or None if no probe could be run (too few items, or only errors)
+        - the probe curve: [{ "threads": int, "n": int, "duration": float, "throughput": float }]
+        - the number of items used by the probes
+    """
+    budget = int(n * AUTOTUNE_BUDGET)
+    curve = []
+    n_used = 0
+    best = 0.
+    n_no_gain = 0
+    for threads in candidates:
+        # the number of items grows with the number of threads, so that all threads of a probe have work
+        n_probe = threads * AUTOTUNE_ITEMS_PER_THREAD
+        if n_used + n_probe > budget:
+            break
+        s = timer()
+        success = probe(threads, n_probe)
+        duration = timer() - s
+        n_used += n_probe
+        throughput = success / duration if duration > 0 else 0.
+        curve.append({ "threads": threads, "n": n_probe, "duration": duration, "throughput": throughput })
+        # stop when the throughput stopped increasing for `AUTOTUNE_PATIENCE` probes in a row
+        if throughput > best * (1 + AUTOTUNE_MIN_GAIN):
+            n_no_gain = 0
+        else:
+            n_no_gain += 1
+            if n_no_gain >= AUTOTUNE_PATIENCE:
+                break
+        best = max(best, throughput)
+    return find_knee(curve), curve, n_used
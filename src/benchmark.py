@@ -1,28 +1,45 @@
 import shutil
 import random
+from pathlib import Path
 from itertools import chain
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Tuple, Dict
+from typing import Any, Callable, List, Tuple, Dict
 from timeit import default_timer as timer
 
 from tqdm import tqdm
 
-from src.utils import pprint, write_report, get_manifest_short_id
+from src.utils import pprint, write_report, get_manifest_short_id, get_target_canvas
+from src.stats import describe
+from src.profiling import ClientProfiler
+from src.metrics import Recorder, RequestLog, OperationStats
+from src.exporter import LiveMetrics, serve_live_metrics
+from src.manifest_server import serve_manifests, validate_manifest_server
+from src.distributions import parse_distribution
+from src.scenario import load_scenario, PHASES
+from src.cold_cache import make_cache_cold, validate_cold_cache
+from src.autotune import autotune
+from src.limiter import AimdLimiter
+from src.pipeline import mt_insert_annotations_pipeline, validate_pipeline
+from src.db_latency import DbLatency, attribution, validate_db_latency
 from src.adapter_sas import AdapterSas
 from src.adapter_aiiinotate import AdapterAiiinotate
-from src.adapter_core import AdapterCore, validate_endpoint
+from src.adapter_core import AdapterCore, ADAPTER_ERRORS, validate_endpoint, validate_retry_policy
 from src.multithread import mt_insert_manifests, mt_insert_annotations, mt_delete
-from src.constants import STEPS, N_ITERATIONS, N_STEPS_DEFAULT, N_ANNOTATIONS_PER_CANVAS, THREADS_DEFAULT, RATIO
-from src.generate import generate_annotations, generate_annotation_lists, generate_manifests, mkstr
+from src.constants import (
+    SAS_FANOUT_DEFAULT, STEPS, N_ITERATIONS, N_ITERATIONS_COLLECTION, SWEEP_N_ITERATIONS, N_STEPS_DEFAULT, N_ANNOTATIONS_PER_CANVAS, THREADS_DEFAULT, RATIO, N_TRIALS_DEFAULT, PATH_OUT,
+    TIMEOUT_CONNECT_DEFAULT, TIMEOUT_READ_DEFAULT, RETRIES_DEFAULT, BACKOFF_DEFAULT,
+    MANIFEST_SERVER_LATENCY_DEFAULT, MANIFEST_SERVER_SEED_DEFAULT, DISTRIBUTION_DEFAULT, COLD_CACHE_COMMAND_DEFAULT
+)
+from src.generate import generate_annotations, generate_annotation_lists, generate_manifests, make_manifest_uri, make_canvas_uri, mkstr
 from src.mongosh import mongoshimport_annotations, mongoshimport_manifests
 
 def validate_threads(threads: int|None):
     if not isinstance(threads, int) or threads < 1:
         raise ValueError(f"validate_threads: 'threads' but be an integer >= 1, got {threads} (type {type(threads)})")
 
-def validate_n_steps(n_steps: int):
+def validate_n_steps(n_steps: int, max_: int = len(STEPS)):
     min_ = 1
-    max_ = len(STEPS)
     if (
         (not isinstance(n_steps, int))
         or n_steps < min_
@@ -30,6 +47,19 @@ def validate_n_steps(n_steps: int):
     ):
         raise ValueError(f"validate_n_steps: 'steps' must be an integer, with steps in ({min_}, {max_}), got '{n_steps}'")
 
+def validate_trials(trials: int) -> None:
+    if not isinstance(trials, int) or trials < 1:
+        raise ValueError(f"validate_trials: 'trials' must be an integer >= 1, got {trials} (type {type(trials)})")
+
+def validate_sweep(sweep) -> None:
+    if sweep is not None:
+        if (
+            not isinstance(sweep, list)
+            or not len(sweep)
+            or not all(isinstance(n, int) and n >= 1 for n in sweep)
+        ):
+            raise ValueError(f"validate_sweep: 'sweep' must be None or a non-empty list of integers >= 1, got {sweep}")
+
 def validate_server(server:str) -> None:
     if server not in ["aiiinotate", "sas"]:
         raise TypeError(f"validate_adapter: server '{server}' must be one of ['aiiinotate', 'sas']")
@@ -45,55 +75,245 @@ def validate_nowrite(nowrite) -> None:
     if not isinstance(nowrite, bool):
         raise TypeError(f"validate_nowrite: 'nowrite' must be bool, got {nowrite} (type={type(nowrite)})")
 
+def validate_metrics_port(metrics_port) -> None:
+    if metrics_port is not None:
+        if not isinstance(metrics_port, int) or not (0 < metrics_port < 65536):
+            raise ValueError(f"validate_metrics_port: 'metrics_port' must be None or an integer in range 1..65535, got {metrics_port}")
+
+def validate_autotune(autotune, adaptive) -> None:
+    if not isinstance(autotune, bool) or not isinstance(adaptive, bool):
+        raise TypeError(f"validate_autotune: 'autotune' and 'adaptive' must be booleans, got {type(autotune)} and {type(adaptive)}")
+    if autotune and adaptive:
+        raise ValueError("validate_autotune: 'autotune' and 'adaptive' can't be used together: the limiter would skew the probes")
+
+def validate_profile_client(profile_client) -> None:
+    if not isinstance(profile_client, bool):
+        raise TypeError(f"validate_profile_client: 'profile_client' must be bool, got {profile_client} (type={type(profile_client)})")
+
 class Benchmark:
+    # prefix of the report's name (the report of a sweep is `report_sweep_...`)
+    report_type = "benchmark"
+
     def __init__(
         self,
         endpoint: str,
         server: str,
-        n_steps: int = N_STEPS_DEFAULT,
-        threads: int|None = THREADS_DEFAULT,
+        n_steps: int|None = None,
+        threads: int|None = None,
+        trials: int|None = None,
+        profile_client: bool = False,
+        metrics_port: int|None = None,
+        timeout_connect: float = TIMEOUT_CONNECT_DEFAULT,
+        timeout_read: float = TIMEOUT_READ_DEFAULT,
+        retries: int = RETRIES_DEFAULT,
+        backoff: float = BACKOFF_DEFAULT,
+        sweep: List[int]|None = None,
+        manifest_server_port: int|None = None,
+        manifest_server_latency: float = MANIFEST_SERVER_LATENCY_DEFAULT,
+        manifest_server_seed: int = MANIFEST_SERVER_SEED_DEFAULT,
+        distribution: str|None = None,
+        scenario: str|None = None,
+        cold_cache: int|None = None,
+        cold_cache_command: str = COLD_CACHE_COMMAND_DEFAULT,
+        autotune: bool = False,
+        adaptive: bool = False,
+        pipeline: Tuple[int,int]|None = None,
+        sas_fanout: int = SAS_FANOUT_DEFAULT,
+        db_latency: bool = False,
+        compression: str|None = None,
+        decode: bool = True,
         nowrite: bool = False,
     ):
         """
         view CLI help for info on the arguments.
+
+        :param n_steps: number of steps to run. by default, all steps of the scenario, or `N_STEPS_DEFAULT`.
+        :param threads: by default, the scenario's value, or `THREADS_DEFAULT`. the same goes for `trials`, `sweep` and `distribution`.
+        :param scenario: optional, path to a scenario file (see `src.scenario`). arguments that are not None override its values.
+        :param cold_cache: if not None, make caches cold before each read phase (see `src.cold_cache`) and time the first `cold_cache` reads apart.
+        :param sweep: if not None, run a list-size sweep with lists of these sizes, at the last step only, instead of the benchmark phase.
+        :param distribution: key distribution of the benchmark phase (see `src.distributions.parse_distribution`)
+        :param autotune: if True, tune the number of threads at each populate (see `src.autotune`). `threads` is still used to purge the database.
+        :param adaptive: if True, adapt the number of requests in flight when populating and purging (see `src.limiter`). `threads` is then the max number of requests in flight.
+        :param pipeline: if not None, (producers, senders): insert annotations with a producer/consumer pipeline with this number of threads in each stage (see `src.pipeline`). aiiinotate only.
+        :param sas_fanout: with SAS, number of threads that insert and delete the annotations of lists concurrently (see `AdapterSas.fan_out`).
+        :param db_latency: if True, run the MongoDB query equivalent to each adapter call of the benchmark phase, to attribute latency to the database and to aiiinotate (see `src.db_latency`).
+        :param compression: if not None, "gzip" or "deflate": compress request bodies and accept compressed responses (see `AdapterCore.request`).
+        :param decode: if False, the responses of the benchmark phase that aren't inspected (searches) are not decoded.
         """
-        validate_n_steps(n_steps)
+        # the scenario is validated before anything else, so that errors are caught before connecting to the server
+        scenario_data = load_scenario(scenario) if scenario is not None else {}
+        all_steps = [ tuple(step) for step in scenario_data.get("steps", STEPS) ]
+        if n_steps is None:
+            n_steps = len(all_steps) if "steps" in scenario_data else N_STEPS_DEFAULT
+        # explicit arguments take precedence over the scenario, which takes precedence over the defaults
+        threads = threads if threads is not None else scenario_data.get("threads", THREADS_DEFAULT)
+        trials = trials if trials is not None else scenario_data.get("trials", N_TRIALS_DEFAULT)
+        sweep = sweep if sweep is not None else scenario_data.get("sweep")
+        distribution = distribution if distribution is not None else scenario_data.get("distribution", DISTRIBUTION_DEFAULT)
+
+        validate_n_steps(n_steps, len(all_steps))
         validate_server(server)
-        validate_endpoint(endpoint)
+        validate_retry_policy(timeout_connect, timeout_read, retries, backoff)
+        validate_endpoint(endpoint, (timeout_connect, timeout_read))
         validate_threads(threads)
+        validate_trials(trials)
         validate_nowrite(nowrite)
+        validate_profile_client(profile_client)
+        validate_metrics_port(metrics_port)
+        validate_sweep(sweep)
+        validate_manifest_server(manifest_server_port, manifest_server_latency)
+        validate_cold_cache(cold_cache, cold_cache_command)
+        validate_autotune(autotune, adaptive)
+        validate_pipeline(pipeline, server == "aiiinotate", autotune)
+        # how canvases, annotations and manifests are picked in the benchmark phase
+        self.key_distribution = parse_distribution(distribution)
 
         adapter: AdapterCore
+        retry_policy = {
+            "timeout_connect": timeout_connect,
+            "timeout_read": timeout_read,
+            "retries": retries,
+            "backoff": backoff,
+        }
         if server == "aiiinotate":
-            adapter = AdapterAiiinotate(endpoint)
+            adapter = AdapterAiiinotate(endpoint, compression=compression, **retry_policy)
         else:
-            adapter = AdapterSas(endpoint)
+            adapter = AdapterSas(endpoint, fanout=sas_fanout, compression=compression, **retry_policy)
 
-        steps = STEPS[:n_steps]
+        steps = all_steps[:n_steps]
 
         self.adapter = adapter
         self.server_name = self.adapter.server_name
         self.server_is_aiiinotate = self.server_name == "aiiinotate"
+        validate_db_latency(db_latency, self.server_is_aiiinotate)
         self.steps = steps
         self.threads = threads
+        self.trials = trials  # number of times the benchmark phase is repeated on the same populated database
         self.nowrite = nowrite
+        self.decode = decode
+        self.sweep_list_sizes = sweep
 
-        self.ratio = RATIO  # annotation-to-canvas ratio
-        self.n_annotation_per_canvas = N_ANNOTATIONS_PER_CANVAS  # number of annotations per canvas, if a canvas has annotations
-        self.n_iterations = N_ITERATIONS  # number of iterations for read benchmarking: we will run read queries n times and then get the average time for a single query.
+        timestamp = datetime.now().strftime(r'%Y-%m-%d-%H:%M:%S')
+        report_type = self.report_type if self.sweep_list_sizes is None else "sweep"
+        self.report_basename = f"report_{report_type}_{self.server_name.lower()}_{timestamp}_{len(self.steps)}steps"
+
+        # profile the python client. profiles are written to a directory next to the report.
+        self.profiler = ClientProfiler(profile_client)
+        if not self.nowrite:
+            self.profiler.set_output_dir(PATH_OUT / f"{self.report_basename}_profile")
+
+        # record every adapter call. `self.operation_stats` aggregates the calls of the
+        # current step to compute timings, and the request log, written next to the
+        # report while the benchmark runs, keeps all calls.
+        self.operation_stats = OperationStats()
+        sinks = [ self.operation_stats ]
+        self.request_log_name = None
+        if not self.nowrite:
+            if not PATH_OUT.exists():
+                PATH_OUT.mkdir()
+            self.request_log_name = f"{self.report_basename}_requests.ndjson"
+            sinks.append(RequestLog(PATH_OUT / self.request_log_name))
+        self.recorder = Recorder(sinks)
+
+        # optionally, time the database queries equivalent to adapter calls, in the same sinks.
+        self.db_latency = DbLatency(self.recorder) if db_latency else None
+
+        # optionally, serve live metrics computed from the same records as the request log.
+        self.metrics_server = None
+        if metrics_port is not None:
+            live_metrics = LiveMetrics(self.recorder)
+            self.recorder.sinks.append(live_metrics)
+            self.metrics_server = serve_live_metrics(live_metrics, metrics_port)
+
+        # optionally, serve the generated manifests, so that the annotation server can fetch them when inserting annotations.
+        self.manifest_server = None
+        manifest_server = None
+        if manifest_server_port is not None:
+            self.manifest_server = serve_manifests(manifest_server_port, manifest_server_latency, manifest_server_seed)
+            manifest_server = {
+                "uri_root": f"http://127.0.0.1:{manifest_server_port}",
+                "latency": manifest_server_latency,
+                "seed": manifest_server_seed,
+            }
+
+        self.ratio = scenario_data.get("ratio", RATIO)  # annotation-to-canvas ratio
+        self.n_annotation_per_canvas = scenario_data.get("n_annotation_per_canvas", N_ANNOTATIONS_PER_CANVAS)  # number of annotations per canvas, if a canvas has annotations
+        self.n_iterations = scenario_data.get("n_iterations", N_ITERATIONS)  # number of iterations for read benchmarking: we will run read queries n times and then get the average time for a single query.
+        self.n_iterations_collection = scenario_data.get("n_iterations_collection", N_ITERATIONS_COLLECTION)  # number of times the manifest collection is listed in each trial
+        self.n_iterations_sweep = SWEEP_N_ITERATIONS  # number of lists of each size inserted and read in a sweep
+        self.phases = scenario_data.get("phases", PHASES)  # phases of the benchmark phase to run
+        self.cold_cache = cold_cache  # number of reads timed apart after making caches cold, or None
+        self.cold_cache_command = cold_cache_command
+        self.cold_cache_runs = []  # results of `make_cache_cold`, for each trial of the current step
+        self.autotune = autotune
+        self.autotune_runs = {}  # chosen number of threads and probe curve of each populate of the current step
+        self.adaptive = adaptive
+        self.limiters: Dict[str, AimdLimiter] = {}  # concurrency limiter of each phase of the current step
+        self.pipeline = pipeline
+        self.pipeline_runs = {}  # utilization of the stages of the pipeline, for each populate of the current step
 
         self.step_current = {}
+        self.manifest_collection = None  # size of the manifest collection, the last time it was listed
+        self.bulk_delete = {}  # number of documents deleted by bulk deletes, for the current step (see `self.record_bulk_delete`)
+        self.trial_current = None  # index of the current trial, if running the benchmark phase
         self.report = {
             "server_name": self.server_name,
             "n_steps": n_steps,
             "n_threads": self.threads,
+            "autotune": self.autotune,
+            "sas_fanout": sas_fanout if not self.server_is_aiiinotate else None,
+            "db_latency": db_latency,
+            "compression": compression,
+            "decode": decode,
+            "adaptive": self.adaptive,
+            "pipeline": (
+                { "producers": self.pipeline[0], "senders": self.pipeline[1] }
+                if self.pipeline is not None
+                else None
+            ),
             "n_iterations": self.n_iterations,
+            "n_iterations_collection": self.n_iterations_collection,
+            "n_trials": self.trials,
             "n_annotation_per_canvas": self.n_annotation_per_canvas,
             "ratio_annotation_to_canvas": self.ratio,
             "time_unit": "seconds",
+            **retry_policy,
+            "request_log": self.request_log_name,
+            "sweep_list_sizes": self.sweep_list_sizes,
+            "manifest_server": manifest_server,
+            "key_distribution": self.key_distribution.to_dict(),
+            "phases": self.phases,
+            # the scenario, as written in the scenario file, to make the report self-describing
+            "scenario": { "file": Path(scenario).name, **scenario_data } if scenario is not None else None,
+            "cold_cache": (
+                { "n_request": self.cold_cache, "command": self.cold_cache_command }
+                if self.cold_cache is not None
+                else None
+            ),
             "results": []
         }
 
+    @contextmanager
+    def phase(self, name: str):
+        """
+        wrap a phase of the current step (populate_manifest, read, purge...)
+        to profile it when running with `--profile-client`, and to
+        add the phase to all records of the request log.
+        """
+        label = f"step{self.step_current.get('index', 0)}"
+        if self.trial_current is not None:
+            label += f"_trial{self.trial_current}"
+        self.recorder.step = self.step_current.get("index", None)
+        self.recorder.trial = self.trial_current
+        self.recorder.phase = name
+        try:
+            with self.profiler.phase(f"{label}_{name}"):
+                yield
+        finally:
+            self.recorder.phase = None
+            self.recorder.flush()
+
     def step_to_dict(self, idx_step: int, step: Tuple[int,int]) -> Dict:
         n_manifest = step[0]
         n_canvas_per_manifest = step[1]
@@ -106,6 +326,10 @@ class Benchmark:
             if n_annotation >= self.n_annotation_per_canvas
             else 1
         )
+        # each annotated canvas has `self.n_annotation_per_canvas` annotations: round `n_annotation`
+        # to a multiple of it, which is the number of annotations that are actually inserted.
+        if n_annotation >= self.n_annotation_per_canvas:
+            n_annotation = n_canvas_with_annotations_per_manifest * self.n_annotation_per_canvas
         return {
             "index": idx_step,
             "n_manifest": n_manifest,  # number of inserted manifests
@@ -119,9 +343,33 @@ class Benchmark:
         """
         sample a list to randomly select `self.n_iterations` values, or return the whole list if it's smaller than `self.n_iterations`.
         """
-        #NOTE: THIS WILL BREAK THE BENCHMARKS if using it in benchmarks that are running several iterations, if `self.n_iterations > len(list_)`: average calculation will be broken !
         return random.sample(list_, min(self.n_iterations, len(list_)))
 
+    def sample_keys(self, list_: List, key: Callable[[Any], str]|None = None, replace: bool|None = None) -> List:
+        """
+        like `self.sample_for_iteration`, but following the key distribution of the benchmark (see `src.distributions`).
+
+        :param key: function that returns the key of an item (by default, the item itself)
+        :param replace: if True, an item can be selected several times (by default, only with skewed distributions)
+        """
+        return self.key_distribution.sample(list_, self.n_iterations, key, replace)
+
+    def classify_canvas(self, annotation: Dict) -> str:
+        """key class of an annotation: the key class of its target canvas"""
+        return self.key_distribution.classify(get_target_canvas(annotation))
+
+    def with_db_latency(self, op: str, func: Callable) -> Callable:
+        """with `--db-latency`, run the database query equivalent to `op` after each call to `func` (see `DbLatency.wrap`)"""
+        return self.db_latency.wrap(op, func) if self.db_latency is not None else func
+
+    def mean_latency(self, op: str) -> float|None:
+        """
+        timing of an operation in the current phase and trial: the mean latency of
+        its successful calls, or None if all calls failed. failed calls and timeouts
+        are reported separately, in the `operations` section of the report.
+        """
+        return self.operation_stats.mean_latency(self.recorder.trial, self.recorder.phase, op)  # pyright: ignore
+
     def warmup(self):
         """
         before running the benchmark, insert a bunch of annotations to the
@@ -166,13 +414,22 @@ class Benchmark:
             )
 
         else:
-            list_id_canvas = mt_insert_manifests(
-                func=self.adapter.insert_manifest,
-                n=n_manifest,
-                threads=self.threads,
-                pbar_desc=f"inserting {n_manifest} manifests with {n_canvas_per_manifest} canvases each (threads={self.threads})",
-                n_manifest=n_manifest,
-                n_canvas=n_canvas_per_manifest,
+            insert_manifest = self.recorder.wrap("insert_manifest", self.adapter.insert_manifest, [])
+            limiter = self.make_limiter("populate_manifest")
+            list_id_canvas = self.insert_autotuned(
+                "populate_manifest",
+                n_manifest,
+                lambda threads, start, stop: mt_insert_manifests(
+                    func=insert_manifest,
+                    n=stop-start,
+                    threads=threads,
+                    pbar_desc=f"inserting {stop-start} manifests with {n_canvas_per_manifest} canvases each (threads={threads})",
+                    n_manifest=stop-start,
+                    n_canvas=n_canvas_per_manifest,
+                    limiter=limiter,
+                ),
+                # a manifest that was inserted returns all its canvas IDs
+                lambda list_id: len(list_id) // n_canvas_per_manifest
             )
         assert len(list_id_canvas) != 0
         return list_id_canvas
@@ -186,13 +443,36 @@ class Benchmark:
                 n_annotation=self.n_annotation_per_canvas
             )
             list_id_canvas_annotations  = list_id_canvas
-        else:
-            list_id_canvas_annotations = mt_insert_annotations(
-                func=self.adapter.insert_annotation_list,
+        elif self.pipeline is not None:
+            producers, senders = self.pipeline
+            insert_annotation_list = self.recorder.wrap("insert_annotation_list", self.adapter.insert_annotation_list_bytes, 0)
+            limiter = self.make_limiter("populate_annotation")
+            if limiter is not None:
+                insert_annotation_list = limiter.wrap(insert_annotation_list)
+            list_id_canvas_annotations, self.pipeline_runs["populate_annotation"] = mt_insert_annotations_pipeline(
+                func=insert_annotation_list,
                 data=list_id_canvas,
                 n_annotation=step_n_annotation_per_canvas,
-                threads=self.threads,
-                pbar_desc=f"inserting {n_annotation} annotations on {len(list_id_canvas)} canvases (threads={self.threads})"
+                producers=producers,
+                senders=senders,
+                pbar_desc=f"inserting {n_annotation} annotations on {len(list_id_canvas)} canvases (producers={producers}, senders={senders})"
+            )
+        else:
+            insert_annotation_list = self.recorder.wrap("insert_annotation_list", self.adapter.insert_annotation_list, 0)
+            limiter = self.make_limiter("populate_annotation")
+            list_id_canvas_annotations = self.insert_autotuned(
+                "populate_annotation",
+                len(list_id_canvas),
+                lambda threads, start, stop: mt_insert_annotations(
+                    func=insert_annotation_list,
+                    data=list_id_canvas[start:stop],
+                    n_annotation=step_n_annotation_per_canvas,
+                    threads=threads,
+                    limiter=limiter,
+                    pbar_desc=f"inserting {(stop-start) * step_n_annotation_per_canvas} annotations on {stop-start} canvases (threads={threads})"
+                ),
+                # 1 canvas ID per annotation list inserted
+                len
             )
 
         # there's always an error in SAS insertions, so only enable this check for aiiinotate.
@@ -200,6 +480,54 @@ class Benchmark:
             assert len(list_id_canvas) == len(list_id_canvas_annotations)
         return list_id_canvas_annotations
 
+    def make_limiter(self, name: str) -> AimdLimiter|None:
+        """
+        with `--adaptive`, create the concurrency limiter of phase `name`. its trajectory is added to the step's report.
+        """
+        if not self.adaptive:
+            return None
+        limiter = AimdLimiter(self.threads)
+        self.limiters[name] = limiter
+        return limiter
+
+    def insert_autotuned(
+        self,
+        name: str,
+        n: int,
+        insert: Callable[[int, int, int], List[str]],
+        count_success: Callable[[List[str]], int]
+    ) -> List[str]:
+        """
+        insert `n` items. with `--autotune`, the first items are inserted by probes to choose
+        the number of threads (see `src.autotune`), and the others with the chosen number of threads.
+
+        :param name: name of the populate phase, in the report
+        :param insert: function that inserts items `start..stop` with `threads` threads: `insert(threads, start, stop)`
+        :param count_success: function that returns the number of items inserted, from the output of `insert`
+        :returns: the concatenated outputs of `insert`
+        """
+        if not self.autotune:
+            return insert(self.threads, 0, n)
+
+        list_id = []
+        start = 0
+        def probe(threads: int, n_probe: int) -> int:
+            nonlocal start
+            out = insert(threads, start, start + n_probe)
+            start += n_probe
+            list_id.extend(out)
+            return count_success(out)
+
+        threads, curve, n_probed = autotune(probe, n)
+        # not enough items to probe, or all probes failed
+        if threads is None:
+            threads = self.threads
+        self.autotune_runs[name] = { "threads": threads, "n_probed": n_probed, "curve": curve }
+        print(f"autotune: {name}: using {threads} threads (probes: {[ (p['threads'], round(p['throughput'], 1)) for p in curve ]})")
+        if n_probed < n:
+            list_id += insert(threads, n_probed, n)
+        return list_id
+
     def populate(self):
         """
         before starting the benchmark, bulk insert annotations and annotation lists to the server.
@@ -227,7 +555,8 @@ class Benchmark:
         # insert manifests
         s = timer()
         # `mt_insert_manifests` returns a list of all canvas IDs of all the manifests inserted.
-        list_id_canvas = self.populate_manifests(n_manifest, n_canvas_per_manifest)
+        with self.phase("populate_manifest"):
+            list_id_canvas = self.populate_manifests(n_manifest, n_canvas_per_manifest)
         # list_id_canvas = mt_insert_manifests(
         #     func=self.adapter.insert_manifest,
         #     n=n_manifest,
@@ -257,11 +586,12 @@ class Benchmark:
         #     threads=self.threads,
         #     pbar_desc=f"inserting {n_annotation} annotations on {len(list_id_canvas_sample)} canvases (threads={self.threads})"
         # )
-        list_id_canvas_annotations = self.populate_annotations(
-            n_annotation,
-            list_id_canvas_sample,
-            step_n_annotation_per_canvas
-        )
+        with self.phase("populate_annotation"):
+            list_id_canvas_annotations = self.populate_annotations(
+                n_annotation,
+                list_id_canvas_sample,
+                step_n_annotation_per_canvas
+            )
         e = timer()
         d_populate_annotation = e-s
         # there's always an error in SAS insertions, so only enable this check for aiiinotate.
@@ -274,6 +604,14 @@ class Benchmark:
         get all annotations on canvases whose @ids are in `list_id_canvas`
         """
         list_annotations = []
+        get_annotation_list = self.recorder.wrap(
+            "get_annotation_list",
+            self.adapter.get_annotation_list,
+            None,
+            self.key_distribution.classify
+        )
+        if is_benchmark:
+            get_annotation_list = self.with_db_latency("get_annotation_list", get_annotation_list)
         desc = (
             f"benchmark: read, {len(list_id_canvas)} annotation lists"
             if is_benchmark
@@ -285,7 +623,9 @@ class Benchmark:
             desc=desc
         ):
             # SAS returns Annotation[], while aiiinotate returns an AnnotationList.
-            annotations_data = self.adapter.get_annotation_list(id_canvas)
+            annotations_data = get_annotation_list(id_canvas)
+            if annotations_data is None:
+                continue
             if self.server_is_aiiinotate:
                 list_annotations.extend(annotations_data["resources"])
             else:
@@ -298,91 +638,200 @@ class Benchmark:
 
         :param list_id_canvas: canvases containing annotations
         """
-        list_id_canvas = self.sample_for_iteration(list_id_canvas)
+        list_id_canvas = self.sample_keys(list_id_canvas)
 
         # 1. read annotations on a canvas
-        s = timer()
         list_annotations = self.get_annotations_for_canvases(list_id_canvas, True)
-        e = timer()
-        d_read_annotation_list = (e-s) / self.n_iterations
+        d_read_annotation_list = self.mean_latency("get_annotation_list")
 
         # 2. read a single annotation
         d_read_annotation = None
         # SAS can't fetch a single anno by its @id => only enable for aiiinotate
-        if self.server_is_aiiinotate:
+        if self.server_is_aiiinotate and len(list_annotations):
             # list of randomly selected annotation @ids.
             list_id_annotation = [
-                random.choice(list_annotations)["@id"]
-                for _ in range(self.n_iterations)
+                annotation["@id"]
+                for annotation in self.sample_keys(
+                    list_annotations,
+                    get_target_canvas,
+                    replace=True
+                )
             ]
-            s = timer()
+            # annotation @ids don't contain their canvas
+            key_class = { annotation["@id"]: self.classify_canvas(annotation) for annotation in list_annotations }
+            get_annotation = self.recorder.wrap("get_annotation", self.adapter.get_annotation, None, key_class.get)  # pyright: ignore
+            get_annotation = self.with_db_latency("get_annotation", get_annotation)
             for id_annotation in tqdm(
                 list_id_annotation,
                 total=len(list_id_annotation),
                 desc=f"benchmark: read, {len(list_id_annotation)} annotations"
             ):
-                annotation = self.adapter.get_annotation(id_annotation)  # pyright: ignore
-                assert "@id" in annotation.keys() and annotation["@id"] == id_annotation
-            e = timer()
-            d_read_annotation = (e-s) / self.n_iterations
-
-        # TODO 3. IIIF SEARCH API
+                annotation = get_annotation(id_annotation)
+                if annotation is not None:
+                    assert "@id" in annotation.keys() and annotation["@id"] == id_annotation
+            d_read_annotation = self.mean_latency("get_annotation")
 
         return d_read_annotation_list, d_read_annotation
 
-    def write(self) -> Tuple[float, float, float|None]:
+    def read_cold(self, list_id_canvas: List[str]) -> float|None:
+        """
+        make caches cold, then read `self.cold_cache` annotation lists: the latency of the
+        first requests after a restart, when data must be read from disk.
+
+        :param list_id_canvas: canvases containing annotations
+        """
+        # reading a canvas that doesn't exist checks that the server can query the database
+        # again, without loading annotations into the cache.
+        id_canvas_probe = make_canvas_uri(make_manifest_uri(mkstr()), mkstr())
+        self.cold_cache_runs.append(make_cache_cold(
+            self.cold_cache_command,
+            lambda: self.adapter.get_annotation_list(id_canvas_probe)
+        ))
+        list_id_canvas = self.key_distribution.sample(list_id_canvas, self.cold_cache)  # pyright: ignore
+        self.get_annotations_for_canvases(list_id_canvas, True)
+        return self.mean_latency("get_annotation_list")
+
+    def split_manifests(self, list_id_canvas: List[str], list_id_canvas_annotations: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        :param list_id_canvas: all canvases inserted in the populate phase
+        :param list_id_canvas_annotations: canvases on which annotations were inserted in the populate phase
+        :returns: the @ids of manifests with annotations, and of manifests without annotations
+        """
+        to_id_manifest = lambda id_canvas: make_manifest_uri(get_manifest_short_id(id_canvas))
+        # dicts are used instead of sets to keep the insertion order, so that sampling is reproducible.
+        id_manifest_annotated = dict.fromkeys(to_id_manifest(c) for c in list_id_canvas_annotations)
+        id_manifest_empty = dict.fromkeys(
+            id_manifest for id_manifest in map(to_id_manifest, list_id_canvas)
+            if id_manifest not in id_manifest_annotated
+        )
+        return list(id_manifest_annotated.keys()), list(id_manifest_empty.keys())
+
+    def search(self, list_id_manifest: List[str]) -> float|None:
+        """
+        IIIF Search API benchmark: search all annotations on a manifest
+
+        :param list_id_manifest: manifests to search on
+        """
+        list_id_manifest = self.sample_keys(list_id_manifest)
+        search = self.recorder.wrap(
+            "search",
+            lambda id_manifest: self.adapter.search(id_manifest, decode=self.decode),
+            None,
+            self.key_distribution.classify
+        )
+        for id_manifest in tqdm(
+            list_id_manifest,
+            total=len(list_id_manifest),
+            desc=f"benchmark: {self.recorder.phase}, {len(list_id_manifest)} manifests"
+        ):
+            search(id_manifest)
+        return self.mean_latency("search")
+
+    def read_manifest(self, list_id_manifest: List[str]) -> float|None:
+        """
+        read a single manifest
+
+        :param list_id_manifest: manifests inserted in the populate phase
+        """
+        list_id_manifest = self.sample_keys(list_id_manifest)
+        get_manifest = self.recorder.wrap("get_manifest", self.get_manifest_checked, None, self.key_distribution.classify)
+        get_manifest = self.with_db_latency("get_manifest", get_manifest)
+        for id_manifest in tqdm(
+            list_id_manifest,
+            total=len(list_id_manifest),
+            desc=f"benchmark: read, {len(list_id_manifest)} manifests"
+        ):
+            get_manifest(id_manifest)
+        return self.mean_latency("get_manifest")
+
+    def get_manifest_checked(self, id_manifest: str) -> Dict|None:
+        """
+        read a manifest, and check that it is the requested manifest.
+        aiiinotate can rewrite the host and prefix of a manifest's @id, so only short ids are compared.
+
+        :returns: the manifest, or None if it is another manifest (the call is then recorded as an error)
+        """
+        manifest = self.adapter.get_manifest(id_manifest)
+        id_served = manifest.get("@id") if isinstance(manifest, dict) else None
+        try:
+            is_same = id_served is not None and get_manifest_short_id(id_served) == get_manifest_short_id(id_manifest)
+        except ValueError:
+            is_same = False
+        return manifest if is_same else None
+
+    def list_manifests(self) -> float|None:
+        """
+        list the whole manifest collection, `self.n_iterations_collection` times.
+        the size of the collection is saved to `self.manifest_collection`.
+        """
+        list_manifest_collection = self.recorder.wrap("list_manifest_collection", self.adapter.list_manifest_collection, None)
+        for _ in tqdm(
+            range(self.n_iterations_collection),
+            total=self.n_iterations_collection,
+            desc=f"benchmark: list manifest collection, {self.n_iterations_collection} times"
+        ):
+            collection = list_manifest_collection()
+            if collection is not None:
+                self.manifest_collection = collection
+        return self.mean_latency("list_manifest_collection")
+
+    def write(self) -> Tuple[float|None, float|None, float|None, List[str], List[str], List[str]]:
         """
         write time benchmarks
+
+        :returns: the 3 write timings, the canvases on which annotation lists were written,
+            the canvases on which any annotation was written, and all canvases of the written manifests.
         """
+        insert_manifest = self.recorder.wrap("insert_manifest", self.adapter.insert_manifest, [])
+        insert_annotation = self.recorder.wrap("insert_annotation", self.adapter.insert_annotation, 0)  # pyright: ignore
+        insert_annotation_list = self.recorder.wrap("insert_annotation_list", self.adapter.insert_annotation_list, 0)
+
         # 1. insert manifests
         list_id_canvas = []
         generator_manifest = generate_manifests(self.n_iterations, self.step_current["n_canvas_per_manifest"])
-        s = timer()
         for manifest in generator_manifest:
-            canvases = self.adapter.insert_manifest(manifest)
+            canvases = insert_manifest(manifest)
             list_id_canvas.extend(canvases)
-        e = timer()
-        d_write_manifest = (e-s) / self.n_iterations
+        d_write_manifest = self.mean_latency("insert_manifest")
 
         # 2. create 1 annotation
-        generator_annotation = generate_annotations(random.sample(list_id_canvas, self.n_iterations))
-        s = timer()
+        list_id_canvas_annotation = self.sample_for_iteration(list_id_canvas)
+        generator_annotation = generate_annotations(list_id_canvas_annotation)
         for annotation in tqdm(
             generator_annotation,
-            total=self.n_iterations,
-            desc=f"benchmark: write, {self.n_iterations} annotations"
+            total=min(self.n_iterations, len(list_id_canvas)),
+            desc=f"benchmark: write, {min(self.n_iterations, len(list_id_canvas))} annotations"
         ):
-            self.adapter.insert_annotation(annotation)
-        e = timer()
-        d_write_annotation = (e-s) / self.n_iterations
+            insert_annotation(annotation)
+        d_write_annotation = self.mean_latency("insert_annotation")
 
         # 3. create many annotations
-        d_write_annotation_list = None
+        list_id_canvas_written = self.sample_for_iteration(list_id_canvas)
         generator_annotation_list = generate_annotation_lists(
-            self.sample_for_iteration(list_id_canvas),
+            list_id_canvas_written,
             self.n_annotation_per_canvas
         )
-        s = timer()
         for annotation_list in tqdm(
             generator_annotation_list,
-            total=self.n_iterations,
-            desc=f"benchmark: write, {self.n_iterations} annotation lists"
+            total=len(list_id_canvas_written),
+            desc=f"benchmark: write, {len(list_id_canvas_written)} annotation lists"
         ):
-            self.adapter.insert_annotation_list(annotation_list)
-        e = timer()
-        d_write_annotation_list = (e-s) / self.n_iterations
+            insert_annotation_list(annotation_list)
+        d_write_annotation_list = self.mean_latency("insert_annotation_list")
 
-        return d_write_manifest, d_write_annotation, d_write_annotation_list
+        list_id_canvas_annotated = list(dict.fromkeys(list_id_canvas_annotation + list_id_canvas_written))
+        return d_write_manifest, d_write_annotation, d_write_annotation_list, list_id_canvas_written, list_id_canvas_annotated, list_id_canvas
 
     def update(self, list_id_canvas: List[str]):
         """
         update time benchmarks
         """
         # update 1 annotation
-        list_id_canvas = self.sample_for_iteration(list_id_canvas)
+        list_id_canvas = self.sample_keys(list_id_canvas)
         list_annotation = self.get_annotations_for_canvases(list_id_canvas, False)
-        list_annotation = self.sample_for_iteration(list_annotation)
-        s = timer()
+        list_annotation = self.sample_keys(list_annotation, get_target_canvas)
+        update_annotation = self.recorder.wrap("update_annotation", self.adapter.update_annotation, 0, self.classify_canvas)
+        update_annotation = self.with_db_latency("update_annotation", update_annotation)
         for annotation in tqdm(
             list_annotation,
             total=len(list_annotation),
@@ -390,29 +839,215 @@ class Benchmark:
         ):
             r = sorted(random.sample(range(0,1000), 4))  # 4 random numbers in range 0..1000
             annotation["on"][0]["selector"]["value"] = f"xywh={r[0]},{r[1]},{r[2]},{r[3]}"
-            self.adapter.update_annotation(annotation)
-        e = timer()
-        d_update_annotation = (e-s) / self.n_iterations
+            update_annotation(annotation)
+
+        return self.mean_latency("update_annotation")
 
-        return d_update_annotation
+    def delete(self, list_id_canvas: List[str]) -> Tuple[float|None, List[Dict]]:
+        """
+        delete time benchmarks
 
-    def delete(self, list_id_canvas: List[str]):
-        list_id_canvas = self.sample_for_iteration(list_id_canvas)
+        :param list_id_canvas: canvases containing annotations
+        :returns: the mean latency, and the deleted annotations (see `self.restore`)
+        """
+        # an annotation can only be deleted once
+        list_id_canvas = self.sample_keys(list_id_canvas, replace=False)
         list_annotation = self.get_annotations_for_canvases(list_id_canvas, False)
-        list_annotation = self.sample_for_iteration(list_annotation)
+        list_annotation = self.sample_keys(list_annotation, get_target_canvas, replace=False)
 
         # delete 1 annotation
-        s = timer()
+        key_class = { annotation["@id"]: self.classify_canvas(annotation) for annotation in list_annotation }
+        delete_annotation = self.recorder.wrap("delete_annotation", self.adapter.delete_annotation, 0, key_class.get)
+        list_deleted = []
         for annotation in tqdm(
             list_annotation,
             total=len(list_annotation),
             desc=f"benchmark: delete, {len(list_annotation)} annotations"
         ):
             id_annotation = annotation["@id"]
-            self.adapter.delete_annotation(id_annotation)
-        e = timer()
+            if delete_annotation(id_annotation):
+                list_deleted.append(annotation)
+
+        return self.mean_latency("delete_annotation"), list_deleted
+
+    def restore(self, list_annotation: List[Dict]) -> None:
+        """
+        re-insert the annotations deleted by `self.delete`, so that all trials run on the same
+        populated database. the inserts are neither timed nor recorded.
+
+        :param list_annotation: annotations, as they were served before being deleted
+        """
+        n_failed = 0
+        for annotation in tqdm(
+            list_annotation,
+            total=len(list_annotation),
+            desc=f"restoring {len(list_annotation)} deleted annotations"
+        ):
+            try:
+                n_failed += 0 if self.adapter.insert_annotation(annotation) else 1
+            except ADAPTER_ERRORS:
+                n_failed += 1
+        if n_failed > 0:
+            print(f"WARNING: restore: {n_failed} of {len(list_annotation)} deleted annotations could not be re-inserted")
+        return
 
-        return (e-s) / self.n_iterations
+    def cleanup_write(self, list_id_manifest: List[str]) -> None:
+        """
+        delete the data created by `self.write`, so that the database doesn't grow from a trial to
+        the next. the deletes are neither timed nor recorded. SAS can't delete manifests: the written
+        manifests, without annotations, remain in its database until the end of the step.
+
+        :param list_id_manifest: manifests written by `self.write`
+        """
+        for id_manifest in tqdm(
+            list_id_manifest,
+            total=len(list_id_manifest),
+            desc=f"deleting {len(list_id_manifest)} written manifests"
+        ):
+            try:
+                self.adapter.delete_annotations_for_manifest(id_manifest)
+                if self.server_is_aiiinotate:
+                    self.adapter.delete_manifest(id_manifest)
+            except ADAPTER_ERRORS:
+                print(f"WARNING: cleanup_write: could not delete the written manifest {id_manifest}")
+        return
+
+    def sweep(self, list_sizes: List[int]) -> List[Dict]:
+        """
+        annotation list size sweep: on the populated database, insert and read
+        `self.n_iterations_sweep` annotation lists of each size in `list_sizes`.
+        lists are written on new manifests, and deleted after each size,
+        so that all sizes run on the same database.
+
+        :returns: for each list size, the timings and the mean size of requests and responses (in bytes)
+        """
+        insert_manifest = self.recorder.wrap("insert_manifest", self.adapter.insert_manifest, [])
+        insert_annotation_list = self.recorder.wrap("insert_annotation_list", self.adapter.insert_annotation_list, 0)
+        get_annotation_list = self.recorder.wrap("get_annotation_list", self.adapter.get_annotation_list, None)
+        delete_annotations_for_manifest = self.recorder.wrap(
+            "delete_annotations_for_manifest",
+            self.adapter.delete_annotations_for_manifest,
+            0
+        )
+
+        # 1 canvas per manifest: each list is written on its own manifest.
+        list_id_canvas = []
+        with self.phase("sweep_manifest"):
+            for manifest in generate_manifests(self.n_iterations_sweep, 1):
+                list_id_canvas.extend(insert_manifest(manifest))
+        list_id_manifest, _ = self.split_manifests(list_id_canvas, list_id_canvas)
+
+        out = []
+        for size in list_sizes:
+            with self.phase(f"sweep_insert_{size}"):
+                for annotation_list in tqdm(
+                    generate_annotation_lists(list_id_canvas, size),
+                    total=len(list_id_canvas),
+                    desc=f"sweep: write, {len(list_id_canvas)} annotation lists of {size} annotations"
+                ):
+                    insert_annotation_list(annotation_list)
+                d_insert = self.mean_latency("insert_annotation_list")
+                size_insert = self.operation_stats.mean_size(None, self.recorder.phase, "insert_annotation_list", "request_size")  # pyright: ignore
+
+            # check that the lists were read entirely
+            n_incomplete = 0
+            with self.phase(f"sweep_read_{size}"):
+                for id_canvas in tqdm(
+                    list_id_canvas,
+                    total=len(list_id_canvas),
+                    desc=f"sweep: read, {len(list_id_canvas)} annotation lists of {size} annotations"
+                ):
+                    annotations_data = get_annotation_list(id_canvas)
+                    if annotations_data is None:
+                        continue
+                    # SAS returns Annotation[], while aiiinotate returns an AnnotationList.
+                    annotations = annotations_data["resources"] if self.server_is_aiiinotate else annotations_data
+                    n_incomplete += 0 if len(annotations) == size else 1
+                d_read = self.mean_latency("get_annotation_list")
+                size_read = self.operation_stats.mean_size(None, self.recorder.phase, "get_annotation_list")  # pyright: ignore
+
+            with self.phase(f"sweep_delete_{size}"):
+                for id_manifest in list_id_manifest:
+                    delete_annotations_for_manifest(id_manifest)
+
+            out.append({
+                "n_annotation_per_list": size,
+                "n_list": len(list_id_canvas),
+                "timing_write_annotation_list": d_insert,
+                "timing_read_annotation_list": d_read,
+                "size_write_annotation_list": size_insert,  # mean size of a request, in bytes
+                "size_read_annotation_list": size_read,  # mean size of a response, in bytes
+                "n_incomplete_read": n_incomplete,
+            })
+        return out
+
+    def record_bulk_delete(self, op: str, n_call: int, n_deleted: int, n_remaining: int|None = None) -> None:
+        """
+        add the results of a bulk delete to `self.bulk_delete`, and warn if the delete was incomplete.
+
+        :param n_call: number of delete requests
+        :param n_deleted: total of the `deletedCount` of all requests
+        :param n_remaining: number of documents found after the delete, or None if not checked
+        """
+        if op not in self.bulk_delete:
+            self.bulk_delete[op] = { "n_call": 0, "n_deleted": 0, "n_remaining": None }
+        out = self.bulk_delete[op]
+        out["n_call"] += n_call
+        out["n_deleted"] += n_deleted
+        if n_remaining is not None:
+            out["n_remaining"] = (out["n_remaining"] or 0) + n_remaining
+            if n_remaining > 0:
+                print(f"WARNING: {op}: {n_remaining} documents remain after deleting {n_deleted} documents")
+        return
+
+    def delete_manifest_annotations(self, list_id_manifest: List[str]) -> float|None:
+        """
+        bulk delete benchmark: delete all annotations on a manifest.
+        afterwards, the manifests are searched to check that no annotation remains.
+
+        :param list_id_manifest: manifests that have annotations
+        """
+        delete_annotations_for_manifest = self.recorder.wrap(
+            "delete_annotations_for_manifest",
+            self.adapter.delete_annotations_for_manifest,
+            0
+        )
+        n_deleted = 0
+        for id_manifest in tqdm(
+            list_id_manifest,
+            total=len(list_id_manifest),
+            desc=f"benchmark: delete, all annotations on {len(list_id_manifest)} manifests"
+        ):
+            # None if the delete failed
+            n_deleted += delete_annotations_for_manifest(id_manifest) or 0
+        d_delete_manifest_annotations = self.mean_latency("delete_annotations_for_manifest")
+
+        # check the deletes. the searches are recorded, but not included in the timing.
+        search = self.recorder.wrap("search", self.adapter.search, None)
+        n_remaining = 0
+        for id_manifest in list_id_manifest:
+            annotation_list = search(id_manifest)
+            n_remaining += len(annotation_list["resources"]) if annotation_list is not None else 0
+        self.record_bulk_delete("delete_annotations_for_manifest", len(list_id_manifest), n_deleted, n_remaining)
+        return d_delete_manifest_annotations
+
+    def delete_manifests(self, list_id_manifest: List[str]) -> float|None:
+        """
+        bulk delete benchmark: delete whole manifests.
+
+        :param list_id_manifest: manifests to delete
+        """
+        delete_manifest = self.recorder.wrap("delete_manifest", self.adapter.delete_manifest, 0)
+        n_deleted = 0
+        for id_manifest in tqdm(
+            list_id_manifest,
+            total=len(list_id_manifest),
+            desc=f"benchmark: delete, {len(list_id_manifest)} manifests"
+        ):
+            n_deleted += delete_manifest(id_manifest)
+        # each delete should remove exactly 1 manifest
+        self.record_bulk_delete("delete_manifest", len(list_id_manifest), n_deleted, len(list_id_manifest) - n_deleted)
+        return self.mean_latency("delete_manifest")
 
     def purge(self):
         """
@@ -421,9 +1056,117 @@ class Benchmark:
         if self.server_is_aiiinotate:
             self.adapter.purge()  # pyright: ignore
         else:
-            self.adapter.purge(self.threads)  # pyright: ignore
+            self.adapter.purge(self.threads, self.make_limiter("purge"))  # pyright: ignore
         return
 
+    def trial(
+        self,
+        list_id_canvas_annotations: List[str],
+        list_id_manifest_annotated: List[str],
+        list_id_manifest_empty: List[str]
+    ) -> Dict[str, float|None]:
+        """
+        run the benchmark phase once.
+
+        :param list_id_canvas_annotations: canvases on which annotations were inserted in the populate phase
+        :param list_id_manifest_annotated: manifests with annotations (see `self.split_manifests`)
+        :param list_id_manifest_empty: manifests without annotations
+        :returns: a mapping of {<metric>: <timing>}. a timing is None if all calls failed.
+        """
+        timings = {}
+        if "read" in self.phases:
+            # the first reads after making caches cold are timed apart from the steady state.
+            if self.cold_cache is not None:
+                with self.phase("read_cold"):
+                    timings["timing_read_annotation_list_cold"] = self.read_cold(list_id_canvas_annotations)
+            with self.phase("read"):
+                d_read_annotation_list, d_read_annotation = self.read(list_id_canvas_annotations)
+            timings["timing_read_annotation_list"] = d_read_annotation_list
+            # SAS can't fetch a single annotation
+            if self.server_is_aiiinotate:
+                timings["timing_read_annotation"] = d_read_annotation
+
+        # search on manifests with and without annotations: searching an empty
+        # manifest measures the fixed cost of a search on a database of this size.
+        if "search" in self.phases:
+            with self.phase("search_annotated"):
+                timings["timing_search_manifest_annotated"] = self.search(list_id_manifest_annotated)
+            with self.phase("search_empty"):
+                timings["timing_search_manifest_empty"] = self.search(list_id_manifest_empty)
+
+        # SAS doesn't serve manifests
+        if "read_manifest" in self.phases and self.server_is_aiiinotate:
+            with self.phase("read_manifest"):
+                timings["timing_read_manifest"] = self.read_manifest(list_id_manifest_annotated + list_id_manifest_empty)
+        if "list_manifests" in self.phases:
+            with self.phase("list_manifests"):
+                timings["timing_list_manifest_collection"] = self.list_manifests()
+
+        if "write" in self.phases:
+            with self.phase("write"):
+                (
+                    d_write_manifest,
+                    d_write_annotation,
+                    d_write_annotation_list,
+                    list_id_canvas_written,
+                    list_id_canvas_written_annotated,
+                    list_id_canvas_written_all
+                ) = self.write()
+            timings["timing_write_manifest"] = d_write_manifest
+            timings["timing_write_annotation"] = d_write_annotation
+            timings["timing_write_annotation_list"] = d_write_annotation_list
+
+        if "update" in self.phases:
+            with self.phase("update"):
+                d_update_annotation = self.update(list_id_canvas_annotations)
+            timings["timing_update_annotation"] = d_update_annotation
+
+        # delete annotations of the populated database, then re-insert them outside of the phase,
+        # so that all trials run on the same populated database.
+        if "delete" in self.phases:
+            with self.phase("delete"):
+                d_delete_annotation, list_annotation_deleted = self.delete(list_id_canvas_annotations)
+            timings["timing_delete_annotation"] = d_delete_annotation
+            self.restore(list_annotation_deleted)
+
+        # bulk deletes require the "write" phase (see `src.scenario.validate_scenario`): delete all
+        # annotations on each written manifest, then the manifests themselves (SAS can't delete manifests).
+        # afterwards, the remaining written data is deleted, so that the database doesn't grow between trials.
+        if "write" in self.phases:
+            list_id_manifest_written_annotated, list_id_manifest_written_empty = self.split_manifests(
+                list_id_canvas_written_all,  # pyright: ignore
+                list_id_canvas_written_annotated  # pyright: ignore
+            )
+            if "delete_manifest_annotations" in self.phases:
+                with self.phase("delete_manifest_annotations"):
+                    timings["timing_delete_manifest_annotations"] = self.delete_manifest_annotations(list_id_manifest_written_annotated)
+            if "delete_manifest" in self.phases and self.server_is_aiiinotate:
+                with self.phase("delete_manifest"):
+                    timings["timing_delete_manifest"] = self.delete_manifests(
+                        list_id_manifest_written_annotated + list_id_manifest_written_empty
+                    )
+            else:
+                self.cleanup_write(list_id_manifest_written_annotated + list_id_manifest_written_empty)
+        return timings
+
+    def aggregate_trials(self, list_trial: List[Dict[str, float|None]]) -> Dict:
+        """
+        combine the timings of several trials.
+        `timing_*` keys hold the average over all trials, and `trials` holds
+        the statistical summary of each metric (see `src.stats.describe`).
+        trials in which all calls of a metric failed are skipped.
+        """
+        out = { "trials": {} }
+        for metric in list_trial[0].keys():
+            values = [ t[metric] for t in list_trial if t[metric] is not None ]
+            if not len(values):
+                out[metric] = None
+                continue
+            summary = describe(values)
+            out[metric] = summary["mean"]
+            out["trials"][metric] = summary
+        return out
+
     def step(self, idx_step:int, step: Tuple[int,int]):
         """
         run a single step.
@@ -436,6 +1179,7 @@ class Benchmark:
         self.step_current = step_dict
         report = {}
         report["step"] = step_dict
+        self.operation_stats.reset()
 
         t_width = shutil.get_terminal_size((80,20))[0]
         banner_start = f"\nSTART STEP #{idx_step}: {step_dict}\n{'~' * t_width}\n"
@@ -446,27 +1190,53 @@ class Benchmark:
             d_populate_manifest, d_populate_annotation, list_id_canvas_full, list_id_canvas_annotations = self.populate()
             report["timing_populate_manifest"] = d_populate_manifest
             report["timing_populate_annotation"] = d_populate_annotation
+            # in a sweep, the benchmark phase is replaced by the list-size sweep.
+            if self.sweep_list_sizes is not None:
+                report["sweep"] = self.sweep(self.sweep_list_sizes)
+            else:
+                list_id_manifest_annotated, list_id_manifest_empty = self.split_manifests(
+                    list_id_canvas_full,
+                    list_id_canvas_annotations
+                )
 
-            d_read_annotation_list, d_read_annotation = self.read(list_id_canvas_annotations)
-            report["timing_read_annotation_list"] = d_read_annotation_list
-            if d_read_annotation is not None:
-                report["timing_read_annotation"] = d_read_annotation
-
-            d_write_manifest, d_write_annotation, d_write_annotation_list = self.write()
-            report["timing_write_manifest"] = d_write_manifest
-            report["timing_write_annotation"] = d_write_annotation
-            if d_write_annotation_list is not None:
-                report["timing_write_annotation_list"] = d_write_annotation_list
-
-            d_update_annotation = self.update(list_id_canvas_annotations)
-            report["timing_update_annotation"] = d_update_annotation
-
-            d_delete_annotation = self.delete(list_id_canvas_annotations)
-            report["timing_delete_annotation"] = d_delete_annotation
+                # the benchmark phase is repeated `self.trials` times on the same populated
+                # database. the report is updated after each trial to not lose completed trials.
+                list_trial = []
+                for idx_trial in range(1, self.trials+1):
+                    if self.trials > 1:
+                        print(f"\nSTEP #{idx_step}: TRIAL {idx_trial}/{self.trials}\n")
+                    self.trial_current = idx_trial
+                    list_trial.append(self.trial(
+                        list_id_canvas_annotations,
+                        list_id_manifest_annotated,
+                        list_id_manifest_empty
+                    ))
+                    report.update(self.aggregate_trials(list_trial))
+                    report["manifest_collection"] = self.manifest_collection
+                    report["bulk_delete"] = self.bulk_delete
 
         finally:
-            self.purge()
+            self.trial_current = None
+            with self.phase("purge"):
+                self.purge()
+            report["operations"] = self.operation_stats.summary()
+            report["key_classes"] = self.operation_stats.key_class_summary()
+            report["attribution"] = attribution(report["operations"]) if self.db_latency is not None else None
+            report["cold_cache"] = self.cold_cache_runs if self.cold_cache is not None else None
+            report["autotune"] = self.autotune_runs if self.autotune else None
+            report["pipeline"] = self.pipeline_runs if self.pipeline is not None else None
+            report["concurrency"] = (
+                { name: limiter.summary() for name, limiter in self.limiters.items() }
+                if self.adaptive
+                else None
+            )
             self.step_current = {}
+            self.manifest_collection = None
+            self.bulk_delete = {}
+            self.cold_cache_runs = []
+            self.autotune_runs = {}
+            self.limiters = {}
+            self.pipeline_runs = {}
             self.report["results"].append(report)
             print(f"\nSTEP #{idx_step} RESULTS:")
             pprint(report)
@@ -475,15 +1245,27 @@ class Benchmark:
         print(banner_end)
         return
 
-    def run(self):
-        def write(basename: str):
-            if not self.nowrite:
-                write_report(basename, self.report)
-            return
+    def save(self) -> None:
+        """write the report to file"""
+        if not self.nowrite:
+            write_report(self.report_basename, self.report)
+            self.profiler.write_windows()
+        return
 
-        timestamp = datetime.now().strftime(r'%Y-%m-%d-%H:%M:%S')
-        report_basename = f"report_benchmark_{self.server_name.lower()}_{timestamp}_{len(self.steps)}steps"
+    def close(self) -> None:
+        """write the report, and close the request log and local servers"""
+        self.save()
+        self.recorder.close()
+        self.adapter.close()
+        if self.db_latency is not None:
+            self.db_latency.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        if self.manifest_server is not None:
+            self.manifest_server.shutdown()
+        return
 
+    def run(self):
         print("Global benchmark parameters:")
         pprint(self.report)
 
@@ -491,18 +1273,43 @@ class Benchmark:
         try:
             for i, step in enumerate(self.steps):
                 i += 1
+                # a sweep is run at a fixed database size: the last step
+                if self.sweep_list_sizes is not None and i < len(self.steps):
+                    continue
                 self.step(i, step)  # pyright: ignore
-                write(report_basename)
+                self.save()
         finally:
-                write(report_basename)
+            self.close()
         return
 
 
 def benchmark_runner(
     server: str,
     endpoint: str,
-    n_steps: int = N_STEPS_DEFAULT,
-    threads: int|None = THREADS_DEFAULT,
+    n_steps: int|None = None,
+    threads: int|None = None,
+    trials: int|None = None,
+    profile_client: bool = False,
+    metrics_port: int|None = None,
+    timeout_connect: float = TIMEOUT_CONNECT_DEFAULT,
+    timeout_read: float = TIMEOUT_READ_DEFAULT,
+    retries: int = RETRIES_DEFAULT,
+    backoff: float = BACKOFF_DEFAULT,
+    sweep: List[int]|None = None,
+    manifest_server_port: int|None = None,
+    manifest_server_latency: float = MANIFEST_SERVER_LATENCY_DEFAULT,
+    manifest_server_seed: int = MANIFEST_SERVER_SEED_DEFAULT,
+    distribution: str|None = None,
+    scenario: str|None = None,
+    cold_cache: int|None = None,
+    cold_cache_command: str = COLD_CACHE_COMMAND_DEFAULT,
+    autotune: bool = False,
+    adaptive: bool = False,
+    pipeline: Tuple[int,int]|None = None,
+    sas_fanout: int = SAS_FANOUT_DEFAULT,
+    db_latency: bool = False,
+    compression: str|None = None,
+    decode: bool = True,
     nowrite: bool = False,
 ) -> None:
     """define a benchmark and run it"""
@@ -511,6 +1318,28 @@ def benchmark_runner(
         endpoint=endpoint,
         n_steps=n_steps,
         threads=threads,
+        trials=trials,
+        profile_client=profile_client,
+        metrics_port=metrics_port,
+        timeout_connect=timeout_connect,
+        timeout_read=timeout_read,
+        retries=retries,
+        backoff=backoff,
+        sweep=sweep,
+        manifest_server_port=manifest_server_port,
+        manifest_server_latency=manifest_server_latency,
+        manifest_server_seed=manifest_server_seed,
+        distribution=distribution,
+        scenario=scenario,
+        cold_cache=cold_cache,
+        cold_cache_command=cold_cache_command,
+        autotune=autotune,
+        adaptive=adaptive,
+        pipeline=pipeline,
+        sas_fanout=sas_fanout,
+        db_latency=db_latency,
+        compression=compression,
+        decode=decode,
         nowrite=nowrite
     ).run()
 
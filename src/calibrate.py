@@ -0,0 +1,207 @@
+"""
+calibration (`main.py calibrate`): measure the max throughput and the baseline latency
+of the benchmark client itself, before a real run.
+
+each operation of the benchmark is run through the same code as in a benchmark
+(`AdapterAiiinotate`, `src.metrics.Recorder` and the `mt_*` functions of `src.multithread`),
+against the null annotation server (`src.null_server`), which costs (almost) nothing:
+1. with 1 thread: the baseline latency of the client.
+2. with `threads` threads: the max throughput of the client.
+
+on a real server, an operation whose throughput is close to this ceiling is limited by
+the client, not by the server. the null server runs in the same process as the client,
+so the ceiling is a lower bound: the client and the server share the same interpreter.
+"""
+
+import random
+from datetime import datetime
+from timeit import default_timer as timer
+from typing import Callable, Dict, List
+
+from src.utils import pprint, write_report
+from src.metrics import Recorder, OperationStats
+from src.null_server import serve_null_server
+from src.adapter_aiiinotate import AdapterAiiinotate
+from src.multithread import mt_insert_manifests, mt_insert_annotations, mt_apply
+from src.constants import CALIBRATE_N_CALL, CALIBRATE_N_CANVAS, N_ANNOTATIONS_PER_CANVAS, THREADS_DEFAULT
+
+MODES = { "sequential": "1 thread", "concurrent": "max threads" }
+
+
+def validate_calibrate(threads, n_call, n_canvas, n_annotation) -> None:
+    for name, value in [("threads", threads), ("n_call", n_call), ("n_canvas", n_canvas), ("n_annotation", n_annotation)]:
+        if not isinstance(value, int) or value < 1:
+            raise ValueError(f"validate_calibrate: '{name}' must be an integer >= 1, got {value} (type {type(value)})")
+
+
+class Calibration:
+    def __init__(
+        self,
+        threads: int = THREADS_DEFAULT,
+        n_call: int = CALIBRATE_N_CALL,
+        n_canvas: int = CALIBRATE_N_CANVAS,
+        n_annotation: int = N_ANNOTATIONS_PER_CANVAS,
+        nowrite: bool = False,
+    ):
+        """
+        :param threads: number of threads of the "concurrent" mode
+        :param n_call: number of calls of each operation, in each mode
+        :param n_canvas: number of canvases per inserted manifest
+        :param n_annotation: number of annotations per inserted annotation list
+        """
+        validate_calibrate(threads, n_call, n_canvas, n_annotation)
+        self.threads = threads
+        self.n_call = n_call
+        self.n_canvas = n_canvas
+        self.n_annotation = n_annotation
+        self.nowrite = nowrite
+        self.server = serve_null_server()
+        self.adapter = AdapterAiiinotate(f"http://127.0.0.1:{self.server.server_address[1]}")
+        self.operation_stats = OperationStats()
+        self.recorder = Recorder([ self.operation_stats ])
+        self.durations: Dict[str, Dict[str, float]] = {}  # { op: { mode: duration of all calls } }
+        timestamp = datetime.now().strftime(r'%Y-%m-%d-%H:%M:%S')
+        self.report_basename = f"report_calibrate_{timestamp}"
+
+    def run_op(self, op: str, run: Callable[[int, str], List]) -> List:
+        """
+        run an operation in both modes.
+
+        :param run: function that runs `self.n_call` calls with `threads` threads: `run(threads, pbar_desc)`
+        :returns: the concatenated outputs of `run`
+        """
+        out = []
+        for mode, threads in [("sequential", 1), ("concurrent", self.threads)]:
+            self.recorder.phase = mode
+            s = timer()
+            out += run(threads, f"calibrate: {op} ({MODES[mode]}, threads={threads})") or []
+            self.durations.setdefault(op, {})[mode] = timer() - s
+            self.recorder.flush()
+        return out
+
+    def run(self) -> Dict:
+        wrap = self.recorder.wrap
+        adapter = self.adapter
+        try:
+            list_id_canvas = self.run_op("insert_manifest", lambda threads, desc: mt_insert_manifests(
+                func=wrap("insert_manifest", adapter.insert_manifest, []),
+                n=self.n_call,
+                n_canvas=self.n_canvas,
+                threads=threads,
+                pbar_desc=desc
+            ))
+            list_id_manifest = adapter.get_id_manifest_list()
+            # each mode inserts annotations on different canvases
+            list_id_canvas_sample = random.sample(list_id_canvas, min(len(list_id_canvas), 2 * self.n_call))
+            list_id_canvas_annotations = self.run_op("insert_annotation_list", lambda threads, desc: mt_insert_annotations(
+                func=wrap("insert_annotation_list", adapter.insert_annotation_list, 0),
+                data=list_id_canvas_sample[:self.n_call] if threads == 1 else list_id_canvas_sample[self.n_call:],
+                n_annotation=self.n_annotation,
+                threads=threads,
+                pbar_desc=desc
+            ))
+            # reads and updates are done on random keys, with replacement
+            for op, func, keys in [
+                ("get_annotation_list", adapter.get_annotation_list, list_id_canvas_annotations),
+                ("search", adapter.search, list_id_manifest),
+                ("get_manifest", adapter.get_manifest, list_id_manifest),
+            ]:
+                self.run_op(op, lambda threads, desc: mt_apply(
+                    func=wrap(op, func, {}),
+                    data=random.choices(keys, k=self.n_call),
+                    threads=threads,
+                    pbar_desc=desc
+                ))
+            list_annotation = [
+                annotation
+                for id_canvas in list_id_canvas_annotations[:self.n_call]
+                for annotation in adapter.get_annotation_list(id_canvas)["resources"]
+            ]
+            self.run_op("update_annotation", lambda threads, desc: mt_apply(
+                func=wrap("update_annotation", adapter.update_annotation, 0),
+                data=random.choices(list_annotation, k=self.n_call),
+                threads=threads,
+                pbar_desc=desc
+            ))
+            # each annotation is deleted once
+            list_id_annotation = [ a["@id"] for a in random.sample(list_annotation, min(len(list_annotation), 2 * self.n_call)) ]
+            self.run_op("delete_annotation", lambda threads, desc: mt_apply(
+                func=wrap("delete_annotation", adapter.delete_annotation, 0),
+                data=list_id_annotation[:self.n_call] if threads == 1 else list_id_annotation[self.n_call:],
+                threads=threads,
+                pbar_desc=desc
+            ))
+        finally:
+            self.server.shutdown()
+            self.recorder.close()
+
+        report = self.to_report()
+        self.print_report(report)
+        if not self.nowrite:
+            write_report(self.report_basename, report)
+        return report
+
+    def to_report(self) -> Dict:
+        """
+        :returns: { ..., "results": { <op>: { <mode>: {
+            "threads", "n_success", "n_error", "throughput": successful calls per second, "latency": latency summary of successful calls
+        } } } }
+        """
+        summary = self.operation_stats.summary()
+        results = {}
+        for op, durations in self.durations.items():
+            results[op] = {}
+            for mode, duration in durations.items():
+                stats = summary.get(mode, {}).get(op, { "n_success": 0, "n_error": 0, "n_timeout": 0, "latency_success": None })
+                results[op][mode] = {
+                    "threads": 1 if mode == "sequential" else self.threads,
+                    "n_success": stats["n_success"],
+                    "n_error": stats["n_error"] + stats["n_timeout"],
+                    "throughput": stats["n_success"] / duration if duration > 0 else None,
+                    "latency": stats["latency_success"],
+                }
+        return {
+            "server_name": "null",
+            "n_threads": self.threads,
+            "n_call": self.n_call,
+            "n_canvas_per_manifest": self.n_canvas,
+            "n_annotation_per_canvas": self.n_annotation,
+            "time_unit": "seconds",
+            "results": results,
+        }
+
+    def print_report(self, report: Dict) -> None:
+        print("\nCALIBRATION: throughput (successful calls per second) and latency of the benchmark client, against a null server\n")
+        print(f"{'operation':<24}{'1 thread':>12}{'p50 (ms)':>12}{f'{self.threads} threads':>14}{'p50 (ms)':>12}{'p95 (ms)':>12}")
+        for op, modes in report["results"].items():
+            row = f"{op:<24}"
+            for mode, width in [("sequential", 12), ("concurrent", 14)]:
+                data = modes[mode]
+                latency = data["latency"] or {}
+                row += f"{data['throughput'] or 0:>{width}.1f}{(latency.get('p50') or 0) * 1000:>12.2f}"
+                if mode == "concurrent":
+                    row += f"{(latency.get('p95') or 0) * 1000:>12.2f}"
+            print(row)
+        errors = { op: sum(m["n_error"] for m in modes.values()) for op, modes in report["results"].items() }
+        if any(errors.values()):
+            print("\nWARNING: some calls failed against the null server:")
+            pprint({ op: n for op, n in errors.items() if n })
+        print("")
+        return
+
+
+def calibrate_runner(
+    threads: int = THREADS_DEFAULT,
+    n_call: int = CALIBRATE_N_CALL,
+    n_canvas: int = CALIBRATE_N_CANVAS,
+    n_annotation: int = N_ANNOTATIONS_PER_CANVAS,
+    nowrite: bool = False,
+) -> None:
+    """define a calibration and run it"""
+    Calibration(
+        threads=threads,
+        n_call=n_call,
+        n_canvas=n_canvas,
+        n_annotation=n_annotation,
+        nowrite=nowrite,
+    ).run()
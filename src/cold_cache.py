@@ -0,0 +1,98 @@
+"""
+cold cache: empty the database caches before a phase, to measure what users
+experience when reading rarely-viewed manuscripts.
+
+after the populate phase, most of the data is in the database's cache (WiredTiger
+for MongoDB) and in the OS page cache. to make caches cold:
+1. the database (and, optionally, the annotation server) is restarted with a shell
+   command (by default `COLD_CACHE_COMMAND_DEFAULT`, which restarts `mongod`).
+2. the OS page cache is dropped, if permitted (as root, or with passwordless sudo).
+3. the benchmark waits until the annotation server can read from the database again.
+
+this only makes sense if the database runs on the same machine as the benchmark.
+"""
+
+import os
+import time
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from src.utils import run_bash
+from src.adapter_core import ADAPTER_ERRORS
+from src.constants import COLD_CACHE_WAIT_TIMEOUT, COLD_CACHE_POLL_INTERVAL
+
+PATH_DROP_CACHES = Path("/proc/sys/vm/drop_caches")
+
+
+def validate_cold_cache(cold_cache, command) -> None:
+    if cold_cache is not None and (not isinstance(cold_cache, int) or cold_cache < 1):
+        raise ValueError(f"validate_cold_cache: 'cold_cache' must be None or an integer >= 1, got {cold_cache}")
+    if not isinstance(command, str) or not command.strip():
+        raise ValueError(f"validate_cold_cache: 'command' must be a non-empty string, got '{command}'")
+
+
+def drop_os_caches() -> bool:
+    """
+    write dirty pages to disk and drop the OS page cache (linux only).
+
+    :returns: True if the page cache was dropped
+    """
+    if not PATH_DROP_CACHES.exists():
+        return False
+    os.sync()
+    try:
+        PATH_DROP_CACHES.write_text("3")
+        return True
+    except OSError:
+        pass
+    # not root: try passwordless sudo. `-n` fails instead of prompting for a password.
+    result = subprocess.run(
+        ["sudo", "-n", "sh", "-c", f"echo 3 > {PATH_DROP_CACHES}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return result.returncode == 0
+
+
+def wait_until_ready(probe: Callable[[], Any], timeout: float = COLD_CACHE_WAIT_TIMEOUT) -> None:
+    """
+    call `probe` until it succeeds. the annotation server may answer before it has
+    reconnected to the database, so `probe` should be a request that reads from the
+    database (i.e., reading the annotations of a canvas that doesn't exist).
+
+    :param probe: function that raises one of `ADAPTER_ERRORS` (i.e., `UnexpectedStatus`) while the server isn't ready
+    """
+    start = time.time()
+    while True:
+        try:
+            probe()
+            return
+        except ADAPTER_ERRORS:
+            if time.time() - start > timeout:
+                raise TimeoutError(f"wait_until_ready: the annotation server was not ready within {timeout}s")
+            time.sleep(COLD_CACHE_POLL_INTERVAL)
+
+
+def make_cache_cold(command: str, probe: Callable[[], Any]) -> Dict:
+    """
+    restart the database with `command`, drop the OS page cache and wait for the annotation server.
+
+    :param probe: see `wait_until_ready`
+    :returns: { "restart_duration": time to run `command`, in seconds,
+                "wait_duration": time until the annotation server answered, in seconds,
+                "os_cache_dropped": bool }
+    """
+    s = time.time()
+    run_bash(command)
+    restart_duration = time.time() - s
+    os_cache_dropped = drop_os_caches()
+    if not os_cache_dropped:
+        print("WARNING: make_cache_cold: could not drop the OS page cache (requires root or passwordless sudo)")
+    s = time.time()
+    wait_until_ready(probe)
+    return {
+        "restart_duration": restart_duration,
+        "wait_duration": time.time() - s,
+        "os_cache_dropped": os_cache_dropped,
+    }
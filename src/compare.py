@@ -0,0 +1,226 @@
+"""
+compare benchmark reports to detect regressions.
+
+the 1st report is the baseline, all other reports are compared to it.
+steps are matched by their number of annotations, and a metric is a regression
+if it is slower than the baseline by more than `threshold` (relative), and, when
+samples are available in both reports, if the difference is statistically
+significant at level `alpha`:
+- if both reports have a request log, per-request latencies are compared with a Mann-Whitney U test.
+- otherwise, if both reports have several trials, trials are compared with a Welch's t-test.
+
+bytes on the wire and client CPU time per operation are printed side by side too (i.e., to
+compare a report made with `--compression gzip` to one made without), but are not regressions.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.utils import json_read
+from src.stats import welch_ttest, mann_whitney_u
+from src.metrics import index_latencies
+from src.visualize import get_latest_report_file
+
+
+# (phase, adapter operation) of the request log records that make up a benchmark metric.
+METRIC_TO_OPERATION = {
+    "timing_read_annotation_list": ("read", "get_annotation_list"),
+    "timing_read_annotation": ("read", "get_annotation"),
+    "timing_read_annotation_list_cold": ("read_cold", "get_annotation_list"),
+    "timing_search_manifest_annotated": ("search_annotated", "search"),
+    "timing_search_manifest_empty": ("search_empty", "search"),
+    "timing_read_manifest": ("read_manifest", "get_manifest"),
+    "timing_list_manifest_collection": ("list_manifests", "list_manifest_collection"),
+    "timing_write_manifest": ("write", "insert_manifest"),
+    "timing_write_annotation": ("write", "insert_annotation"),
+    "timing_write_annotation_list": ("write", "insert_annotation_list"),
+    "timing_update_annotation": ("update", "update_annotation"),
+    "timing_delete_annotation": ("delete", "delete_annotation"),
+    "timing_delete_manifest_annotations": ("delete_manifest_annotations", "delete_annotations_for_manifest"),
+    "timing_delete_manifest": ("delete_manifest", "delete_manifest"),
+}
+
+
+def load_report(report_file: str|Path) -> Dict:
+    """load a report. `report_file` is either a path or `latest`"""
+    if report_file == "latest":
+        report_file = get_latest_report_file()
+    report_file = Path(report_file)
+    if not report_file.exists():
+        raise FileNotFoundError(f"load_report: report file not found: '{report_file}'")
+    report = json_read(report_file)
+    report["__file__"] = report_file.name
+    # request logs are written next to their report
+    request_log = report.get("request_log", None)
+    report["__request_log__"] = (
+        report_file.parent / request_log
+        if request_log is not None and (report_file.parent / request_log).exists()
+        else None
+    )
+    # the request log is read once: { (step, phase, op): [latency] }
+    report["__latencies__"] = (
+        index_latencies(report["__request_log__"])
+        if report["__request_log__"] is not None
+        else None
+    )
+    return report
+
+def get_steps_by_n_annotation(report: Dict) -> Dict[int, Dict]:
+    return {
+        step["step"]["n_annotation"]: step
+        for step in report["results"]
+    }
+
+def get_metrics(step: Dict) -> List[str]:
+    return [ k for k in step.keys() if k.startswith("timing_") and step[k] is not None ]
+
+def get_samples(step: Dict, metric: str) -> List[float]:
+    """per-trial values of `metric`, or [] if the report has no trials"""
+    return step.get("trials", {}).get(metric, {}).get("values", [])
+
+def get_latency_samples(report: Dict, step: Dict, metric: str) -> List[float]:
+    """per-request latencies of `metric` at `step`, or [] if the report has no request log"""
+    if report["__latencies__"] is None or metric not in METRIC_TO_OPERATION:
+        return []
+    phase, op = METRIC_TO_OPERATION[metric]
+    return report["__latencies__"].get((step["step"]["index"], phase, op), [])
+
+def significance_test(report_base: Dict, step_base: Dict, report_cand: Dict, step_cand: Dict, metric: str) -> Optional[Dict]:
+    """test the difference between 2 steps on the best samples available, or return None if there are none"""
+    test = mann_whitney_u(
+        get_latency_samples(report_base, step_base, metric),
+        get_latency_samples(report_cand, step_cand, metric)
+    )
+    if test is None:
+        test = welch_ttest(get_samples(step_base, metric), get_samples(step_cand, metric))
+    return test
+
+def compare_metric(report_base: Dict, step_base: Dict, report_cand: Dict, step_cand: Dict, metric: str, threshold: float, alpha: float) -> Dict:
+    """
+    compare a single metric between 2 steps.
+
+    :returns: {
+        "metric", "baseline", "candidate",
+        "delta": relative difference (positive = slower),
+        "test": result of the significance test, or None if no samples are available
+        "regression": bool
+    }
+    """
+    base = step_base[metric]
+    cand = step_cand[metric]
+    delta = (cand - base) / base if base else 0.0
+    test = significance_test(report_base, step_base, report_cand, step_cand, metric)
+    significant = test is None or test["p_value"] < alpha
+    return {
+        "metric": metric,
+        "baseline": base,
+        "candidate": cand,
+        "delta": delta,
+        "test": test,
+        "regression": delta > threshold and significant,
+    }
+
+def compare_transfer(step_base: Dict, step_cand: Dict) -> List[Dict]:
+    """
+    compare the bytes sent and received and the client CPU time of the operations of 2 steps.
+
+    :returns: [{ "phase", "op", "baseline", "candidate": mean "request_size", "size", "wire_size" and "cpu" of successful calls }]
+    """
+    ops_base = step_base.get("operations") or {}
+    ops_cand = step_cand.get("operations") or {}
+    out = []
+    for phase in sorted(set(ops_base.keys()) & set(ops_cand.keys())):
+        for op in sorted(set(ops_base[phase].keys()) & set(ops_cand[phase].keys())):
+            # reports made before compression was supported have no `transfer`
+            base = ops_base[phase][op].get("transfer")
+            cand = ops_cand[phase][op].get("transfer")
+            if base is not None and cand is not None:
+                out.append({ "phase": phase, "op": op, "baseline": base, "candidate": cand })
+    return out
+
+def compare_two(report_base: Dict, report_cand: Dict, threshold: float, alpha: float) -> List[Dict]:
+    """
+    compare all steps shared by 2 reports.
+
+    :returns: a list of { "n_annotation": int, "metrics": [<output of compare_metric>], "transfer": <output of compare_transfer> }
+    """
+    steps_base = get_steps_by_n_annotation(report_base)
+    steps_cand = get_steps_by_n_annotation(report_cand)
+    out = []
+    for n_annotation in sorted(set(steps_base.keys()) & set(steps_cand.keys())):
+        step_base = steps_base[n_annotation]
+        step_cand = steps_cand[n_annotation]
+        metrics = [ m for m in get_metrics(step_base) if m in get_metrics(step_cand) ]
+        out.append({
+            "n_annotation": n_annotation,
+            "metrics": [
+                compare_metric(report_base, step_base, report_cand, step_cand, m, threshold, alpha)
+                for m in metrics
+            ],
+            "transfer": compare_transfer(step_base, step_cand),
+        })
+    return out
+
+def format_p_value(test: Optional[Dict]) -> str:
+    return "-" if test is None else f"{test['p_value']:.3f}"
+
+def print_comparison(name_base: str, name_cand: str, comparison: List[Dict]) -> None:
+    print(f"\nBASELINE : {name_base}\nCANDIDATE: {name_cand}\n")
+    if not len(comparison):
+        print("no steps in common (steps are matched by `n_annotation`)")
+        return
+    header = f"{'metric':<34} {'baseline':>12} {'candidate':>12} {'delta':>9} {'p-value':>8} {'test':>15}"
+    for step in comparison:
+        print(f"n_annotation={step['n_annotation']:,}")
+        print(header)
+        print("-" * len(header))
+        for m in step["metrics"]:
+            flag = "  REGRESSION" if m["regression"] else ""
+            print(
+                f"{m['metric']:<34} {m['baseline']:>12.6f} {m['candidate']:>12.6f} "
+                f"{m['delta']:>+8.1%} {format_p_value(m['test']):>8} {m['test']['test'] if m['test'] else '-':>15}{flag}"
+            )
+        print("")
+        if len(step["transfer"]):
+            print_transfer(step["transfer"])
+    return
+
+def print_transfer(transfer: List[Dict]) -> None:
+    """print the mean bytes per call (sent, and received on the wire) and CPU time per call, baseline -> candidate"""
+    header = f"{'phase/operation':<50} {'sent (B)':>21} {'received (B)':>21} {'cpu (ms)':>17}"
+    print(header)
+    print("-" * len(header))
+    for t in transfer:
+        base = t["baseline"]
+        cand = t["candidate"]
+        print(
+            f"{t['phase'] + '/' + t['op']:<50} {base['request_size']:>10.0f}>{cand['request_size']:<10.0f} "
+            f"{base['wire_size']:>10.0f}>{cand['wire_size']:<10.0f} {base['cpu'] * 1000:>8.3f}>{cand['cpu'] * 1000:<8.3f}"
+        )
+    print("")
+    return
+
+def compare_reports(report_files: List[str], threshold: float, alpha: float) -> int:
+    """
+    compare all reports to the 1st one and print the results.
+
+    :returns: the number of regressions found
+    """
+    if len(report_files) < 2:
+        raise ValueError(f"compare_reports: at least 2 reports are needed, got {len(report_files)}")
+    if threshold < 0:
+        raise ValueError(f"compare_reports: 'threshold' must be >= 0, got {threshold}")
+    if not (0 < alpha < 1):
+        raise ValueError(f"compare_reports: 'alpha' must be in range 0..1, got {alpha}")
+
+    reports = [ load_report(f) for f in report_files ]
+    report_base = reports[0]
+    n_regression = 0
+    for report_cand in reports[1:]:
+        comparison = compare_two(report_base, report_cand, threshold, alpha)
+        print_comparison(report_base["__file__"], report_cand["__file__"], comparison)
+        n_regression += sum(
+            m["regression"] for step in comparison for m in step["metrics"]
+        )
+    print(f"{n_regression} regression(s) found (threshold={threshold:.1%}, alpha={alpha})")
+    return n_regression
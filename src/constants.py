@@ -25,9 +25,16 @@ AIIINOTATE_HOST = os.getenv("AIIINOTATE_HOST")
 AIIINOTATE_PORT = os.getenv("AIIINOTATE_PORT")
 AIIINOTATE_SCHEME = os.getenv("AIIINOTATE_SCHEME")
 
+# the constants below are the defaults of the benchmark. they can be overridden
+# without editing the source with a scenario file (see `src/scenario.py`).
+
 # number of times a single benchmark operation is repeated
 N_ITERATIONS = 50
 
+# number of times the whole manifest collection is listed in each trial.
+# listing is much slower than other operations on large databases, so it gets fewer iterations.
+N_ITERATIONS_COLLECTION = 5
+
 # number of annotations per canvas, if a canvas has annotations. the point
 # is to insert and read "large" annotation lists.
 N_ANNOTATIONS_PER_CANVAS = 100
@@ -103,4 +110,129 @@ STEPS = [
 N_STEPS_DEFAULT = 3
 
 # default number of threads to use
-THREADS_DEFAULT = 20
\ No newline at end of file
+THREADS_DEFAULT = 20
+
+# `src/multithread.py`: number of items in each chunk of work taken by a thread, max number of chunks
+# waiting in the queue per thread, time (in seconds) between 2 checks of the queue by idle threads,
+# and time (in seconds) between 2 updates of the progress bar.
+MULTITHREAD_CHUNK_SIZE = 8
+MULTITHREAD_QUEUE_SIZE = 4
+MULTITHREAD_POLL_INTERVAL = 0.05
+MULTITHREAD_REPORT_INTERVAL = 0.25
+
+# automatic tuning of the number of populate threads (`--autotune`, see `src/autotune.py`):
+# - numbers of threads that are probed, in order
+# - number of items inserted by each thread of a probe
+# - max share of the items of a populate that can be used by probes
+# - min relative throughput increase for a probe to be an improvement, and number of probes
+#   in a row without improvement after which probing stops
+# - the chosen number of threads is the smallest whose throughput is within this share of the best throughput
+AUTOTUNE_CANDIDATES = [1, 2, 4, 8, 16, 32, 64]
+AUTOTUNE_ITEMS_PER_THREAD = 4
+AUTOTUNE_BUDGET = 0.25
+AUTOTUNE_MIN_GAIN = 0.05
+AUTOTUNE_PATIENCE = 2
+AUTOTUNE_TOLERANCE = 0.1
+
+# producer/consumer pipeline (`--pipeline`, see `src/pipeline.py`): number of serialized payloads
+# that can wait in the buffer between producers and senders, per sender thread.
+PIPELINE_BUFFER_PER_SENDER = 4
+
+# calibration against the null server (`main.py calibrate`): default number of calls of each operation
+# in each mode (1 thread, then `--threads` threads), and number of canvases per inserted manifest.
+CALIBRATE_N_CALL = 500
+CALIBRATE_N_CANVAS = 10
+
+# SAS has no bulk routes, so the annotations of a list are inserted or deleted one by one, by a pool
+# of threads shared by all populate threads: default size of the pool (`--sas-fanout`), which is also
+# the max number of annotation requests in flight.
+SAS_FANOUT_DEFAULT = 32
+
+# adaptive concurrency limiter (`--adaptive`, see `src/limiter.py`): initial number of requests in flight,
+# factor by which the limit is multiplied when the server is overloaded, max ratio between the moving average
+# of the latency and its lowest value before the server is considered overloaded, and weight of the last
+# request in the moving average.
+AIMD_INITIAL_LIMIT = 4
+AIMD_DECREASE = 0.7
+AIMD_LATENCY_TOLERANCE = 2.0
+AIMD_LATENCY_SMOOTHING = 0.1
+# default number of trials: number of times the benchmark phase is repeated
+# on the same populated database, to measure run-to-run variance.
+N_TRIALS_DEFAULT = 1
+
+# default regression threshold when comparing reports: a metric that is more
+# than 10% slower than in the baseline report is a regression.
+COMPARE_THRESHOLD_DEFAULT = 0.1
+
+# default significance level of statistical tests when comparing reports.
+COMPARE_ALPHA_DEFAULT = 0.05
+
+# sampling interval (in seconds) of the client profiler (`--profile-client`)
+PROFILE_CLIENT_INTERVAL = 0.005
+
+# number of records buffered in memory before being appended to the request log
+REQUEST_LOG_BUFFER_SIZE = 1000
+
+# duration (in seconds) of the rolling window over which live metrics (`--metrics-port`) are computed
+LIVE_METRICS_WINDOW = 60
+
+# default timeouts (in seconds) of requests to the annotation server:
+# time to connect, and max time to wait between 2 bytes of a response.
+TIMEOUT_CONNECT_DEFAULT = 5
+TIMEOUT_READ_DEFAULT = 120
+
+# default max number of times a failed request is retried, and time (in
+# seconds) to wait before the 1st retry (doubled at each retry).
+RETRIES_DEFAULT = 2
+BACKOFF_DEFAULT = 0.5
+
+# level of the compression of request bodies (`--compression`), from 1 (fastest) to 9 (smallest).
+# 6 is the default of zlib.
+COMPRESSION_LEVEL = 6
+
+# size (in bytes) of the chunks in which large responses (i.e., the manifest collection) are streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# list-size sweep (`--sweep`): default sizes of the annotation lists, and number of lists inserted and read for each size
+SWEEP_LIST_SIZES_DEFAULT = [10, 100, 1000, 10000]
+SWEEP_N_ITERATIONS = 10
+
+# local IIIF manifest server (`--manifest-server`): default artificial latency (in seconds) added
+# to each response, default seed of the generated canvases, and number of manifests kept in memory.
+MANIFEST_SERVER_LATENCY_DEFAULT = 0.0
+MANIFEST_SERVER_SEED_DEFAULT = 0
+MANIFEST_SERVER_CACHE_SIZE = 1024
+
+# key distribution of the benchmark phase (`--distribution`): default distribution, share of the keys
+# that are "hot" with the "uniform" and "zipf" distributions, and seed of the ranking of keys.
+DISTRIBUTION_DEFAULT = "uniform"
+DISTRIBUTION_HOT_SHARE = 0.1
+DISTRIBUTION_SEED = 0
+
+# cold cache (`--cold-cache`): default command that restarts the database, max time (in seconds)
+# to wait for the annotation server to be ready after the restart, and time between 2 checks.
+COLD_CACHE_COMMAND_DEFAULT = "sudo systemctl restart mongod"
+COLD_CACHE_WAIT_TIMEOUT = 120
+COLD_CACHE_POLL_INTERVAL = 0.5
+
+# HTTP vs. database latency attribution (`--db-latency`): max time (in seconds) to wait for MongoDB to answer
+DB_LATENCY_TIMEOUT = 5
+
+# soak test (`main.py soak`): default duration and window (in seconds), and number of threads sending requests
+SOAK_DURATION_DEFAULT = 3600
+SOAK_WINDOW_DEFAULT = 60
+SOAK_CONCURRENCY_DEFAULT = 4
+# workload of the soak test: probability of each operation. each inserted annotation is deleted later on.
+SOAK_MIX = {
+    "get_annotation_list": 0.5,
+    "search": 0.1,
+    "update_annotation": 0.1,
+    "insert_annotation": 0.15,
+    "delete_annotation": 0.15,
+}
+# how to find the processes whose memory is monitored during a soak test: (process name, pattern in the command line)
+SOAK_PROCESSES = {
+    "aiiinotate": ("node", "aiiinotate"),
+    "SimpleAnnotationServer": ("java", "SimpleAnnotationServer"),
+    "mongod": ("mongod", None),
+}
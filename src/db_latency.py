@@ -0,0 +1,149 @@
+"""
+HTTP vs. database latency attribution (`--db-latency`, aiiinotate only).
+
+after each benchmarked adapter call, the equivalent MongoDB query is run directly
+against aiiinotate's database, on the same key, and recorded as `db:<op>` (i.e.,
+`db:get_annotation_list`). comparing both latencies tells how much of an operation
+is spent in the database, and how much in aiiinotate (routing, validation,
+serialization) and on the network: the application overhead.
+
+| adapter call          | MongoDB query                                              |
+| --------------------- | ---------------------------------------------------------- |
+| `get_annotation_list` | `annotations2.find({"on.full": <canvas>})`                 |
+| `get_annotation`      | `annotations2.find_one({"@id": <annotation>})`             |
+| `get_manifest`        | `manifests2.find_one({"@id": <manifest>})`                 |
+| `update_annotation`   | `annotations2.update_one({"@id": <annotation>}, {"$set": <new selector>})` |
+
+notes:
+- the query runs right after the HTTP call, so the documents it reads are in the database's
+  cache. the DB latency is a lower bound, and the overhead an upper bound.
+- the query is only run if the HTTP call succeeded.
+- deletes are not attributed: an annotation can only be deleted once, and deleting a copy
+  inserted for the occasion would time a delete of a document that was just written, and is
+  in the cache. reading the annotation before the HTTP delete would warm the cache too, and
+  change the HTTP latency that is attributed.
+- requires `pymongo`, an optional dependency: `uv sync --extra db`.
+"""
+
+import random
+from typing import Any, Callable, Dict
+
+from src.metrics import Recorder
+from src.constants import DB_NAME, MONGODB_HOST, MONGODB_PORT, DB_LATENCY_TIMEOUT
+
+# prefix of the records of database queries
+DB_OP_PREFIX = "db:"
+
+
+def import_pymongo():
+    try:
+        import pymongo
+    except ImportError as e:
+        raise ImportError("import_pymongo: --db-latency requires pymongo. install it with: `uv sync --extra db`") from e
+    return pymongo
+
+
+def validate_db_latency(db_latency, server_is_aiiinotate: bool) -> None:
+    if not isinstance(db_latency, bool):
+        raise TypeError(f"validate_db_latency: 'db_latency' must be a boolean, got {type(db_latency)}")
+    if db_latency and not server_is_aiiinotate:
+        raise ValueError("validate_db_latency: 'db_latency' is only supported with aiiinotate: SAS doesn't use MongoDB")
+    if db_latency and (DB_NAME is None or MONGODB_HOST is None or MONGODB_PORT is None):
+        raise ValueError("validate_db_latency: 'db_latency' requires MONGODB_DB, MONGODB_HOST and MONGODB_PORT to be defined in .env.aiiinotate")
+
+
+class DbLatency:
+    def __init__(self, recorder: Recorder):
+        """
+        :param recorder: the benchmark's recorder. database queries are recorded in the same sinks as adapter calls.
+        """
+        pymongo = import_pymongo()
+        self.client = pymongo.MongoClient(
+            host=MONGODB_HOST,
+            port=int(MONGODB_PORT),  # pyright: ignore
+            serverSelectionTimeoutMS=DB_LATENCY_TIMEOUT * 1000,
+        )
+        # fail before the benchmark starts if the database can't be reached
+        self.client.admin.command("ping")
+        db = self.client[DB_NAME]
+        self.annotations = db["annotations2"]
+        self.manifests = db["manifests2"]
+        self.recorder = recorder
+        self.queries: Dict[str, Callable[[Any], bool]] = {
+            "get_annotation_list": self.find_annotation_list,
+            "get_annotation": self.find_annotation,
+            "get_manifest": self.find_manifest,
+            "update_annotation": self.update_annotation,
+        }
+
+    def find_annotation_list(self, id_canvas: str) -> bool:
+        # the cursor is consumed, to fetch all documents like the HTTP call does
+        list(self.annotations.find({ "on.full": id_canvas }))
+        return True
+
+    def find_annotation(self, id_annotation: str) -> bool:
+        return self.annotations.find_one({ "@id": id_annotation }) is not None
+
+    def find_manifest(self, id_manifest: str) -> bool:
+        return self.manifests.find_one({ "@id": id_manifest }) is not None
+
+    def update_annotation(self, annotation: Dict) -> bool:
+        # a new selector, so that the update is written, like in `Benchmark.update`
+        r = sorted(random.sample(range(0,1000), 4))
+        result = self.annotations.update_one(
+            { "@id": annotation["@id"] },
+            { "$set": { "on.0.selector.value": f"xywh={r[0]},{r[1]},{r[2]},{r[3]}" } }
+        )
+        return result.matched_count == 1
+
+    def wrap(self, op: str, func: Callable) -> Callable:
+        """
+        after each successful call to `func`, run the equivalent database query on the same key.
+
+        :param op: name of the adapter call (a key of `self.queries`)
+        :param func: the adapter call, wrapped by `Recorder.wrap`
+        """
+        query = self.recorder.wrap(f"{DB_OP_PREFIX}{op}", self.queries[op], False)
+
+        def wrapper(key, *args, **kwargs):
+            out = func(key, *args, **kwargs)
+            if out:
+                query(key)
+            return out
+        return wrapper
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def attribution(operations: Dict) -> Dict:
+    """
+    compare the latency of adapter calls to the latency of their database queries.
+
+    :param operations: the `operations` section of a step's report (see `OperationStats.summary`)
+    :returns: { <phase>: { <op>: {
+        "http": latency summary of the successful calls,
+        "db": latency summary of the successful queries,
+        "overhead": { "mean", "p50": http - db, "share": share of the mean http latency that is not spent in the database }
+    } } }
+    """
+    out: Dict[str, Dict] = {}
+    for phase, ops in operations.items():
+        for op, stats in ops.items():
+            db_stats = ops.get(f"{DB_OP_PREFIX}{op}")
+            if op.startswith(DB_OP_PREFIX) or db_stats is None:
+                continue
+            http = stats["latency_success"]
+            db = db_stats["latency_success"]
+            if http is None or db is None:
+                continue
+            out.setdefault(phase, {})[op] = {
+                "http": http,
+                "db": db,
+                "overhead": {
+                    "mean": http["mean"] - db["mean"],
+                    "p50": http["p50"] - db["p50"] if http["p50"] is not None and db["p50"] is not None else None,
+                    "share": (http["mean"] - db["mean"]) / http["mean"] if http["mean"] > 0 else None,
+                },
+            }
+    return out
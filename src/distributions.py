@@ -0,0 +1,136 @@
+"""
+key distributions: how the benchmark phase picks the canvases, annotations and
+manifests it works on.
+
+- "uniform": all keys are equally likely (the default).
+- "zipf:<s>": keys are ranked, and the key of rank `r` is picked with a probability
+  proportional to `1 / r^s`: a few keys get most requests, like a few popular manuscripts.
+- "hotspot:<x>:<y>": a share `x` of requests goes to a share `y` of the keys (i.e.,
+  `hotspot:0.9:0.1`: 90% of requests on 10% of the keys).
+
+each key is either "hot" or "cold". the hot keys are the hotspot for "hotspot:<x>:<y>",
+and the share `DISTRIBUTION_HOT_SHARE` of top-ranked keys for "zipf" and "uniform"
+(with a uniform distribution, hot and cold keys should have the same latency).
+keys are ranked by a hash of the key and the seed, so a key keeps its rank (and is hot
+or cold) in all trials and phases of a benchmark.
+"""
+
+import random
+import hashlib
+from heapq import nlargest
+from typing import Any, Callable, Dict, List, Optional
+
+from src.constants import DISTRIBUTION_HOT_SHARE, DISTRIBUTION_SEED
+
+DISTRIBUTIONS = ["uniform", "zipf", "hotspot"]
+
+
+def validate_distribution(name: str, s: float|None = None, x: float|None = None, y: float|None = None) -> None:
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"validate_distribution: distribution must be one of {DISTRIBUTIONS}, got '{name}'")
+    if name == "zipf" and (not isinstance(s, (int, float)) or s <= 0):
+        raise ValueError(f"validate_distribution: zipf parameter 's' must be a number > 0, got {s}")
+    if name == "hotspot":
+        for k, v in [("x", x), ("y", y)]:
+            if not isinstance(v, (int, float)) or not (0 < v < 1):
+                raise ValueError(f"validate_distribution: hotspot parameter '{k}' must be a number in range 0..1 (exclusive), got {v}")
+
+
+class KeyDistribution:
+    def __init__(
+        self,
+        name: str = "uniform",
+        s: float|None = None,
+        x: float|None = None,
+        y: float|None = None,
+        seed: int = DISTRIBUTION_SEED
+    ):
+        """
+        view the module's docstring for info on the arguments.
+        """
+        validate_distribution(name, s, x, y)
+        self.name = name
+        self.s = s
+        self.x = x
+        self.y = y
+        self.seed = seed
+        self.hot_share = y if name == "hotspot" else DISTRIBUTION_HOT_SHARE
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "s": self.s,
+            "x": self.x,
+            "y": self.y,
+            "hot_share": self.hot_share,
+            "seed": self.seed,
+        }
+
+    def hotness(self, key: str) -> float:
+        """position of `key` in the ranking, as a float in range 0..1 (0 = most popular)"""
+        digest = hashlib.blake2b(f"{self.seed}/{key}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64
+
+    def classify(self, key: str) -> str:
+        """"hot" or "cold" """
+        return "hot" if self.hotness(key) < self.hot_share else "cold"
+
+    def weights(self, keys: List[str]) -> List[float]:
+        """relative probability of picking each of `keys`. items that share a key have the same weight."""
+        if self.name == "zipf":
+            ranked = sorted(set(keys), key=self.hotness)
+            rank = { k: i+1 for i, k in enumerate(ranked) }
+            return [ 1 / rank[k] ** self.s for k in keys ]  # pyright: ignore
+        if self.name == "hotspot":
+            is_hot = [ self.hotness(k) < self.hot_share for k in keys ]
+            n_hot = sum(is_hot)
+            n_cold = len(keys) - n_hot
+            # if there are only hot or only cold keys, all keys are equally likely
+            if n_hot == 0 or n_cold == 0:
+                return [ 1.0 ] * len(keys)
+            w_hot = self.x / n_hot  # pyright: ignore
+            w_cold = (1 - self.x) / n_cold  # pyright: ignore
+            return [ w_hot if h else w_cold for h in is_hot ]
+        return [ 1.0 ] * len(keys)
+
+    def sample(self, items: List, k: int, key: Optional[Callable[[Any], str]] = None, replace: Optional[bool] = None) -> List:
+        """
+        pick min(k, len(items)) items.
+
+        :param key: function that returns the key of an item (by default, the item itself)
+        :param replace: if True, an item can be picked several times. by default, items are picked
+            once with the uniform distribution, and several times with skewed distributions:
+            popular keys are requested over and over.
+        """
+        k = min(k, len(items))
+        if k == 0:
+            return []
+        if replace is None:
+            replace = self.name != "uniform"
+        if self.name == "uniform":
+            return random.choices(items, k=k) if replace else random.sample(items, k)
+        weights = self.weights([ key(i) if key is not None else i for i in items ])
+        if replace:
+            return random.choices(items, weights=weights, k=k)
+        # weighted sampling without replacement (Efraimidis-Spirakis): keep the k largest `u^(1/w)`
+        idx = nlargest(k, range(len(items)), key=lambda i: random.random() ** (1 / weights[i]))
+        return [ items[i] for i in idx ]
+
+
+def parse_distribution(spec: str, seed: int = DISTRIBUTION_SEED) -> KeyDistribution:
+    """
+    parse a distribution from the CLI: "uniform", "zipf:<s>" or "hotspot:<x>:<y>"
+    """
+    name, *params = spec.strip().split(":")
+    expected = { "uniform": 0, "zipf": 1, "hotspot": 2 }
+    if name not in expected or len(params) != expected[name]:
+        raise ValueError(f"parse_distribution: expected 'uniform', 'zipf:<s>' or 'hotspot:<x>:<y>', got '{spec}'")
+    try:
+        values = [ float(p) for p in params ]
+    except ValueError:
+        raise ValueError(f"parse_distribution: parameters of '{spec}' must be numbers")
+    if name == "zipf":
+        return KeyDistribution(name, s=values[0], seed=seed)
+    if name == "hotspot":
+        return KeyDistribution(name, x=values[0], y=values[1], seed=seed)
+    return KeyDistribution(name, seed=seed)
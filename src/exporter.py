@@ -0,0 +1,159 @@
+"""
+live metrics exporter, to follow long benchmark runs.
+
+`LiveMetrics` is a sink of `src.metrics.Recorder`: it receives the same records
+as the request log, and keeps the records of the last `window` seconds in memory.
+`serve_live_metrics` exposes them, along with the progress of the thread pools
+that populate and purge the database, on a local HTTP endpoint, in Prometheus text
+format: `curl http://127.0.0.1:<port>/metrics`, or scrape it with Prometheus.
+"""
+
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from src.metrics import Recorder
+from src.multithread import active_progress
+from src.local_server import LocalServer, QuietHandler, serve_in_thread
+from src.constants import LIVE_METRICS_WINDOW
+
+PREFIX = "aiiinotate_benchmark"
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    """nearest-rank quantile of a sorted, non-empty list"""
+    idx = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class LiveMetrics:
+    def __init__(self, recorder: Recorder, window: float = LIVE_METRICS_WINDOW):
+        """
+        :param recorder: the recorder this sink is attached to, to read the current step and phase.
+        :param window: duration (in seconds) over which rates and latency percentiles are computed.
+        """
+        self.recorder = recorder
+        self.window = window
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        # (end of the request, op, latency, outcome), for the last `window` seconds
+        self._recent: Deque[Tuple[float, str, float, str]] = deque()
+        # cumulative number of requests per (op, outcome)
+        self._totals: Dict[Tuple[str, str], int] = {}
+
+    def __call__(self, record: Dict) -> None:
+        end = record["ts"] + record["latency"]
+        with self._lock:
+            self._recent.append((end, record["op"], record["latency"], record["outcome"]))
+            key = (record["op"], record["outcome"])
+            self._totals[key] = self._totals.get(key, 0) + 1
+            # pruned here too, so that memory stays bounded when the metrics are not scraped
+            self._prune(end)
+
+    def _prune(self, now: float) -> None:
+        """drop the records older than `self.window`. the caller must hold `self._lock`"""
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def snapshot(self) -> Dict:
+        """
+        :returns: {
+            "totals": { (op, outcome): count },
+            "ops": { op: {"rate", "error_ratio", "timeout_ratio", "latencies": sorted latencies of successful requests} },
+        }
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            recent = list(self._recent)
+            totals = dict(self._totals)
+        # at the start of the run, rates are computed over the time elapsed
+        duration = min(self.window, now - self.started_at) or self.window
+        ops: Dict[str, Dict] = {}
+        for _, op, latency, outcome in recent:
+            if op not in ops:
+                ops[op] = { "n": 0, "n_error": 0, "n_timeout": 0, "latencies": [] }
+            ops[op]["n"] += 1
+            ops[op]["n_error"] += 1 if outcome == "error" else 0
+            ops[op]["n_timeout"] += 1 if outcome == "timeout" else 0
+            if outcome == "success":
+                ops[op]["latencies"].append(latency)
+        for op, data in ops.items():
+            data["rate"] = data["n"] / duration
+            data["error_ratio"] = data["n_error"] / data["n"]
+            data["timeout_ratio"] = data["n_timeout"] / data["n"]
+            data["latencies"].sort()
+        return { "totals": totals, "ops": ops }
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name: str, mtype: str, help_: str, samples: List[Tuple[Dict, float]]):
+            lines.append(f"# HELP {PREFIX}_{name} {help_}")
+            lines.append(f"# TYPE {PREFIX}_{name} {mtype}")
+            for labels, value in samples:
+                labels_str = ",".join(f"{k}=\"{escape_label(v)}\"" for k, v in labels.items())
+                lines.append(f"{PREFIX}_{name}{{{labels_str}}} {value}" if labels_str else f"{PREFIX}_{name} {value}")
+
+        metric("step", "gauge", "index of the current step", [
+            ({}, self.recorder.step or 0)
+        ])
+        metric("trial", "gauge", "index of the current trial (0 outside of the benchmark phase)", [
+            ({}, self.recorder.trial or 0)
+        ])
+        metric("phase_info", "gauge", "current phase of the step", [
+            ({ "phase": self.recorder.phase or "none" }, 1)
+        ])
+        metric("requests_total", "counter", "number of requests since the start of the benchmark", [
+            ({ "op": op, "outcome": outcome }, n)
+            for (op, outcome), n in sorted(snapshot["totals"].items())
+        ])
+        metric("ops_per_second", "gauge", f"requests per second over the last {self.window:g} seconds", [
+            ({ "op": op }, data["rate"]) for op, data in sorted(snapshot["ops"].items())
+        ])
+        metric("error_ratio", "gauge", f"share of failed requests over the last {self.window:g} seconds", [
+            ({ "op": op }, data["error_ratio"]) for op, data in sorted(snapshot["ops"].items())
+        ])
+        metric("timeout_ratio", "gauge", f"share of timed out requests over the last {self.window:g} seconds", [
+            ({ "op": op }, data["timeout_ratio"]) for op, data in sorted(snapshot["ops"].items())
+        ])
+        metric("latency_seconds", "gauge", f"latency percentiles of successful requests over the last {self.window:g} seconds", [
+            ({ "op": op, "quantile": q }, quantile(data["latencies"], q))
+            for op, data in sorted(snapshot["ops"].items())
+            if len(data["latencies"])
+            for q in QUANTILES
+        ])
+        # progress of the populate and purge pools, counted by their worker threads
+        pools = active_progress()
+        # not a counter: it restarts from 0 with each pool
+        metric("pool_items", "gauge", "number of items processed by the running thread pools", [
+            ({ "pool": pool["desc"], "outcome": outcome }, pool[outcome])
+            for pool in pools
+            for outcome in ["success", "error"]
+        ])
+        metric("pool_items_per_second", "gauge", "items processed per second by the running thread pools, since they started", [
+            ({ "pool": pool["desc"] }, pool["throughput"]) for pool in pools
+        ])
+        return "\n".join(lines) + "\n"
+
+
+def serve_live_metrics(live_metrics: LiveMetrics, port: int) -> LocalServer:
+    """
+    serve `live_metrics` on http://127.0.0.1:<port>/metrics, in a daemon thread.
+    """
+    class Handler(QuietHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ["/", "/metrics"]:
+                self.send_error(404)
+                return
+            body = live_metrics.to_prometheus().encode("utf-8")
+            self.send_body(body, "text/plain; version=0.0.4; charset=utf-8")
+
+    server = serve_in_thread(Handler, port)
+    print(f"live metrics served at: http://127.0.0.1:{port}/metrics")
+    return server
@@ -1,5 +1,7 @@
 from typing import List, Dict, Tuple, Generator
+from hashlib import blake2b
 from uuid import uuid4
+import re
 
 import random
 import string
@@ -15,8 +17,17 @@ from src.constants import  PATH_CANVAS_2_TEMPLATE, PATH_MANIFEST_2_TEMPLATE, PAT
 # in turn, we put manifest @ids on a closed localhost port. this means:
 # - that HTTP fetches fail almost instantly => more deterministic
 # - that benchmarked insert times are much faster than actual insert times.
+# to benchmark the real insert path, serve the manifests with the local manifest
+# server (`src.manifest_server`, `--manifest-server`), which updates `URI_ROOT`.
 URI_ROOT = "https://localhost"
 
+# canvas @ids are derived from the seed and the manifest's short id, so that the
+# local manifest server can rebuild any generated manifest from its @id alone.
+MANIFEST_SEED = 0
+
+# the number of canvases of a manifest is encoded at the end of its short id
+N_CANVAS_REGEX = re.compile(r"_c(\d+)$")
+
 annotation_2_template = json_read(PATH_ANNOTATION_2_TEMPLATE)
 manifest_2_template = json_read(PATH_MANIFEST_2_TEMPLATE)
 canvas_2_template = json_read(PATH_CANVAS_2_TEMPLATE)
@@ -31,6 +42,31 @@ def mkstr():
     # return generate_random_string(15)  # NOTE: ~12 it/s
     return str(uuid4())  # NOTE: ~25 it/s
 
+def configure_manifests(uri_root: str|None = None, seed: int|None = None) -> None:
+    """
+    change where generated manifests are (supposedly) served, and the seed used to generate their canvases.
+    """
+    global URI_ROOT, MANIFEST_SEED
+    URI_ROOT = uri_root if uri_root is not None else URI_ROOT
+    MANIFEST_SEED = seed if seed is not None else MANIFEST_SEED
+    return
+
+def make_manifest_short_id(n_canvas: int) -> str:
+    """a unique manifest short id, ending with the manifest's number of canvases"""
+    return f"{mkstr()}_c{n_canvas}"
+
+def parse_manifest_short_id(short_id: str) -> int|None:
+    """
+    :returns: the number of canvases of the manifest with short id `short_id`, or None if it was not generated by `make_manifest_short_id`
+    """
+    match = N_CANVAS_REGEX.search(short_id)
+    return int(match[1]) if match else None
+
+def make_canvas_folio(short_id: str, idx: int) -> str:
+    """deterministic folio of the `idx`th canvas of a manifest"""
+    digest = blake2b(f"{MANIFEST_SEED}/{short_id}/{idx}".encode("utf-8"), digest_size=8).hexdigest()
+    return f"f_{digest}"
+
 def make_manifest_uri(short_id: str) -> str:
     return f"{URI_ROOT}/{short_id}/manifest.json"
 
@@ -67,9 +103,8 @@ def generate_annotation_list(id_canvas, n_annotations:int) -> Dict:
         ]
     }
 
-def generate_canvas(id_manifest:str) -> Dict:
+def generate_canvas(id_manifest:str, folio: str) -> Dict:
     canvas = orjson_deepcopy(canvas_2_template)
-    folio = f"f_{mkstr()}"
     id_canvas = make_canvas_uri(id_manifest, folio)
     id_img = f"{id_canvas}/full/full/0/native.jpg"
     canvas["@id"] = id_canvas
@@ -78,28 +113,33 @@ def generate_canvas(id_manifest:str) -> Dict:
     return canvas
 
 def generate_canvases(id_manifest:str, n_canvas=1000) -> List[Dict]:
+    short_id = get_manifest_short_id(id_manifest)
     return [
-        generate_canvas(id_manifest) for _ in range(n_canvas)
+        generate_canvas(id_manifest, make_canvas_folio(short_id, i)) for i in range(n_canvas)
     ]
 
-def generate_manifest(n_canvas:int=1000) -> Dict:
+def generate_manifest(n_canvas:int=1000, short_id: str|None = None) -> Dict:
+    """
+    :param short_id: the manifest's short id. if None, a new one is created.
+        the same short id always gives the same manifest (see `MANIFEST_SEED`).
+    """
     manifest = orjson_deepcopy(manifest_2_template)
-    id_manifest = make_manifest_uri(mkstr())
+    id_manifest = make_manifest_uri(short_id if short_id is not None else make_manifest_short_id(n_canvas))
     manifest["@id"] = id_manifest
     manifest["sequences"][0]["canvases"] = generate_canvases(id_manifest, n_canvas)
     return manifest
 
 def generate_manifest_index(n_canvas:int=1000) -> Dict:
     """generate a manifest index as it is stored in aiiinotate"""
-    short_id = mkstr()
+    short_id = make_manifest_short_id(n_canvas)
     id_manifest = make_manifest_uri(short_id)
     return {
         "@id": id_manifest,
         "manifestShortId": short_id,
         "@type": "sc:Manifest",
         "canvasIds": [
-            make_canvas_uri(id_manifest, mkstr())
-            for _ in range(n_canvas)
+            make_canvas_uri(id_manifest, make_canvas_folio(short_id, i))
+            for i in range(n_canvas)
         ]
     }
 
@@ -0,0 +1,138 @@
+"""
+adaptive concurrency limiter (`--adaptive`): limits the number of requests in flight in
+the `mt_*` functions of `src.multithread`, and adapts the limit to the server's health (AIMD).
+
+the pool still has `threads` workers, but a worker waits before each request while
+`limit` requests are in flight. after each request:
+- if the request failed (error or timeout), or if the moving average of the latency is more than
+  `AIMD_LATENCY_TOLERANCE` times its lowest value (the server is overloaded and requests are queued),
+  the limit is multiplied by `AIMD_DECREASE`. the limit is decreased at most once per round of
+  `limit` requests, so that the requests that were already in flight don't decrease it again.
+- otherwise, the limit grows by 1 per round of `limit` successful requests.
+
+every change of the limit is saved in `trajectory`, to see when the server started to degrade.
+"""
+
+import threading
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, List
+
+from src.adapter_core import reset_response_stats, get_response_stats
+from src.constants import AIMD_INITIAL_LIMIT, AIMD_DECREASE, AIMD_LATENCY_TOLERANCE, AIMD_LATENCY_SMOOTHING
+
+
+class AimdLimiter:
+    def __init__(self, max_limit: int, min_limit: int = 1, initial_limit: int = AIMD_INITIAL_LIMIT):
+        """
+        :param max_limit: max number of requests in flight (the number of threads of the pool)
+        """
+        if not isinstance(max_limit, int) or max_limit < min_limit:
+            raise ValueError(f"AimdLimiter: 'max_limit' must be an integer >= {min_limit}, got {max_limit}")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        self.latency = None  # moving average of the latency of successful requests
+        self.latency_min = None  # lowest value of `self.latency`
+        self.n_success = 0
+        self.n_error = 0
+        self.n_since_decrease = 0  # number of requests completed since the last decrease
+        self.start = timer()
+        self.trajectory: List[Dict] = []
+        self.cond = threading.Condition()
+        self.log("start")
+
+    def log(self, reason: str) -> None:
+        """save the current limit in `self.trajectory`. must be called while holding `self.cond`"""
+        self.trajectory.append({
+            "time": timer() - self.start,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "reason": reason,
+        })
+
+    def acquire(self) -> None:
+        """wait until less than `limit` requests are in flight"""
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, success: bool) -> None:
+        """
+        :param latency: duration of the request, in seconds
+        :param success: False if the request failed or timed out
+        """
+        with self.cond:
+            self.in_flight -= 1
+            self.n_since_decrease += 1
+            limit_before = int(self.limit)
+            reason = None
+            if success:
+                self.n_success += 1
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else AIMD_LATENCY_SMOOTHING * latency + (1 - AIMD_LATENCY_SMOOTHING) * self.latency
+                )
+                self.latency_min = self.latency if self.latency_min is None else min(self.latency_min, self.latency)
+                if self.latency > self.latency_min * AIMD_LATENCY_TOLERANCE:
+                    reason = "latency"
+            else:
+                self.n_error += 1
+                reason = "error"
+
+            if reason is not None:
+                if self.n_since_decrease >= limit_before:
+                    self.limit = max(self.min_limit, self.limit * AIMD_DECREASE)
+                    self.n_since_decrease = 0
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != limit_before:
+                self.log(reason or "increase")
+            self.cond.notify_all()
+
+    def wrap(self, func: Callable) -> Callable:
+        """
+        limit the calls to `func`. a call succeeds if it raised no exception and the server answered
+        with a status below 500 (see `src.adapter_core.get_response_stats`). its return value isn't
+        used: a delete that deleted nothing returns 0, but the server is healthy. the adapter functions
+        wrapped by `src.metrics.Recorder.wrap` don't raise: a failed request leaves no status, or a 5xx status.
+        """
+        def wrapper(*args, **kwargs) -> Any:
+            self.acquire()
+            reset_response_stats()
+            s = timer()
+            success = False
+            try:
+                out = func(*args, **kwargs)
+                status = get_response_stats()["status"]
+                success = status is not None and status < 500
+                return out
+            finally:
+                self.release(timer() - s, success)
+        return wrapper
+
+    def summary(self) -> Dict:
+        with self.cond:
+            self.log("end")
+            return {
+                "max_limit": self.max_limit,
+                "final_limit": int(self.limit),
+                "mean_limit": mean_limit(self.trajectory),
+                "n_success": self.n_success,
+                "n_error": self.n_error,
+                "trajectory": self.trajectory,
+            }
+
+
+def mean_limit(trajectory: List[Dict]) -> float|None:
+    """time-weighted mean of the limit"""
+    duration = trajectory[-1]["time"] - trajectory[0]["time"]
+    if duration <= 0:
+        return None
+    return sum(
+        a["limit"] * (b["time"] - a["time"])
+        for a, b in zip(trajectory, trajectory[1:])
+    ) / duration
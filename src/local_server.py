@@ -0,0 +1,40 @@
+"""
+small HTTP servers run by the benchmark client itself, in daemon threads
+(live metrics, local IIIF manifest server...).
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalServer(ThreadingHTTPServer):
+    # the annotation server may open many connections at once (i.e., when fetching manifests in parallel)
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    """a request handler that doesn't log requests and keeps connections alive"""
+    protocol_version = "HTTP/1.1"
+    # headers and body are sent separately: without this, Nagle's algorithm delays the body on kept-alive connections.
+    disable_nagle_algorithm = True
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't mess with the tqdm progress bars
+        return
+
+
+def serve_in_thread(handler: type[QuietHandler], port: int, host: str = "127.0.0.1") -> LocalServer:
+    """
+    serve `handler` on http://<host>:<port>, in a daemon thread. call `.shutdown()` on the returned server to stop it.
+    """
+    server = LocalServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
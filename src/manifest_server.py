@@ -0,0 +1,74 @@
+"""
+local IIIF Presentation 2.x manifest server.
+
+by default, generated manifests point to a closed port (see `src.generate.URI_ROOT`):
+when inserting an annotation, the annotation server's attempt to fetch its target
+manifest fails instantly, and inserts are faster than in production. this server
+serves the generated manifests on demand, so that inserts go through the real path:
+fetching the manifest and indexing its canvases.
+
+manifests aren't stored: a manifest is rebuilt from its short id and the seed
+(see `src.generate.make_canvas_folio`). the most requested manifests are kept
+in memory as JSON bytes, and an artificial latency can be added to each response
+to simulate a remote IIIF server.
+"""
+
+import time
+from functools import lru_cache
+
+from src.utils import json_dumps
+from src.local_server import LocalServer, QuietHandler, serve_in_thread
+from src.generate import configure_manifests, parse_manifest_short_id, generate_manifest
+from src.constants import MANIFEST_SERVER_LATENCY_DEFAULT, MANIFEST_SERVER_SEED_DEFAULT, MANIFEST_SERVER_CACHE_SIZE
+
+
+def validate_manifest_server(port, latency) -> None:
+    if port is not None and (not isinstance(port, int) or not (0 < port < 65536)):
+        raise ValueError(f"validate_manifest_server: 'port' must be None or an integer in range 1..65535, got {port}")
+    if not isinstance(latency, (int, float)) or latency < 0:
+        raise ValueError(f"validate_manifest_server: 'latency' must be a number >= 0, got {latency} (type {type(latency)})")
+
+
+@lru_cache(maxsize=MANIFEST_SERVER_CACHE_SIZE)
+def render_manifest(short_id: str) -> bytes|None:
+    """the manifest with short id `short_id`, as JSON bytes, or None if it wasn't generated by the benchmark"""
+    n_canvas = parse_manifest_short_id(short_id)
+    if n_canvas is None:
+        return None
+    return json_dumps(generate_manifest(n_canvas, short_id), indent=False)
+
+
+def serve_manifests(
+    port: int,
+    latency: float = MANIFEST_SERVER_LATENCY_DEFAULT,
+    seed: int = MANIFEST_SERVER_SEED_DEFAULT
+) -> LocalServer:
+    """
+    serve generated manifests on http://127.0.0.1:<port>/<short id>/manifest.json, in a daemon thread.
+    manifests generated after this call will point to this server.
+
+    :param latency: time (in seconds) to wait before sending each response
+    :param seed: seed of the generated canvases
+    """
+    validate_manifest_server(port, latency)
+    configure_manifests(uri_root=f"http://127.0.0.1:{port}", seed=seed)
+    render_manifest.cache_clear()
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            parts = self.path.split("?")[0].strip("/").split("/")
+            body = (
+                render_manifest(parts[0])
+                if len(parts) == 2 and parts[1] == "manifest.json"
+                else None
+            )
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_body(body, "application/ld+json")
+
+    server = serve_in_thread(Handler, port)
+    print(f"manifests served at: http://127.0.0.1:{port}/<manifest short id>/manifest.json (latency={latency}s, seed={seed})")
+    return server
@@ -0,0 +1,379 @@
+"""
+per-request instrumentation of the adapters.
+
+`Recorder.wrap` times every call to an adapter method and sends 1 record per call
+to the recorder's sinks. the main sink is `RequestLog`, an append-only, buffered
+NDJSON file written while the benchmark runs: raw observations survive a crash,
+and any aggregate can be rebuilt offline with `aggregate_request_log`.
+
+a record is a JSON object on a single line:
+```
+{
+    "op": "get_annotation_list",  # the adapter method called
+    "step": 3,                    # index of the step
+    "phase": "read",              # phase of the step (populate_manifest, read, write...)
+    "trial": 1,                   # index of the trial, or null outside of the benchmark phase
+    "ts": 1792420595.154,         # unix timestamp of the start of the call
+    "latency": 0.0021,            # duration of the call, in seconds
+    "ok": true,                   # false if the adapter reported a failure or raised an exception
+    "outcome": "success",         # "success", "error" or "timeout"
+    "status": 200,                # HTTP status code of the (last) response, or null
+    "size": 45321,                # size of the response body(ies), in bytes
+    "wire_size": 45321,           # size of the response body(ies) as received, before decompression, in bytes
+    "request_size": 0,            # size of the request body(ies) as sent, after compression, in bytes
+    "n_retry": 0,                 # number of retried requests
+    "cpu": 0.0004,                # CPU time of the calling thread during the call, in seconds
+    "key_class": "hot",           # "hot" or "cold" if the key of the call was classified (see `src.distributions`), else null
+    "worker": "Thread-3 (worker)" # name of the thread that made the call
+}
+```
+"""
+
+import time
+import threading
+from pathlib import Path
+from functools import wraps
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+import requests
+
+from src.utils import json_dumps, json_parse
+from src.stats import LatencyHistogram
+from src.adapter_core import reset_response_stats, get_response_stats, ADAPTER_ERRORS
+from src.constants import REQUEST_LOG_BUFFER_SIZE
+
+
+OUTCOMES = ["success", "error", "timeout"]
+
+# quantities of the records summed by `OperationStats`: bytes sent and received, and CPU time of the client
+SIZES = ["request_size", "size", "wire_size", "cpu"]
+
+
+class RequestLog:
+    """
+    append-only NDJSON log of adapter calls.
+    records are buffered in memory and written every `buffer_size` records,
+    when calling `flush` (at the end of each phase) and when closing the log.
+    """
+    def __init__(self, fp: Path, buffer_size: int = REQUEST_LOG_BUFFER_SIZE):
+        self.fp = fp
+        self.buffer_size = buffer_size
+        self._buffer: List[bytes] = []
+        self._lock = threading.Lock()
+        self._fh = open(fp, mode="ab")
+
+    def __call__(self, record: Dict) -> None:
+        line = json_dumps(record, indent=False) + b"\n"
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._write()
+
+    def _write(self) -> None:
+        """write the buffer to file. the lock must be held by the caller."""
+        if self._buffer:
+            self._fh.write(b"".join(self._buffer))
+            self._fh.flush()
+            self._buffer = []
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write()
+            self._fh.close()
+
+
+class Recorder:
+    """
+    time adapter calls and send the resulting records to `sinks`.
+    the benchmark updates `step`, `phase` and `trial` as it progresses,
+    so that all records carry the context in which they were made.
+    """
+    def __init__(self, sinks: Optional[List[Callable[[Dict], None]]] = None):
+        self.sinks = sinks or []
+        self.step: Optional[int] = None
+        self.phase: Optional[str] = None
+        self.trial: Optional[int] = None
+
+    def record(self, record: Dict) -> None:
+        for sink in self.sinks:
+            sink(record)
+
+    def wrap(
+        self,
+        op: str,
+        func: Callable,
+        default: Any = None,
+        classify: Optional[Callable[[Any], str]] = None
+    ) -> Callable:
+        """
+        wrap `func`, an adapter method, to record each of its calls under the name `op`.
+        the outcome of a call is:
+        - "success" if it returns a truthy result (adapters return `1`, a non-empty list or a non-empty dict on success)
+        - "timeout" if a request timed out (after all retries)
+        - "error" otherwise: a falsy result, or a failed request or unexpected response (see `ADAPTER_ERRORS`).
+        other exceptions are bugs of the client: they are recorded as errors and raised.
+
+        :param default: value returned by the wrapper instead of raising, when
+            a request fails or times out. it should be the value returned by
+            `func` on failure (`0` for most adapter methods).
+        :param classify: optional, function that returns the key class ("hot" or "cold") of
+            the 1st argument of `func`, to compare the latency of hot and cold keys.
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            reset_response_stats()
+            outcome = "error"
+            ts = time.time()
+            cpu = time.thread_time()
+            s = timer()
+            try:
+                result = func(*args, **kwargs)
+                outcome = "success" if result else "error"
+                return result
+            except requests.exceptions.Timeout:
+                outcome = "timeout"
+                return default
+            except ADAPTER_ERRORS:
+                return default
+            finally:
+                latency = timer() - s
+                cpu = time.thread_time() - cpu
+                self.record({
+                    "op": op,
+                    "step": self.step,
+                    "phase": self.phase,
+                    "trial": self.trial,
+                    "ts": ts,
+                    "latency": latency,
+                    "ok": outcome == "success",
+                    "outcome": outcome,
+                    **get_response_stats(),
+                    "cpu": cpu,
+                    "key_class": classify(args[0]) if classify is not None and len(args) else None,
+                    "worker": threading.current_thread().name,
+                })
+        return wrapper
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            if hasattr(sink, "flush"):
+                sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                sink.close()
+
+
+class OperationStats:
+    """
+    in-memory aggregates of the records, per (trial, phase, op, outcome).
+    used to compute benchmark timings and the `operations` section of the report.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[Tuple, LatencyHistogram] = {}
+        self.sizes: Dict[Tuple, Dict[str, float]] = {}  # total size of responses and requests, and total CPU time
+        self.key_classes: Dict[Tuple, LatencyHistogram] = {}  # successful calls, per (phase, op, key class)
+
+    def __call__(self, record: Dict) -> None:
+        key = (record["trial"], record["phase"], record["op"], record["outcome"])
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram()
+                self.sizes[key] = { key_size: 0 for key_size in SIZES }
+            self.histograms[key].add(record["latency"])
+            for key_size in SIZES:
+                # records of request logs written before compression was supported have no `wire_size` and `cpu`
+                self.sizes[key][key_size] += record.get(key_size) or 0
+            if record["key_class"] is not None and record["outcome"] == "success":
+                key_class = (record["phase"], record["op"], record["key_class"])
+                if key_class not in self.key_classes:
+                    self.key_classes[key_class] = LatencyHistogram()
+                self.key_classes[key_class].add(record["latency"])
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms = {}
+            self.sizes = {}
+            self.key_classes = {}
+
+    def mean_latency(self, trial: Optional[int], phase: str, op: str) -> Optional[float]:
+        """mean latency of the successful calls to `op`, or None if no call succeeded"""
+        histogram = self.histograms.get((trial, phase, op, "success"), None)
+        return histogram.mean if histogram is not None else None
+
+    def mean_size(self, trial: Optional[int], phase: str, op: str, key: str = "size") -> Optional[float]:
+        """
+        mean size (in bytes) of the successful calls to `op`, or None if no call succeeded
+
+        :param key: "size" for responses, "wire_size" for responses before decompression, "request_size"
+            for requests, or "cpu" for the CPU time of the client (in seconds)
+        """
+        histogram = self.histograms.get((trial, phase, op, "success"), None)
+        if histogram is None:
+            return None
+        return self.sizes[(trial, phase, op, "success")][key] / histogram.count
+
+    def summary(self) -> Dict:
+        """
+        aggregate all trials.
+
+        :returns: { <phase>: { <op>: {
+            "n_success", "n_error", "n_timeout",
+            "latency_success", "latency_error", "latency_timeout": latency summary (see `LatencyHistogram.to_dict`), or None
+            "transfer": mean "request_size", "size", "wire_size" (in bytes) and "cpu" (in seconds) of the successful calls, or None
+        } } }
+        """
+        merged: Dict[Tuple, LatencyHistogram] = {}
+        sizes: Dict[Tuple, Dict[str, float]] = {}
+        for (trial, phase, op, outcome), histogram in self.histograms.items():
+            key = (phase, op, outcome)
+            if key not in merged:
+                merged[key] = LatencyHistogram()
+                sizes[key] = { key_size: 0 for key_size in SIZES }
+            merged[key].merge(histogram)
+            for key_size in SIZES:
+                sizes[key][key_size] += self.sizes[(trial, phase, op, outcome)][key_size]
+        out: Dict[str, Dict] = {}
+        for phase, op in sorted(set((k[0], k[1]) for k in merged.keys())):
+            out.setdefault(phase, {})[op] = {}
+            for outcome in OUTCOMES:
+                histogram = merged.get((phase, op, outcome), None)
+                out[phase][op][f"n_{outcome}"] = histogram.count if histogram else 0
+            for outcome in OUTCOMES:
+                histogram = merged.get((phase, op, outcome), None)
+                out[phase][op][f"latency_{outcome}"] = histogram.to_dict() if histogram else None
+            histogram = merged.get((phase, op, "success"), None)
+            out[phase][op]["transfer"] = (
+                { key_size: sizes[(phase, op, "success")][key_size] / histogram.count for key_size in SIZES }
+                if histogram is not None and histogram.count
+                else None
+            )
+        return out
+
+
+    def key_class_summary(self) -> Dict:
+        """
+        latency of successful calls on hot and cold keys, for all trials.
+
+        :returns: { <phase>: { <op>: { "hot", "cold": latency summary (see `LatencyHistogram.to_dict`), or None } } }
+        """
+        out: Dict[str, Dict] = {}
+        for phase, op in sorted(set((k[0], k[1]) for k in self.key_classes.keys())):
+            out.setdefault(phase, {})[op] = {
+                key_class: (
+                    self.key_classes[(phase, op, key_class)].to_dict()
+                    if (phase, op, key_class) in self.key_classes
+                    else None
+                )
+                for key_class in ["hot", "cold"]
+            }
+        return out
+
+
+def iter_request_log(fp: str|Path) -> Generator[Dict, None, None]:
+    """read a request log lazily, 1 record at a time"""
+    with open(fp, mode="rb") as fh:
+        for line in fh:
+            # the last line may be truncated if the benchmark crashed while writing
+            try:
+                yield json_parse(line)
+            except ValueError:
+                continue
+    return
+
+def aggregate_request_log(
+    fp: str|Path,
+    group_by: Tuple[str, ...] = ("step", "phase", "op"),
+    filter_: Optional[Callable[[Dict], bool]] = None,
+) -> Dict[Tuple, Dict]:
+    """
+    rebuild aggregates from a request log, with a constant memory footprint per group.
+
+    :param fp: path to the request log
+    :param group_by: record keys to group records by
+    :param filter_: optional, only aggregate the records for which `filter_(record)` is True
+    :returns: a mapping of { <group values>: {"n_error" (including timeouts), "n_timeout", "size", and the output of `LatencyHistogram.to_dict`} }
+    """
+    groups: Dict[Tuple, Dict] = {}
+    for record in iter_request_log(fp):
+        if filter_ is not None and not filter_(record):
+            continue
+        key = tuple(record.get(k) for k in group_by)
+        if key not in groups:
+            groups[key] = { "histogram": LatencyHistogram(), "n_error": 0, "n_timeout": 0, "size": 0 }
+        group = groups[key]
+        group["histogram"].add(record["latency"])
+        group["n_error"] += 0 if record["ok"] else 1
+        # request logs written before timeouts were tracked have no `outcome`
+        group["n_timeout"] += 1 if record.get("outcome", None) == "timeout" else 0
+        group["size"] += record["size"] or 0
+    return {
+        key: {
+            **group["histogram"].to_dict(),
+            "n_error": group["n_error"],
+            "n_timeout": group["n_timeout"],
+            "size": group["size"],
+        }
+        for key, group in groups.items()
+    }
+
+def index_latencies(fp: str|Path) -> Dict[Tuple[int, str, str], List[float]]:
+    """
+    read a request log once, and index the latencies of its successful calls.
+
+    :returns: { (step, phase, op): [latency] }
+    """
+    out: Dict[Tuple[int, str, str], List[float]] = {}
+    for r in iter_request_log(fp):
+        if r["ok"]:
+            out.setdefault((r["step"], r["phase"], r["op"]), []).append(r["latency"])
+    return out
+
+def print_aggregates(aggregates: Dict[Tuple, Dict], group_by: Tuple[str, ...]) -> None:
+    header = (
+        " ".join(f"{k:<22}" for k in group_by)
+        + f" {'count':>8} {'errors':>7} {'timeouts':>8} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10} {'MB':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    # sort numbers numerically and put `None` first
+    sort_key = lambda k: tuple(
+        (v is not None, v if isinstance(v, (int, float)) else 0, str(v))
+        for v in k
+    )
+    for key in sorted(aggregates.keys(), key=sort_key):
+        a = aggregates[key]
+        print(
+            " ".join(f"{str(v):<22}" for v in key)
+            + f" {a['count']:>8} {a['n_error']:>7} {a['n_timeout']:>8} {a['mean']:>10.6f} {a['p50']:>10.6f}"
+            + f" {a['p95']:>10.6f} {a['p99']:>10.6f} {a['max']:>10.6f} {a['size'] / 1e6:>9.2f}"
+        )
+    return
+
+def resolve_request_log(path: str|Path) -> Path:
+    """
+    find a request log from `path`, which can be:
+    - "latest": the request log of the latest report generated
+    - the path to a report file (`.json`)
+    - the path to a request log (`.ndjson`)
+    """
+    from src.visualize import get_latest_report_file
+    from src.utils import json_read
+    if path == "latest":
+        path = get_latest_report_file()
+    path = Path(path)
+    if path.suffix == ".json":
+        request_log = json_read(path).get("request_log", None)
+        if request_log is None:
+            raise FileNotFoundError(f"resolve_request_log: report '{path}' has no request log")
+        path = path.parent / request_log
+    if not path.exists():
+        raise FileNotFoundError(f"resolve_request_log: request log not found: '{path}'")
+    return path
@@ -1,39 +1,130 @@
 """
 multithreading functions to insert data.
 this module defines `multithread` (a decorator) and mt_* functions that use this decorator to parallelize.
+the mt_* functions process one chunk of items at a time, and are called as many times as there are chunks.
 all multithreaded functions are grouped here because otherwise things will be even more of a mess than they are aldready.
 """
 
-from threading import Lock
+from queue import Queue, Empty, Full
+from itertools import islice, repeat
+from threading import Lock, Event, Thread
+from collections.abc import Iterable
 from multiprocessing.pool import ThreadPool
-from typing import Dict, List, Tuple, Callable, Optional
+from timeit import default_timer as timer
+from typing import Dict, Iterator, List, Tuple, Callable, Optional
 
 from tqdm import tqdm
 
 from src.generate import generate_annotation_list, generate_manifest
+from src.constants import MULTITHREAD_CHUNK_SIZE, MULTITHREAD_QUEUE_SIZE, MULTITHREAD_POLL_INTERVAL, MULTITHREAD_REPORT_INTERVAL
 
+# progress reporters of the pools that are running, read by the live metrics exporter (see `active_progress`)
+_active_reporters: List["ProgressReporter"] = []
+_active_reporters_lock = Lock()
 
-def validate_n(n:int, threads:int) -> None:
-    if n < threads:
-        raise ValueError(f"'n' must be larger than 'threads' to be properly divided among threads. got n={n}, threads={threads}")
 
-def validate_n_or_update_threads(n:int, threads:int) -> int:
+class WorkerCounter:
     """
-    if `n` < `threads`, the function can't be multiprocessed: `n` can't be split in
-    as many threads as requested => update threads to `1` to effectively disable multiprocessing.
-    this probably has a performance cost, but if `n<threads`, `n` is very low, so
-    we're doing just a few operations and multithreading is probs useless.
+    number of items processed by one worker thread. only this thread writes to
+    its counter, so counting an item doesn't need a lock.
     """
-    try:
-        validate_n(n, threads)
-        return threads
-    except ValueError:
-        threads = 1
-        return threads
+    __slots__ = ("success", "error")
 
-def multithread_wrapper(f, kwargs):
-    """unpack kwargs and call the function."""
-    return f(**kwargs)
+    def __init__(self):
+        self.success = 0
+        self.error = 0
+
+    def add(self, success: bool) -> None:
+        if success:
+            self.success += 1
+        else:
+            self.error += 1
+
+
+class ProgressReporter:
+    """
+    every `MULTITHREAD_REPORT_INTERVAL` seconds, sum the counters of all worker threads of a pool,
+    and update the progress bar with the number of successes, errors and the throughput.
+    the counters are read without a lock, so the progress can be a little behind the workers.
+    """
+    def __init__(self, desc: str, total: int|None, interval: float = MULTITHREAD_REPORT_INTERVAL):
+        self.desc = desc
+        self.total = total
+        self.interval = interval
+        self.pbar = tqdm(total=total, desc=desc)
+        self.counters: List[WorkerCounter] = []
+        self._lock = Lock()  # only taken when a worker thread creates its counter
+        self._stop = Event()
+        self._thread = Thread(target=self.run, daemon=True)
+        self.n_reported = 0  # number of items shown by the progress bar
+        self.start = timer()
+
+    def counter(self) -> WorkerCounter:
+        """create the counter of a worker thread"""
+        counter = WorkerCounter()
+        with self._lock:
+            self.counters.append(counter)
+        return counter
+
+    def snapshot(self) -> Dict:
+        """
+        :returns: { "desc", "total", "success", "error", "elapsed": in seconds, "throughput": items per second }
+        """
+        with self._lock:
+            counters = list(self.counters)
+        success = sum(c.success for c in counters)
+        error = sum(c.error for c in counters)
+        elapsed = timer() - self.start
+        return {
+            "desc": self.desc,
+            "total": self.total,
+            "success": success,
+            "error": error,
+            "elapsed": elapsed,
+            "throughput": (success + error) / elapsed if elapsed > 0 else 0.,
+        }
+
+    def report(self) -> None:
+        snapshot = self.snapshot()
+        n = snapshot["success"] + snapshot["error"]
+        self.pbar.set_postfix(
+            { "ok": snapshot["success"], "err": snapshot["error"], "avg": f"{snapshot['throughput']:.1f}/s" },
+            refresh=False
+        )
+        self.pbar.update(n - self.n_reported)
+        self.n_reported = n
+
+    def run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def __enter__(self) -> "ProgressReporter":
+        with _active_reporters_lock:
+            _active_reporters.append(self)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.report()
+        self.pbar.close()
+        with _active_reporters_lock:
+            _active_reporters.remove(self)
+
+
+def active_progress() -> List[Dict]:
+    """progress of the pools that are running (see `ProgressReporter.snapshot`)"""
+    with _active_reporters_lock:
+        reporters = list(_active_reporters)
+    return [ r.snapshot() for r in reporters ]
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[List]:
+    """lazily split `items` in lists of `size` items (the last one may be smaller)"""
+    it = iter(items)
+    while chunk := list(islice(it, size)):
+        yield chunk
 
 def multithread(func) -> Callable:
     """decorator to multiprocess a function, without collecting anything. use for inserts"""
@@ -42,10 +133,16 @@ def multithread(func) -> Callable:
         """
         NOTE: the wrapped function must accept **kwargs and arguments to the wrapped function must be passed as kwargs
 
+        items are read lazily, in small chunks, and put in a bounded queue. each thread takes the
+        next chunk from the queue as soon as it's done with the previous one: fast threads process
+        more chunks than slow ones, and only a few chunks are in memory at once.
+        each thread counts the items it processed in its own `WorkerCounter`, and a `ProgressReporter`
+        thread periodically sums the counters to update the progress bar.
+
         **kwargs should contain:
         - either:
             - n: int, number of documents (annotations or manifests) to insert
-            - data: List, a list of items that will be divided among threads and passed to worker processes.
+            - data: Iterable, the items that will be divided among threads and passed to worker processes (a list, or a generator for very large inputs).
             => to insert manifests, we only need to know `n` (number of manifests). to insert annotations, we need to know the @ids of manifests on which to insert annotations.
         - threads: int, number of threads to use
         - pbar_desc: str, description message for the tqdm progress bar
@@ -53,86 +150,115 @@ def multithread(func) -> Callable:
         - any other kwargs to pass to the wrapped funcion
 
         **kwargs can optionnally contain:
+        - limiter: AimdLimiter, to adapt the number of requests in flight to the server's health (see `src.limiter`).
+          `threads` is then the max number of requests in flight.
+        - total: int, number of items in `data`, if `data` is a generator (for the progress bar)
         """
         if not any(k in kwargs.keys() for k in ["n", "data"]):
             raise ValueError(f"'n' or 'data' must be defined in 'kwargs' ! got {kwargs}")
 
         threads = kwargs["threads"]
 
-        # split `data` into even sized sub-lists to pass to each process.
-        if "data" in kwargs.keys():
-            if not isinstance(kwargs["data"], list):
-                raise TypeError(f"kwargs['data'] must be a list ! got '{type(kwargs['data'])}'")
-            data = kwargs["data"]
-            n = len(data)
-            threads = validate_n_or_update_threads(n, threads)
-            n_per_thread = n // threads  # number of items to process in each thread
-
-            # make a nested list of length `threads`, each sub-list with the same number of items
-            # https://stackoverflow.com/a/2231685
-            data: List[List] = [
-                data[i:i+n_per_thread] for i in range(0, n, n_per_thread)
-            ]
-            # since `n_per_threads` is rounded, it may leave stuff out
-            # => there can be an extra item in `data` with leftovers that could not be split evenly
-            # => append everything extra to the 1st item in data.
-            if len(data) > threads:
-                # all items whose index is > `threads` is left over
-                for leftover in data[threads:]:
-                    data[0].extend(leftover)
-                data = data[:threads]  # keep only the last items.
-            # data_shape = [ len(d) for d in data ]
-            # print(f">>> n={n} threads={threads} len(data)={len(data)} data_shape={data_shape}")
-            assert len(data) == threads
-            assert sum(len(d) for d in data) == n
-            kwargs["data"] = data
-            kwargs["n"] = n_per_thread
-
-        # get the number of entries to process per thread
+        # all threads share the limiter: each call to `func` waits for a free slot
+        limiter = kwargs.pop("limiter", None)
+        if limiter is not None:
+            kwargs["func"] = limiter.wrap(kwargs["func"])
+
+        # `items` is iterated over lazily. in `n` mode, items are placeholders: the wrapped function only gets the size of its chunk.
+        use_data = "data" in kwargs.keys()
+        if use_data:
+            items = kwargs.pop("data")
+            if not isinstance(items, Iterable) or isinstance(items, (str, bytes, dict)):
+                raise TypeError(f"kwargs['data'] must be an iterable of items (a list or a generator) ! got '{type(items)}'")
+            total = kwargs.pop("total", len(items) if hasattr(items, "__len__") else None)  # pyright: ignore
         else:
-            n = kwargs["n"]
-            threads = validate_n_or_update_threads(n, threads)
-            n_per_thread = n // threads
-            kwargs["n"] = n_per_thread
-
-        # create a tqdm progress bar.
-        pbar_desc = kwargs["pbar_desc"]
-        pbar = tqdm(total=n, desc=pbar_desc)
-
-        # `lock` tracks the shared memory in all worker processses
-        lock = Lock()
-
-        # build pool_kwargs, the arguments that will be passed to each worker process.
-        pool_kwargs = []
-        for i in range(threads):
-            kw = kwargs.copy()
-            kw["pbar"] = pbar
-            kw["lock"] = lock
-            # extract the `data` sublist to pass to `f`.
-            if "data" in kwargs.keys():
-                kw["data"] = kwargs["data"][i]
-            pool_kwargs.append((func, kw))
-
-        # we pass to `pool`
-        # 1. a function that, for each thread, applies the kwargs `kw` to `f`
-        # 2. an array of (f, kw), with `f` the function to be executed by each thread and `kw` the kwargs passed to each thread.
+            total = kwargs["n"]
+            items = repeat(None, total)
+
+        # with few items, use fewer threads and smaller chunks, so that all threads have something to do.
+        chunk_size = MULTITHREAD_CHUNK_SIZE
+        if total is not None:
+            threads = max(1, min(threads, total))
+            chunk_size = max(1, min(chunk_size, total // threads))
+
+        # the reporter drives the tqdm progress bar.
+        reporter = ProgressReporter(kwargs["pbar_desc"], total)
+
+        queue: Queue = Queue(maxsize=threads * MULTITHREAD_QUEUE_SIZE)
+        fed = Event()   # set when all items are in the queue
+        stop = Event()  # set when a thread failed: the others stop too
+        feed_error: List[BaseException] = []
+
+        def feed() -> None:
+            """put chunks of items in the queue, waiting while it's full"""
+            try:
+                for chunk in iter_chunks(items, chunk_size):
+                    while True:
+                        if stop.is_set():
+                            return
+                        try:
+                            queue.put(chunk, timeout=MULTITHREAD_POLL_INTERVAL)
+                            break
+                        except Full:
+                            continue
+            except BaseException as e:
+                feed_error.append(e)
+                stop.set()
+            finally:
+                fed.set()
+
+        def work() -> Tuple[int, int, List]:
+            """process chunks until the queue is empty and all items were fed"""
+            success = 0
+            error = 0
+            list_id = []
+            counter = reporter.counter()
+            while not stop.is_set():
+                try:
+                    chunk = queue.get(timeout=MULTITHREAD_POLL_INTERVAL)
+                except Empty:
+                    # once everything was fed, nothing is added to the queue: an empty queue means that we're done.
+                    if fed.is_set() and queue.empty():
+                        break
+                    continue
+                kw = kwargs.copy()
+                kw["counter"] = counter
+                if use_data:
+                    kw["data"] = chunk
+                else:
+                    kw["n"] = len(chunk)
+                try:
+                    #NOTE: each call should return [int,int, Optional[List[str]]]:
+                    # - number of successful inserts,
+                    # - number of errors,
+                    # - optional list of inserted data (i.e., inserted canvas IDs when inserting manifests)
+                    r = func(**kw)
+                except BaseException:
+                    stop.set()
+                    raise
+                success += r[0]
+                error += r[1]
+                if len(r) == 3:
+                    list_id += r[2]
+            return success, error, list_id
+
+        feeder = Thread(target=feed, daemon=True)
+        feeder.start()
         list_id = []
         success = 0
         error = 0
-        with ThreadPool(threads) as pool:
-            #NOTE: each thread should return [int,int, Optional[List[str]]]:
-            # - number of successful inserts,
-            # - number of errors,
-            # - optional list of inserted data (i.e., inserted canvas IDs when inserting manifests)
-            r = pool.starmap(multithread_wrapper, pool_kwargs)
-            # group results: r contains 1 item / thread => combine
-            for el in r:
+        with reporter, ThreadPool(threads) as pool:
+            # group results: there is 1 result / thread => combine. `.get()` raises the error of a thread that failed.
+            results = [ pool.apply_async(work) for _ in range(threads) ]
+            for res in results:
+                el = res.get()
                 success += el[0]
                 error += el[1]
-                if len(el) == 3:
-                    list_id += el[2]
+                list_id += el[2]
+        feeder.join()
+        if len(feed_error):
+            raise feed_error[0]
 
-        pbar.close()
         print(f"SUCCESS: {success}, ERROR: {error}")
         return list_id
 
@@ -143,24 +269,22 @@ def mt_insert_manifests(
     func: Callable,
     n: int,
     n_canvas: int,
-    lock: Lock,
-    pbar: tqdm,
+    counter: WorkerCounter,
     **kwargs
 ) -> Tuple[int,int, List[str]]:
     """
     insert manifests in parallel threads
 
     :param func: Callable - function to use for insert
-    :param n: int - number of manifests to insert in one thread
+    :param n: int - number of manifests to insert in one chunk
     :param n_canvas: int - number of canvases per manifest
-    :param loc: threading.Lock - for shared state
-    :param pbar: tqdm.Tqdm - progress bar
+    :param counter: WorkerCounter - counter of the current thread, to report progress
 
     :returns:
         int, int, List[str]
-        - # of successes in this thread
-        - # of errors in this thread
-        - all inserted ids in this thread
+        - # of successes in this chunk
+        - # of errors in this chunk
+        - all inserted ids in this chunk
     """
     error = 0
     success = 0
@@ -168,9 +292,8 @@ def mt_insert_manifests(
     for _ in range(n):
         # _list_id_canvas = id of all canvases in the manifest inserted
         _list_id_canvas = func(generate_manifest(n_canvas))
-        # update the tqdm progress bar + track success and errors
-        with lock:
-            pbar.update(1)
+        # update the progress + track success and errors
+        counter.add(len(_list_id_canvas) != 0)
         # record the number of successes and errors.
         if len(_list_id_canvas) == 0:
             error += 1
@@ -185,8 +308,7 @@ def mt_insert_annotations(
     func: Callable,
     data: List[str],
     n_annotation: int,
-    lock: Lock,
-    pbar: tqdm,
+    counter: WorkerCounter,
     **kwargs
 ):
     """
@@ -195,13 +317,12 @@ def mt_insert_annotations(
     :func: function to insert an annotation list on one canvas_id
     :data: list of canvas ids inserted by `mt_insert_manifests`
     :n_annotation: number of annotations / canvas
-    :lock: for shared memory
-    :pbar: the process bar, to update it in the parent process.
+    :counter: counter of the current thread, to report progress
 
     :returns:
         int, int, List[str]
-        - # of successes in this thread
-        - # of errors in this thread
+        - # of successes in this chunk
+        - # of errors in this chunk
         - all the canvas IDs on which annotations were inserted
     """
     success = 0
@@ -213,9 +334,8 @@ def mt_insert_annotations(
         r = func(generate_annotation_list(
             id_canvas, n_annotation
         ))
-        # update tqdm
-        with lock:
-            pbar.update(1)
+        # update the progress
+        counter.add(r == 1)
         # track errors and successes
         if r == 1:
             success += 1
@@ -229,29 +349,53 @@ def mt_insert_annotations(
 def mt_delete(
     data: List[str],
     func: Callable,
-    lock: Lock,
-    pbar: tqdm,
+    counter: WorkerCounter,
     **kwargs
 ) -> Tuple[int,int]:
     """
     delete data (annotations or manifests)
 
     :param data: iterable with the IDs to delete (can be annotations "@id", manifest "@id"... depending on what `func` needs)
-    :param func: function to delete data
-    :param lock: for shared memory
-    :param pbar: the process bar, to update it in the parent process.
+    :param func: function to delete data. it returns the number of deleted documents, or None if the delete failed.
+    :param counter: counter of the current thread, to report progress
     """
     success = 0
     error = 0
     for _id in data:
         r = func(_id)
-        with lock:
-            pbar.update(1)
-        if r==1:
+        # deleting nothing (i.e., a manifest without annotations) is not an error
+        counter.add(r is not None)
+        if r is not None:
             success += 1
         else:
-            error += 0
+            error += 1
     return success, error
 
 
 
+
+@multithread
+def mt_apply(
+    data: List,
+    func: Callable,
+    counter: WorkerCounter,
+    **kwargs
+) -> Tuple[int,int]:
+    """
+    call `func` on each item of `data` (i.e., to read or update data). a call succeeds if it returns
+    a truthy value, like the adapter functions wrapped by `src.metrics.Recorder.wrap`.
+
+    :param data: iterable with the arguments of `func`
+    :param func: function to call
+    :param counter: counter of the current thread, to report progress
+    """
+    success = 0
+    error = 0
+    for item in data:
+        r = func(item)
+        counter.add(bool(r))
+        if r:
+            success += 1
+        else:
+            error += 1
+    return success, error
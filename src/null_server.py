@@ -0,0 +1,153 @@
+"""
+null annotation server: an in-memory stand-in for aiiinotate, run by the benchmark client
+itself (see `main.py calibrate`).
+
+it implements the aiiinotate routes used by `src.adapter_aiiinotate.AdapterAiiinotate`,
+with dicts instead of a database, and answers as fast as it can. benchmarking it measures
+the throughput and latency of the benchmark client alone: the ceiling above which results
+on a real server say more about the client than about the server.
+
+routes:
+- POST   /manifests/2/create, /annotations/2/create, /annotations/2/createMany, /annotations/2/update
+- GET    /manifests/2, /data/2/<manifest short id>/manifest.json, /annotations/2/search?canvasUri=<canvas>,
+         /search-api/1/manifests/<manifest short id>/search
+- DELETE /manifests/2/delete?uri=<manifest>, /annotations/2/delete?uri=<annotation>|manifestShortId=<manifest short id>
+"""
+
+import threading
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs
+
+import orjson
+
+from src.utils import get_manifest_short_id, get_target_canvas
+from src.local_server import LocalServer, QuietHandler, serve_in_thread
+
+CONTENT_TYPE = "application/ld+json"
+
+
+class NullStore:
+    """annotations and manifests, indexed like in aiiinotate's database"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.annotations: Dict[str, Dict] = {}          # { annotation @id: annotation }
+        self.by_canvas: Dict[str, Dict[str, None]] = {}  # { canvas @id: annotation @ids }
+        self.by_manifest: Dict[str, Dict[str, None]] = {}  # { manifest short id: annotation @ids }
+        self.manifests: Dict[str, bytes] = {}           # { manifest short id: manifest, as sent by the client }
+        self.manifest_ids: Dict[str, str] = {}          # { manifest short id: manifest @id }
+
+    def insert_annotations(self, annotations: List[Dict]) -> List[str]:
+        with self.lock:
+            for annotation in annotations:
+                self.delete_annotation(annotation["@id"])
+                id_canvas = get_target_canvas(annotation)
+                self.annotations[annotation["@id"]] = annotation
+                self.by_canvas.setdefault(id_canvas, {})[annotation["@id"]] = None
+                self.by_manifest.setdefault(get_manifest_short_id(id_canvas), {})[annotation["@id"]] = None
+        return [ annotation["@id"] for annotation in annotations ]
+
+    def delete_annotation(self, id_annotation: str) -> int:
+        """the lock must be held by the caller"""
+        annotation = self.annotations.pop(id_annotation, None)
+        if annotation is None:
+            return 0
+        id_canvas = get_target_canvas(annotation)
+        self.by_canvas.get(id_canvas, {}).pop(id_annotation, None)
+        self.by_manifest.get(get_manifest_short_id(id_canvas), {}).pop(id_annotation, None)
+        return 1
+
+    def annotation_list(self, list_id_annotation) -> Dict:
+        with self.lock:
+            resources = [ self.annotations[i] for i in list(list_id_annotation) if i in self.annotations ]
+        return { "@context": "http://iiif.io/api/presentation/2/context.json", "@type": "sc:AnnotationList", "resources": resources }
+
+
+def serve_null_server(port: int = 0) -> LocalServer:
+    """
+    serve a null annotation server on http://127.0.0.1:<port>, in a daemon thread.
+
+    :param port: if 0, a free port is chosen. the port is `server.server_address[1]`.
+    """
+    store = NullStore()
+
+    class Handler(QuietHandler):
+        def send_json(self, data, status: int = 200) -> None:
+            self.send_body(orjson.dumps(data), CONTENT_TYPE, status)
+
+        def read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip("/").split("/")
+            query = parse_qs(url.query)
+            if url.path in ["", "/"]:
+                self.send_json({ "name": "null annotation server" })
+            elif url.path == "/manifests/2":
+                with store.lock:
+                    members = [ { "@id": i, "@type": "sc:Manifest" } for i in store.manifest_ids.values() ]
+                self.send_json({ "@type": "sc:Collection", "members": members })
+            elif url.path == "/annotations/2/search" and "canvasUri" in query:
+                self.send_json(store.annotation_list(store.by_canvas.get(query["canvasUri"][0], {})))
+            elif len(parts) == 5 and parts[:3] == ["search-api", "1", "manifests"] and parts[4] == "search":
+                self.send_json(store.annotation_list(store.by_manifest.get(parts[3], {})))
+            elif len(parts) == 4 and parts[:2] == ["data", "2"] and parts[3] == "manifest.json":
+                body = store.manifests.get(parts[2])
+                if body is None:
+                    self.send_error(404)
+                else:
+                    self.send_body(body, CONTENT_TYPE)
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            body = self.read_body()
+            try:
+                data = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                self.send_error(400)
+                return
+            if path == "/manifests/2/create":
+                short_id = get_manifest_short_id(data["@id"])
+                with store.lock:
+                    store.manifests[short_id] = body
+                    store.manifest_ids[short_id] = data["@id"]
+                self.send_json({ "insertedCount": 1, "insertedIds": [ data["@id"] ] })
+            elif path == "/annotations/2/create":
+                self.send_json({ "insertedIds": store.insert_annotations([ data ]) })
+            elif path == "/annotations/2/createMany":
+                self.send_json({ "insertedIds": store.insert_annotations(data["resources"]) })
+            elif path == "/annotations/2/update":
+                with store.lock:
+                    exists = data["@id"] in store.annotations
+                if exists:
+                    store.insert_annotations([ data ])
+                self.send_json({ "matchedCount": int(exists), "modifiedCount": int(exists) })
+            else:
+                self.send_error(404)
+
+        def do_DELETE(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/annotations/2/delete" and "uri" in query:
+                with store.lock:
+                    n = store.delete_annotation(query["uri"][0])
+                self.send_json({ "deletedCount": n })
+            elif url.path == "/annotations/2/delete" and "manifestShortId" in query:
+                with store.lock:
+                    list_id_annotation = list(store.by_manifest.get(query["manifestShortId"][0], {}))
+                    n = sum(store.delete_annotation(i) for i in list_id_annotation)
+                self.send_json({ "deletedCount": n })
+            elif url.path == "/manifests/2/delete" and "uri" in query:
+                short_id = get_manifest_short_id(query["uri"][0])
+                with store.lock:
+                    n = 1 if store.manifests.pop(short_id, None) is not None else 0
+                    store.manifest_ids.pop(short_id, None)
+                self.send_json({ "deletedCount": n })
+            else:
+                self.send_error(404)
+
+    server = serve_in_thread(Handler, port)
+    print(f"null annotation server served at: http://127.0.0.1:{server.server_address[1]}")
+    return server
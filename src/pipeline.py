@@ -0,0 +1,218 @@
+"""
+producer/consumer pipeline to insert annotations (`--pipeline <producers>:<senders>`).
+
+in `mt_insert_annotations`, each thread generates an annotation list, serializes it and
+then waits for the server's response: generating and serializing payloads competes with
+the network for the same threads. in the pipeline, this is split in 2 stages, each with
+its own threads:
+1. producers generate annotation lists and serialize them with orjson, and put the bytes in a bounded buffer.
+2. senders take serialized payloads from the buffer and only send them.
+
+each stage measures its utilization (share of the time its threads spend working) and
+its wait (share of the time spent waiting on the buffer: producers wait when it's full,
+senders wait when it's empty). the stage that doesn't wait is the one that limits throughput.
+"""
+
+from queue import Queue, Empty, Full
+from threading import Lock, Event, Thread
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import orjson
+
+from src.generate import generate_annotation_list
+from src.multithread import ProgressReporter
+from src.constants import MULTITHREAD_POLL_INTERVAL, PIPELINE_BUFFER_PER_SENDER
+
+# returned by the shared iterator when all items were taken
+_END = object()
+
+
+def validate_pipeline(pipeline, server_is_aiiinotate: bool, autotune: bool = False) -> None:
+    if pipeline is None:
+        return
+    if (
+        not isinstance(pipeline, tuple)
+        or len(pipeline) != 2
+        or not all(isinstance(n, int) and n >= 1 for n in pipeline)
+    ):
+        raise ValueError(f"validate_pipeline: 'pipeline' must be None or a tuple of 2 integers >= 1 (producers, senders), got {pipeline}")
+    if not server_is_aiiinotate:
+        raise ValueError("validate_pipeline: 'pipeline' is only supported with aiiinotate: SAS has no bulk route, so serialized annotation lists would be decoded again before being sent")
+    if autotune:
+        raise ValueError("validate_pipeline: 'autotune' and 'pipeline' can't be used together: the pipeline's stages are sized manually")
+
+
+def stage_summary(timings: List[Tuple[float, float]], duration: float) -> Dict:
+    """
+    :param timings: (time spent working, time spent waiting on the buffer) of each thread of a stage
+    :returns: { "threads", "utilization": share of the time spent working, "wait": share of the time spent waiting }
+    """
+    capacity = len(timings) * duration
+    return {
+        "threads": len(timings),
+        "utilization": sum(t[0] for t in timings) / capacity if capacity > 0 else None,
+        "wait": sum(t[1] for t in timings) / capacity if capacity > 0 else None,
+    }
+
+
+def run_pipeline(
+    items: Iterable,
+    produce: Callable[[Any], Any],
+    send: Callable[[Any], bool],
+    producers: int,
+    senders: int,
+    pbar_desc: str,
+    total: int|None = None,
+) -> Tuple[int, int, List, Dict]:
+    """
+    :param items: input items (a list, or a generator), read lazily by the producers
+    :param produce: function that builds the payload of an item
+    :param send: function that sends a payload, and returns True on success
+    :param total: number of items, for the progress bar (by default, `len(items)`)
+    :returns:
+        - number of successes
+        - number of errors
+        - the items that were sent successfully
+        - { "producers": <stage summary>, "senders": <stage summary>, "buffer_size", "duration", "bottleneck" } (see `stage_summary`)
+    """
+    if total is None and hasattr(items, "__len__"):
+        total = len(items)  # pyright: ignore
+    buffer_size = senders * PIPELINE_BUFFER_PER_SENDER
+    buffer: Queue = Queue(maxsize=buffer_size)
+    iterator = iter(items)
+    iterator_lock = Lock()
+    produced = Event()  # set when all producers are done: nothing will be added to the buffer anymore
+    stop = Event()      # set when a thread failed: the others stop too
+    errors: List[BaseException] = []
+    results_lock = Lock()
+    timings_producers: List[Tuple[float, float]] = []
+    timings_senders: List[Tuple[float, float]] = []
+    results = { "success": 0, "error": 0, "items": [] }
+    reporter = ProgressReporter(pbar_desc, total)
+
+    def produce_loop() -> None:
+        busy = 0.
+        wait = 0.
+        try:
+            while not stop.is_set():
+                with iterator_lock:
+                    item = next(iterator, _END)
+                if item is _END:
+                    break
+                s = timer()
+                payload = produce(item)
+                busy += timer() - s
+                s = timer()
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, payload), timeout=MULTITHREAD_POLL_INTERVAL)
+                        break
+                    except Full:
+                        continue
+                wait += timer() - s
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            with results_lock:
+                timings_producers.append((busy, wait))
+
+    def send_loop() -> None:
+        busy = 0.
+        wait = 0.
+        success = 0
+        error = 0
+        sent = []
+        counter = reporter.counter()
+        try:
+            while not stop.is_set():
+                s = timer()
+                try:
+                    item, payload = buffer.get(timeout=MULTITHREAD_POLL_INTERVAL)
+                except Empty:
+                    wait += timer() - s
+                    if produced.is_set() and buffer.empty():
+                        break
+                    continue
+                wait += timer() - s
+                s = timer()
+                ok = send(payload)
+                busy += timer() - s
+                counter.add(ok)
+                if ok:
+                    success += 1
+                    sent.append(item)
+                else:
+                    error += 1
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            with results_lock:
+                timings_senders.append((busy, wait))
+                results["success"] += success
+                results["error"] += error
+                results["items"] += sent
+
+    start = timer()
+    with reporter:
+        threads_producers = [ Thread(target=produce_loop, daemon=True) for _ in range(producers) ]
+        threads_senders = [ Thread(target=send_loop, daemon=True) for _ in range(senders) ]
+        for t in threads_producers + threads_senders:
+            t.start()
+        for t in threads_producers:
+            t.join()
+        produced.set()
+        for t in threads_senders:
+            t.join()
+    duration = timer() - start
+    if len(errors):
+        raise errors[0]
+
+    summary_producers = stage_summary(timings_producers, duration)
+    summary_senders = stage_summary(timings_senders, duration)
+    stats = {
+        "producers": summary_producers,
+        "senders": summary_senders,
+        "buffer_size": buffer_size,
+        "duration": duration,
+        # producers wait on a full buffer when senders can't keep up, and senders wait on an empty buffer when producers can't keep up.
+        "bottleneck": "senders" if (summary_producers["wait"] or 0) > (summary_senders["wait"] or 0) else "producers",
+    }
+    print(f"SUCCESS: {results['success']}, ERROR: {results['error']}")
+    print(
+        f"pipeline: producers {summary_producers['utilization'] or 0:.0%} busy, "
+        f"senders {summary_senders['utilization'] or 0:.0%} busy => limited by the {stats['bottleneck']}"
+    )
+    return results["success"], results["error"], results["items"], stats
+
+
+def mt_insert_annotations_pipeline(
+    func: Callable[[bytes], int],
+    data: Iterable[str],
+    n_annotation: int,
+    producers: int,
+    senders: int,
+    pbar_desc: str,
+    total: int|None = None,
+) -> Tuple[List[str], Dict]:
+    """
+    same as `src.multithread.mt_insert_annotations`, with a producer/consumer pipeline.
+
+    :param func: function to insert a serialized annotation list (i.e., `AdapterCore.insert_annotation_list_bytes`). returns 1 on success
+    :param data: canvas IDs. `n_annotation` annotations are inserted on each canvas.
+    :returns:
+        - all the canvas IDs on which annotations were inserted
+        - the pipeline's stats (see `run_pipeline`)
+    """
+    _, _, list_id_canvas, stats = run_pipeline(
+        items=data,
+        produce=lambda id_canvas: orjson.dumps(generate_annotation_list(id_canvas, n_annotation)),
+        send=lambda body: func(body) == 1,
+        producers=producers,
+        senders=senders,
+        pbar_desc=pbar_desc,
+        total=total,
+    )
+    return list_id_canvas, stats
@@ -0,0 +1,206 @@
+"""
+self-profiling of the benchmark driver (the python client, not the annotation server).
+
+a sampling profiler takes a snapshot of the stacks of all threads every `interval`
+seconds while a phase (populate manifests, read, purge...) is running. this covers
+the worker threads of `src.multithread`, which a deterministic profiler like
+`cProfile` (that only profiles the thread that enabled it) would miss.
+
+for each phase, we save the sampled stacks in "folded" format (1 line per
+stack: `frame;frame;frame <count>`), which can be read by flamegraph tools
+(`flamegraph.pl`, speedscope...), and print a short breakdown of where
+the client's threads spent their time.
+"""
+
+import sys
+import time
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from src.utils import json_read, json_write
+from src.constants import PATH_OUT, PROFILE_CLIENT_INTERVAL
+
+# written by `run_aiiinotate.sh` when the server is started with profiling (`prof` or `clinic`)
+PATH_SERVER_PROFILE = PATH_OUT / "server_profile.json"
+
+# categories of frames, in order of precedence: the 1st category that matches a frame
+# of a stack (from the innermost frame to the outermost) is the category of the stack.
+# each category is defined by substrings of a frame's filename.
+CATEGORIES = [
+    ("tqdm", ["/tqdm/"]),
+    ("serialize", ["/json/", "orjson"]),
+    ("generate", ["/src/generate.py", "/uuid.py", "/random.py"]),
+    ("network", ["/socket.py", "/ssl.py", "/http/client.py", "/urllib3/", "/requests/"]),
+]
+
+# a thread is idle if its innermost frame is one of these functions: (substring of the filename, function names).
+# the waits themselves are in C and have no frame: a thread of a pool waiting for a task is in the pool's
+# loop, and a thread waiting on an `Event` or a `Queue` is in their python methods.
+IDLE_FRAMES = [
+    ("/threading.py", ["wait", "join", "_wait_for_tstate_lock"]),
+    ("/queue.py", ["get", "put"]),
+    ("/multiprocessing/pool.py", ["worker"]),
+    ("/concurrent/futures/thread.py", ["_worker"]),
+]
+
+
+def is_idle(frame) -> bool:
+    """:param frame: the innermost frame of a stack"""
+    filename = frame.f_code.co_filename
+    return any(p in filename and frame.f_code.co_name in names for p, names in IDLE_FRAMES)
+
+def categorize(frame) -> str:
+    """
+    find the category of a stack, starting from its innermost frame `frame`.
+    waiting on a `Lock` has no python frame of its own, so such waits can't be told apart
+    from the code that holds the lock, and are not a category.
+    """
+    if is_idle(frame):
+        return "idle"
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        for category, patterns in CATEGORIES:
+            if any(p in filename for p in patterns):
+                return category
+        frame = frame.f_back
+    return "other"
+
+def format_stack(frame) -> str:
+    """folded representation of a stack, from the outermost to the innermost frame"""
+    stack = []
+    while frame is not None:
+        stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler(threading.Thread):
+    """
+    a daemon thread sampling the stacks of all other threads every `interval` seconds.
+    """
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.n_samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                self.stacks[format_stack(frame)] += 1
+                self.categories[categorize(frame)] += 1
+                self.n_samples += 1
+        return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ClientProfiler:
+    def __init__(self, enabled: bool, interval: float = PROFILE_CLIENT_INTERVAL):
+        """
+        :param enabled: if False, `self.phase` does nothing.
+        :param interval: sampling interval, in seconds
+        """
+        self.enabled = enabled
+        self.interval = interval
+        self.dir: Optional[Path] = None  # where to write profiles. if None, profiles are only printed.
+        self.windows: List[Dict] = []  # summary of all profiled phases
+
+    def set_output_dir(self, dirpath: Path) -> None:
+        self.dir = dirpath
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        profile everything executed in the `with` block.
+
+        :param name: the name of the phase, used to name the profile file (i.e., `step1_trial1_read`).
+        """
+        if not self.enabled:
+            yield
+            return
+        sampler = StackSampler(self.interval)
+        start = time.time()
+        cpu_start = time.process_time()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            cpu = time.process_time() - cpu_start
+            end = time.time()
+            # idle threads (waiting for the pool or sleeping) don't use CPU: they are excluded from the breakdown.
+            n_samples_idle = sampler.categories.pop("idle", 0)
+            n_samples_active = sampler.n_samples - n_samples_idle
+            window = {
+                "phase": name,
+                "start": start,
+                "end": end,
+                "duration_wall": end - start,
+                "duration_cpu": cpu,
+                "n_samples": sampler.n_samples,
+                "n_samples_idle": n_samples_idle,
+                "categories": {
+                    k: v / n_samples_active for k, v in sampler.categories.most_common()
+                } if n_samples_active else {},
+            }
+            self.windows.append(window)
+            self.print_window(window)
+            self.write_folded(name, sampler.stacks)
+        return
+
+    def print_window(self, window: Dict) -> None:
+        cores = window["duration_cpu"] / window["duration_wall"] if window["duration_wall"] else 0
+        print(
+            f"\nCLIENT PROFILE '{window['phase']}': wall={window['duration_wall']:.2f}s, "
+            f"cpu={window['duration_cpu']:.2f}s ({cores:.2f} cores), samples={window['n_samples']} (idle={window['n_samples_idle']})"
+        )
+        # samples are snapshots of the stacks, whether threads use the CPU or wait on a socket:
+        # the breakdown is a share of the wall time of the non-idle threads, not of the CPU time.
+        print("    share of the wall time of non-idle threads:")
+        for category, share in window["categories"].items():
+            print(f"    {category:<10} {share:>6.1%}")
+        return
+
+    def write_folded(self, name: str, stacks: Counter) -> None:
+        if self.dir is None:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.dir / f"{name}.folded", mode="w") as fh:
+            for stack, count in stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+        return
+
+    def write_windows(self) -> None:
+        """
+        write the time windows of all profiled phases. if the server was started
+        with profiling (`bash run_aiiinotate.sh prof|clinic`), the windows are
+        also expressed relative to the server's start, to locate the same
+        windows in the server's profile.
+        """
+        if not self.enabled or self.dir is None:
+            return
+        server_profile = json_read(PATH_SERVER_PROFILE) if PATH_SERVER_PROFILE.exists() else None
+        windows = []
+        for w in self.windows:
+            w = w.copy()
+            if server_profile is not None:
+                w["start_server_offset"] = w["start"] - server_profile["started_at"]
+                w["end_server_offset"] = w["end"] - server_profile["started_at"]
+            windows.append(w)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        json_write(self.dir / "windows.json", {
+            "server_profile": server_profile,
+            "sampling_interval": self.interval,
+            "windows": windows
+        })
+        return
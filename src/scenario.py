@@ -0,0 +1,115 @@
+"""
+benchmark scenarios: declarative files that replace the default benchmark
+parameters of `src.constants` (steps, ratio, iterations, threads...).
+
+a scenario is a TOML or JSON file. all keys are optional: a missing key keeps
+its default value (or the value of the matching CLI option). see `SCENARIO_KEYS`
+and `scenarios/` for examples.
+"""
+
+import json
+import tomllib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from src.distributions import parse_distribution
+
+# phases of the benchmark phase, in the order in which they are run
+PHASES = [
+    "read",
+    "search",
+    "read_manifest",
+    "list_manifests",
+    "write",
+    "update",
+    "delete",
+    "delete_manifest_annotations",
+    "delete_manifest"
+]
+
+# phases that delete data created by the "write" phase
+PHASES_REQUIRING_WRITE = ["delete_manifest_annotations", "delete_manifest"]
+
+
+def _is_int(v: Any, min_: int = 1) -> bool:
+    # bool is a subclass of int
+    return isinstance(v, int) and not isinstance(v, bool) and v >= min_
+
+def _is_int_list(v: Any) -> bool:
+    return isinstance(v, list) and len(v) > 0 and all(_is_int(i) for i in v)
+
+def _is_steps(v: Any) -> bool:
+    return (
+        isinstance(v, list)
+        and len(v) > 0
+        and all(isinstance(s, list) and len(s) == 2 and _is_int(s[0]) and _is_int(s[1]) for s in v)
+    )
+
+def _is_ratio(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and 0 < v <= 1
+
+def _is_phases(v: Any) -> bool:
+    return isinstance(v, list) and len(v) > 0 and all(p in PHASES for p in v)
+
+def _is_distribution(v: Any) -> bool:
+    if not isinstance(v, str):
+        return False
+    try:
+        parse_distribution(v)
+    except ValueError:
+        return False
+    return True
+
+# { <key>: (<validation function>, <expected value, for error messages>) }
+SCENARIO_KEYS: Dict[str, Tuple[Callable[[Any], bool], str]] = {
+    "name": (lambda v: isinstance(v, str), "a string"),
+    "description": (lambda v: isinstance(v, str), "a string"),
+    "steps": (_is_steps, "a non-empty list of [n_manifest, n_canvas_per_manifest] integer pairs >= 1"),
+    "ratio": (_is_ratio, "a number in range 0..1"),
+    "n_annotation_per_canvas": (_is_int, "an integer >= 1"),
+    "n_iterations": (_is_int, "an integer >= 1"),
+    "n_iterations_collection": (_is_int, "an integer >= 1"),
+    "threads": (_is_int, "an integer >= 1"),
+    "trials": (_is_int, "an integer >= 1"),
+    "phases": (_is_phases, f"a non-empty list of phases in {PHASES}"),
+    "distribution": (_is_distribution, "'uniform', 'zipf:<s>' or 'hotspot:<x>:<y>'"),
+    "sweep": (_is_int_list, "a non-empty list of integers >= 1"),
+}
+
+
+def validate_scenario(scenario: Dict, name: str = "scenario") -> None:
+    """
+    :param name: name of the scenario, for error messages
+    """
+    unknown = [ k for k in scenario.keys() if k not in SCENARIO_KEYS ]
+    if len(unknown):
+        raise ValueError(f"validate_scenario: unknown keys in '{name}': {unknown}. allowed keys: {list(SCENARIO_KEYS.keys())}")
+    for k, v in scenario.items():
+        is_valid, expected = SCENARIO_KEYS[k]
+        if not is_valid(v):
+            raise ValueError(f"validate_scenario: '{k}' in '{name}' must be {expected}, got {v}")
+    phases: List[str] = scenario.get("phases", PHASES)
+    if "write" not in phases and any(p in phases for p in PHASES_REQUIRING_WRITE):
+        raise ValueError(f"validate_scenario: phases {PHASES_REQUIRING_WRITE} delete data created by the 'write' phase, so 'write' must be in 'phases' in '{name}'")
+    return
+
+
+def load_scenario(fp: str|Path) -> Dict:
+    """
+    load and validate a scenario file (`.toml` or `.json`).
+    """
+    fp = Path(fp)
+    if not fp.exists():
+        raise FileNotFoundError(f"load_scenario: scenario file not found: '{fp}'")
+    if fp.suffix == ".toml":
+        with open(fp, mode="rb") as fh:
+            scenario = tomllib.load(fh)
+    elif fp.suffix == ".json":
+        with open(fp, mode="rb") as fh:
+            scenario = json.load(fh)
+    else:
+        raise ValueError(f"load_scenario: scenario files must be '.toml' or '.json', got '{fp.name}'")
+    if not isinstance(scenario, dict):
+        raise ValueError(f"load_scenario: a scenario must be a mapping, got {type(scenario)} in '{fp.name}'")
+    validate_scenario(scenario, fp.name)
+    return scenario
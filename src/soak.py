@@ -0,0 +1,356 @@
+"""
+soak test: run a steady mixed workload against a populated database for a long
+time, to detect slow degradations (memory leaks, fragmentation...) that don't
+show up in step benchmarks.
+
+the workload is run by `concurrency` threads that loop over operations picked at
+random following `SOAK_MIX`. inserted annotations are deleted later on, so that the
+size of the database stays constant. every `window` seconds, the latency percentiles
+and throughput of the last window are computed, and the memory (RSS) of the annotation
+server and of `mongod` is read from `/proc` (only if they run on the same machine).
+at the end, upward trends in latency and memory (and downward trends in throughput)
+are detected with a Mann-Kendall test.
+"""
+
+import copy
+import time
+import random
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+from tqdm import tqdm
+
+from src.benchmark import Benchmark
+from src.utils import pprint, get_target_canvas
+from src.stats import LatencyHistogram, mann_kendall
+from src.generate import generate_annotations
+from src.constants import (
+    SOAK_DURATION_DEFAULT, SOAK_WINDOW_DEFAULT, SOAK_CONCURRENCY_DEFAULT, SOAK_MIX, SOAK_PROCESSES, COMPARE_ALPHA_DEFAULT
+)
+
+PATH_PROC = Path("/proc")
+
+
+def validate_soak(duration, window, concurrency, alpha) -> None:
+    for name, value in [("duration", duration), ("window", window)]:
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"validate_soak: '{name}' must be a number > 0, got {value}")
+    if window > duration:
+        raise ValueError(f"validate_soak: 'window' ({window}) must be <= 'duration' ({duration})")
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError(f"validate_soak: 'concurrency' must be an integer >= 1, got {concurrency}")
+    if not (0 < alpha < 1):
+        raise ValueError(f"validate_soak: 'alpha' must be in range 0..1, got {alpha}")
+
+
+def find_pids(name: str, cmdline_pattern: Optional[str] = None) -> List[int]:
+    """
+    pids of the processes named `name` whose command line contains `cmdline_pattern` (linux only)
+    """
+    pids = []
+    for proc in PATH_PROC.glob("[0-9]*"):
+        try:
+            if (proc / "comm").read_text().strip() != name:
+                continue
+            if cmdline_pattern is not None and cmdline_pattern not in (proc / "cmdline").read_text():
+                continue
+            pids.append(int(proc.name))
+        except (OSError, ValueError):
+            # the process exited while reading it
+            continue
+    return pids
+
+
+def read_rss(pids: List[int]) -> Optional[int]:
+    """total resident memory of `pids`, in bytes, or None if none of them could be read"""
+    total = None
+    for pid in pids:
+        try:
+            for line in (PATH_PROC / str(pid) / "status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total = (total or 0) + int(line.split()[1]) * 1024  # in kB
+                    break
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class WindowStats:
+    """
+    a sink of `src.metrics.Recorder` that aggregates the records of the current
+    window. records are assigned to the window that is open when they end.
+    """
+    def __init__(self, phase: str):
+        """
+        :param phase: only records of this phase are aggregated
+        """
+        self.phase = phase
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        """start a new window. the lock must be held by the caller."""
+        self._started_at = time.time()
+        self._ops: Dict[str, Dict] = {}
+
+    def __call__(self, record: Dict) -> None:
+        if record["phase"] != self.phase:
+            return
+        with self._lock:
+            if record["op"] not in self._ops:
+                self._ops[record["op"]] = { "n": 0, "n_error": 0, "n_timeout": 0, "histogram": LatencyHistogram() }
+            op = self._ops[record["op"]]
+            op["n"] += 1
+            op["n_error"] += 1 if record["outcome"] == "error" else 0
+            op["n_timeout"] += 1 if record["outcome"] == "timeout" else 0
+            if record["outcome"] == "success":
+                op["histogram"].add(record["latency"])
+
+    def close_window(self) -> Dict:
+        """
+        close the current window and start a new one.
+
+        :returns: { "duration", "throughput": requests per second, "ops": { <op>: {"n", "n_error", "n_timeout", "rate", "mean", "p50", "p95", "p99"} } }
+        """
+        with self._lock:
+            duration = time.time() - self._started_at
+            ops = self._ops
+            self._reset()
+        out = { "duration": duration, "throughput": sum(op["n"] for op in ops.values()) / duration, "ops": {} }
+        for name, op in sorted(ops.items()):
+            histogram = op["histogram"]
+            out["ops"][name] = {
+                "n": op["n"],
+                "n_error": op["n_error"],
+                "n_timeout": op["n_timeout"],
+                "rate": op["n"] / duration,
+                "mean": histogram.mean,
+                "p50": histogram.percentile(50),
+                "p95": histogram.percentile(95),
+                "p99": histogram.percentile(99),
+            }
+        return out
+
+
+def detect_trends(windows: List[Dict], alpha: float) -> List[Dict]:
+    """
+    test each time series of the soak test for a monotonic trend.
+    the first window is skipped: it includes the warmup of caches and connections.
+
+    :returns: a list of { "series", "n_window", "slope": change per window (in seconds or bytes), "p_value", "degradation": bool }
+    """
+    windows = windows[1:]
+    series: Dict[str, List[float]] = {}
+    for window in windows:
+        for op, data in window["ops"].items():
+            for key in ["p50", "p95"]:
+                if data[key] is not None:
+                    series.setdefault(f"latency_{key}.{op}", []).append(data[key])
+        series.setdefault("throughput", []).append(window["throughput"])
+        for process, rss in window["rss"].items():
+            if rss is not None:
+                series.setdefault(f"rss.{process}", []).append(rss)
+    out = []
+    for name, values in series.items():
+        test = mann_kendall(values)
+        if test is None:
+            continue
+        out.append({
+            "series": name,
+            "n_window": len(values),
+            "slope": test["slope"],
+            "p_value": test["p_value"],
+            # latency and memory degrade when they increase, throughput when it decreases
+            "degradation": test["p_value"] < alpha and (test["slope"] < 0 if name == "throughput" else test["slope"] > 0),
+        })
+    return out
+
+
+class Soak(Benchmark):
+    report_type = "soak"
+
+    def __init__(
+        self,
+        *args,
+        duration: float = SOAK_DURATION_DEFAULT,
+        window: float = SOAK_WINDOW_DEFAULT,
+        concurrency: int = SOAK_CONCURRENCY_DEFAULT,
+        alpha: float = COMPARE_ALPHA_DEFAULT,
+        **kwargs
+    ):
+        """
+        view `Benchmark` for the other arguments. the soak test runs on the last step (`n_steps`).
+
+        :param duration: duration of the soak test, in seconds (excluding the populate phase)
+        :param window: duration of a window, in seconds
+        :param concurrency: number of threads that send requests
+        :param alpha: significance level of the trend tests
+        """
+        validate_soak(duration, window, concurrency, alpha)
+        super().__init__(*args, **kwargs)
+        self.duration = duration
+        self.window = window
+        self.concurrency = concurrency
+        self.alpha = alpha
+        self.window_stats = WindowStats("soak")
+        self.recorder.sinks.append(self.window_stats)
+        self.report["soak"] = {
+            "duration": duration,
+            "window": window,
+            "concurrency": concurrency,
+            "mix": SOAK_MIX,
+            "alpha": alpha,
+        }
+
+    def read_process_rss(self) -> Dict[str, Optional[int]]:
+        """RSS of the annotation server and of mongod, or None for processes that aren't found on this machine"""
+        return {
+            process: read_rss(find_pids(*SOAK_PROCESSES[process]))
+            for process in [self.server_name, "mongod"]
+        }
+
+    def worker(
+        self,
+        stop: threading.Event,
+        list_id_canvas: List[str],
+        list_id_manifest: List[str],
+        list_annotation: List[Dict],
+        inserted: Deque[str],
+    ) -> None:
+        """send requests until `stop` is set"""
+        wrap = self.recorder.wrap
+        classify = self.key_distribution.classify
+        get_annotation_list = wrap("get_annotation_list", self.adapter.get_annotation_list, None, classify)
+        search = wrap("search", self.adapter.search, None, classify)
+        update_annotation = wrap("update_annotation", self.adapter.update_annotation, 0, self.classify_canvas)
+        insert_annotation = wrap("insert_annotation", self.adapter.insert_annotation, 0, self.classify_canvas)
+        delete_annotation = wrap("delete_annotation", self.adapter.delete_annotation, 0)
+        # there is nothing to update: leave updates out of the mix
+        mix = { op: w for op, w in SOAK_MIX.items() if op != "update_annotation" or len(list_annotation) }
+        ops, weights = zip(*mix.items())
+        while not stop.is_set():
+            op = random.choices(ops, weights)[0]
+            # there is nothing to delete yet: insert instead
+            if op == "delete_annotation" and not len(inserted):
+                op = "insert_annotation"
+            if op == "get_annotation_list":
+                get_annotation_list(self.key_distribution.sample(list_id_canvas, 1, replace=True)[0])
+            elif op == "search":
+                search(self.key_distribution.sample(list_id_manifest, 1, replace=True)[0])
+            elif op == "update_annotation":
+                annotation = self.key_distribution.sample(list_annotation, 1, get_target_canvas, replace=True)[0]
+                # annotations are shared by all threads: change a copy, not an annotation that another thread may be sending
+                annotation = copy.deepcopy(annotation)
+                r = sorted(random.sample(range(0,1000), 4))
+                annotation["on"][0]["selector"]["value"] = f"xywh={r[0]},{r[1]},{r[2]},{r[3]}"
+                update_annotation(annotation)
+            elif op == "insert_annotation":
+                id_canvas = self.key_distribution.sample(list_id_canvas, 1, replace=True)[0]
+                annotation = next(generate_annotations([ id_canvas ]))
+                if insert_annotation(annotation):
+                    inserted.append(annotation["@id"])
+            elif op == "delete_annotation":
+                try:
+                    # delete the oldest annotation inserted by the soak test
+                    delete_annotation(inserted.popleft())
+                except IndexError:
+                    # another thread deleted the last one
+                    continue
+        return
+
+    def soak(self, list_id_canvas: List[str], list_id_manifest: List[str]) -> List[Dict]:
+        """
+        run the workload for `self.duration` seconds.
+
+        :param list_id_canvas: canvases with annotations
+        :param list_id_manifest: manifests with annotations
+        :returns: the statistics of each window (see `WindowStats.close_window`), with the RSS of the server and mongod
+        """
+        # annotations to update are read once, before the soak test
+        list_annotation = self.get_annotations_for_canvases(self.sample_for_iteration(list_id_canvas), False)
+        inserted: Deque[str] = deque()
+        stop = threading.Event()
+        n_window = max(1, round(self.duration / self.window))
+        windows = []
+        threads = [
+            threading.Thread(
+                target=self.worker,
+                args=(stop, list_id_canvas, list_id_manifest, list_annotation, inserted),
+                name=f"soak-{i}",
+                daemon=True
+            )
+            for i in range(self.concurrency)
+        ]
+        start = time.time()
+        self.window_stats.close_window()  # discard records from before the soak test
+        for t in threads:
+            t.start()
+        try:
+            pbar = tqdm(range(n_window), desc=f"soak: {n_window} windows of {self.window:g}s (concurrency={self.concurrency})")
+            for idx in pbar:
+                time.sleep(max(0, start + (idx + 1) * self.window - time.time()))
+                window = { "index": idx + 1, "start": start + idx * self.window, **self.window_stats.close_window() }
+                window["rss"] = self.read_process_rss()
+                windows.append(window)
+                pbar.set_postfix({ "req/s": f"{window['throughput']:.1f}" })
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            # delete the annotations inserted by the soak test that are left
+            delete_annotation = self.recorder.wrap("delete_annotation", self.adapter.delete_annotation, 0)
+            while len(inserted):
+                delete_annotation(inserted.popleft())
+        return windows
+
+    def run(self):
+        print("Global soak parameters:")
+        pprint(self.report)
+        # the step of the soak test is the last step
+        idx_step = len(self.steps)
+        self.step_current = self.step_to_dict(idx_step, self.steps[-1])
+        report: Dict = { "step": self.step_current }
+        self.report["results"].append(report)
+        try:
+            d_populate_manifest, d_populate_annotation, list_id_canvas_full, list_id_canvas_annotations = self.populate()
+            report["timing_populate_manifest"] = d_populate_manifest
+            report["timing_populate_annotation"] = d_populate_annotation
+            list_id_manifest_annotated, _ = self.split_manifests(list_id_canvas_full, list_id_canvas_annotations)
+            with self.phase("soak"):
+                report["windows"] = self.soak(list_id_canvas_annotations, list_id_manifest_annotated)
+            report["trends"] = detect_trends(report["windows"], self.alpha)
+            for trend in report["trends"]:
+                if trend["degradation"]:
+                    print(f"WARNING: degradation detected: {trend['series']} changes by {trend['slope']:.6g} per window (p={trend['p_value']:.4f})")
+        finally:
+            with self.phase("purge"):
+                self.purge()
+            report["operations"] = self.operation_stats.summary()
+            self.step_current = {}
+            self.close()
+        return
+
+
+def soak_runner(
+    server: str,
+    endpoint: str,
+    n_steps: int,
+    duration: float = SOAK_DURATION_DEFAULT,
+    window: float = SOAK_WINDOW_DEFAULT,
+    concurrency: int = SOAK_CONCURRENCY_DEFAULT,
+    alpha: float = COMPARE_ALPHA_DEFAULT,
+    **kwargs
+) -> None:
+    """define a soak test and run it. view `Benchmark` for `kwargs`"""
+    Soak(
+        server=server,
+        endpoint=endpoint,
+        n_steps=n_steps,
+        duration=duration,
+        window=window,
+        concurrency=concurrency,
+        alpha=alpha,
+        **kwargs
+    ).run()
@@ -0,0 +1,256 @@
+"""
+statistics helpers to summarize repeated measurements (trials, latencies...).
+only the standard library is used, so that no heavy dependency is needed to build a report.
+"""
+
+import math
+import statistics
+from collections import Counter
+from typing import Dict, List, Optional
+
+
+def tukey_fences(values: List[float], k: float = 1.5) -> tuple[float, float] | None:
+    """
+    return the (low, high) Tukey fences of `values`, or None if there are too few values to compute quartiles.
+    a value outside of [q1 - k*iqr, q3 + k*iqr] is considered an outlier.
+    """
+    if len(values) < 4:
+        return None
+    q1, _, q3 = statistics.quantiles(values, n=4, method="inclusive")
+    iqr = q3 - q1
+    return q1 - k * iqr, q3 + k * iqr
+
+def find_outliers(values: List[float]) -> List[int]:
+    """
+    return the positions (starting at 1, like step and trial indexes) of the outliers in `values`.
+    """
+    fences = tukey_fences(values)
+    if fences is None:
+        return []
+    low, high = fences
+    return [ i+1 for i, v in enumerate(values) if v < low or v > high ]
+
+def describe(values: List[float]) -> Dict:
+    """
+    summarize a list of measurements.
+
+    :returns: {
+        "values": the raw values, in trial order
+        "mean": average value
+        "std": sample standard deviation, or None if there is a single value
+        "min", "max": extreme values
+        "outliers": positions of the outlier trials (starting at 1)
+    }
+    """
+    if not len(values):
+        raise ValueError("describe: can't describe an empty list of values")
+    std: Optional[float] = statistics.stdev(values) if len(values) > 1 else None
+    return {
+        "values": values,
+        "mean": statistics.fmean(values),
+        "std": std,
+        "min": min(values),
+        "max": max(values),
+        "outliers": find_outliers(values),
+    }
+
+def _betacf(a: float, b: float, x: float, max_iter: int = 200, eps: float = 3e-14) -> float:
+    """continued fraction used by `betainc` (Numerical Recipes, 6.4)"""
+    tiny = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = tiny if abs(d) < tiny else d
+    d = 1.0 / d
+    h = d
+    for m in range(1, max_iter+1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < eps:
+            break
+    return h
+
+def betainc(a: float, b: float, x: float) -> float:
+    """regularized incomplete beta function I_x(a, b)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    ln_front = (
+        math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+        + a * math.log(x) + b * math.log(1 - x)
+    )
+    front = math.exp(ln_front)
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1 - x) / b
+
+def student_t_sf_two_sided(t: float, df: float) -> float:
+    """two-sided p-value of a Student t statistic with `df` degrees of freedom"""
+    return betainc(df / 2, 0.5, df / (df + t * t))
+
+def welch_ttest(a: List[float], b: List[float]) -> Optional[Dict]:
+    """
+    Welch's unequal variances t-test between samples `a` and `b`.
+
+    :returns: {"test", "statistic", "df", "p_value"}, or None if the test can't be computed (less than 2 values in a sample)
+    """
+    if len(a) < 2 or len(b) < 2:
+        return None
+    var_a = statistics.variance(a) / len(a)
+    var_b = statistics.variance(b) / len(b)
+    diff = statistics.fmean(b) - statistics.fmean(a)
+    if var_a + var_b == 0:
+        # no variance at all: values are either identical or certainly different.
+        return { "test": "welch_t", "statistic": None, "df": None, "p_value": 1.0 if diff == 0 else 0.0 }
+    t = diff / math.sqrt(var_a + var_b)
+    df = (var_a + var_b) ** 2 / (
+        var_a ** 2 / (len(a) - 1) + var_b ** 2 / (len(b) - 1)
+    )
+    return { "test": "welch_t", "statistic": t, "df": df, "p_value": student_t_sf_two_sided(t, df) }
+
+class LatencyHistogram:
+    """
+    a streaming summary of latencies, with a constant memory footprint.
+    values are counted in log-spaced buckets, so that percentiles have a relative error below `precision`.
+    """
+    def __init__(self, precision: float = 0.01, min_value: float = 1e-6):
+        self.precision = precision
+        self.min_value = min_value
+        self._log_base = math.log1p(precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        idx = (
+            0 if value <= self.min_value
+            else int(math.log(value / self.min_value) / self._log_base) + 1
+        )
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for idx, n in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """approximate value of the `q`th percentile (`q` in 0..100)"""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for idx in sorted(self.buckets.keys()):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                # middle of the bucket, clamped to the values actually seen
+                value = (
+                    self.min_value if idx == 0
+                    else self.min_value * (1 + self.precision) ** (idx - 0.5)
+                )
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+def mann_whitney_u(a: List[float], b: List[float]) -> Optional[Dict]:
+    """
+    Mann-Whitney U test between samples `a` and `b`, using the normal
+    approximation (with tie correction). suited to latency distributions,
+    which are skewed and far from normal.
+
+    :returns: {"test", "statistic", "p_value"}, or None if a sample has less than 2 values
+    """
+    n_a, n_b = len(a), len(b)
+    if n_a < 2 or n_b < 2:
+        return None
+    # rank all values, giving tied values their average rank
+    values = sorted([ (v, 0) for v in a ] + [ (v, 1) for v in b ])
+    ranks = [0.0] * len(values)
+    tie_term = 0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j+1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j+1):
+            ranks[k] = (i + j) / 2 + 1
+        n_tied = j - i + 1
+        tie_term += n_tied ** 3 - n_tied
+        i = j + 1
+    rank_sum_a = sum(r for r, (_, group) in zip(ranks, values) if group == 0)
+    u_a = rank_sum_a - n_a * (n_a + 1) / 2
+    n = n_a + n_b
+    mu = n_a * n_b / 2
+    sigma = math.sqrt(n_a * n_b / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return { "test": "mann_whitney_u", "statistic": u_a, "p_value": 1.0 }
+    z = (u_a - mu) / sigma
+    return { "test": "mann_whitney_u", "statistic": u_a, "p_value": math.erfc(abs(z) / math.sqrt(2)) }
+
+def mann_kendall(values: List[float]) -> Optional[Dict]:
+    """
+    Mann-Kendall test for a monotonic trend in a time series, using the normal
+    approximation (with tie correction), and the Theil-Sen estimate of its slope.
+    unlike a linear regression, it is robust to outliers and doesn't assume that
+    the trend is linear.
+
+    :param values: measurements at regular intervals, in time order
+    :returns: {"test", "statistic", "p_value", "slope": median slope per interval}, or None if there are less than 4 values
+    """
+    n = len(values)
+    if n < 4:
+        return None
+    s = 0
+    slopes = []
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            diff = values[j] - values[i]
+            s += (diff > 0) - (diff < 0)
+            slopes.append(diff / (j - i))
+    tie_term = sum(c * (c - 1) * (2 * c + 5) for c in Counter(values).values())
+    variance = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+    slope = statistics.median(slopes)
+    if variance == 0:
+        return { "test": "mann_kendall", "statistic": s, "p_value": 1.0, "slope": slope }
+    # continuity correction
+    z = (s - (1 if s > 0 else -1 if s < 0 else 0)) / math.sqrt(variance)
+    return { "test": "mann_kendall", "statistic": s, "p_value": math.erfc(abs(z) / math.sqrt(2)), "slope": slope }
@@ -98,6 +98,10 @@ def get_manifest_short_id(iiif_uri:str) -> str:
         raise ValueError(f"could not extract a manifest short ID from '{iiif_uri}'")
     return id_short
 
+def get_target_canvas(annotation: Dict) -> str:
+    """@id of the canvas targeted by an annotation"""
+    return annotation["on"][0]["full"]
+
 def get_canvas_ids(manifest: Dict) -> List[Optional[str]]:
     return [ c["@id"] for c in manifest["sequences"][0]["canvases"] ]
 
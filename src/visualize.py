@@ -42,12 +42,28 @@ def get_x(report: dict, fancy: bool) -> list:
     ]
 
 
-def get_y(report: dict, key: str) -> list[float]:
+def get_y(report: dict, key: str) -> list[float|None]:
+    """values of `key` at each step. None if a step has no value (i.e., older reports, or all requests failed)"""
     return [
-        step[key] for step in report["results"]
+        step.get(key, None) for step in report["results"]
     ]
 
 
+def get_yerr(report: dict, key: str) -> list[float] | None:
+    """
+    standard deviation of `key` across trials at each step, or None if
+    the report doesn't hold several trials (reports made before trials
+    were implemented, or with `--trials 1`).
+    """
+    yerr = [
+        step.get("trials", {}).get(key, {}).get("std", None)
+        for step in report["results"]
+    ]
+    if all(e is None for e in yerr):
+        return None
+    return [ e if e is not None else 0 for e in yerr ]
+
+
 def init_fig(report: dict):
     font_size_title = 34
     font_size_axis = 30
@@ -85,21 +101,34 @@ def make_plot(report: dict, basename: str, annotations_only: bool, to_file: bool
     y_data = [
         ( "timing_read_annotation_list", "Read anno. list", ),
         ( "timing_read_annotation", "Read anno." ),
+        ( "timing_read_annotation_list_cold", "Read anno. list (cold cache)" ),
+        ( "timing_search_manifest_annotated", "Search manifest" ),
+        ( "timing_search_manifest_empty", "Search empty manifest" ),
         ( "timing_write_annotation_list", "Write anno. list" ),
         ( "timing_write_annotation", "Write anno." ),
         ( "timing_update_annotation", "Update anno." ),
-        ( "timing_delete_annotation", "Delete anno." )
+        ( "timing_delete_annotation", "Delete anno." ),
+        ( "timing_delete_manifest_annotations", "Delete all anno. on manifest" ),
     ]
     if not annotations_only:
         y_data.append(( "timing_write_manifest", "Write manifest" ))
+        y_data.append(( "timing_read_manifest", "Read manifest" ))
+        y_data.append(( "timing_list_manifest_collection", "List manifests" ))
+        y_data.append(( "timing_delete_manifest", "Delete manifest" ))
     y_data = [
-        ( get_y(report, el[0]), el[1] )
+        ( get_y(report, el[0]), get_yerr(report, el[0]), el[1] )
         for el in y_data
+        if any(y is not None for y in get_y(report, el[0]))
     ]
 
     fig, ax = init_fig(report)
     for el in y_data:
-        ax.plot(x, el[0], "-o", label=el[1])
+        # a timing is None at steps where all calls failed: NaN leaves a gap in the line
+        y = [ v if v is not None else float("nan") for v in el[0] ]
+        if el[1] is None:
+            ax.plot(x, y, "-o", label=el[2])
+        else:
+            ax.errorbar(x, y, yerr=el[1], fmt="-o", capsize=6, label=el[2])
 
     # style bbox. necessary to be here
     ax.legend(bbox_to_anchor=(1.23,1))